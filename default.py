@@ -30,6 +30,14 @@ _version = _addon.getAddonInfo("version")
 xbmc.log("[PLUGIN] %s: version %s initialized" % (_plugin, _version))
 
 if __name__ == "__main__":
-    from resources.lib import wakanim
-    # start addon
-    wakanim.main(sys.argv)
+    if _addon.getSetting("profiling") == "true":
+        from resources.lib import wakanim, profiler, model
+        # run in-process to profile the whole invocation
+        profiler.run(model.parse(sys.argv), wakanim.main, sys.argv)
+    else:
+        from resources.lib import rpc
+        # let the service answer if running
+        if not rpc.forward(sys.argv):
+            from resources.lib import wakanim
+            # start addon
+            wakanim.main(sys.argv)
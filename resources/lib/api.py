@@ -16,7 +16,12 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import re
+import time
+import socket
+import threading
 from cgi import parse_header
+from contextlib import contextmanager
 from bs4 import BeautifulSoup
 from time import timezone
 try:
@@ -24,17 +29,178 @@ try:
 except ImportError:
     from urllib.parse import urlencode, quote_plus
 try:
-    from urllib2 import urlopen, build_opener, HTTPCookieProcessor, install_opener
+    from urllib2 import build_opener, HTTPCookieProcessor, install_opener, HTTPError, URLError
+    from httplib import IncompleteRead
 except ImportError:
-    from urllib.request import urlopen, build_opener, HTTPCookieProcessor, install_opener
+    from urllib.request import build_opener, HTTPCookieProcessor, install_opener
+    from urllib.error import HTTPError, URLError
+    from http.client import IncompleteRead
 try:
     from cookielib import LWPCookieJar, Cookie
 except ImportError:
     from http.cookiejar import LWPCookieJar, Cookie
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
 
 import xbmc
 import xbmcgui
 
+from . import cassette
+from . import netcache
+
+# request priority classes
+INTERACTIVE = "interactive"  #: page the user is waiting for
+PLAYBACK    = "playback"     #: requests delaying the start of a video
+PROGRESS    = "progress"     #: playtime reports
+BACKGROUND  = "background"   #: prefetching, enrichment, exports
+
+#: parallel requests per priority class
+LIMITS = {INTERACTIVE: 4, PLAYBACK: 2, PROGRESS: 1, BACKGROUND: 2}
+#: requests per second to www.wakanim.tv
+RATE = 8.0
+#: pages showing the same content without login: catalogue, search and show pages
+PUBLIC = re.compile(r"^https://www\.wakanim\.tv/\w+/v2/catalogue(/?$|/search|/show/)")
+#: window property with the time until foreground requests of any invocation hold back background requests
+FOREGROUND_PROPERTY = "plugin.video.wakanim.foreground"
+#: window property with the earliest time of the next request of any invocation
+NEXT_PROPERTY = "plugin.video.wakanim.next"
+#: seconds a running foreground request of another invocation holds back background requests at most
+HOLD = 15
+#: window property with modification time and content of the cookie file
+COOKIES_PROPERTY = "plugin.video.wakanim.cookies"
+
+
+class Scheduler(object):
+    """Coordinates all requests to www.wakanim.tv
+    Every priority class has its own limit of parallel requests and all
+    classes share one rate limit. Background requests wait while a
+    foreground request is running or a video is playing.
+    Every click runs in a process of its own, so the rate limit and running
+    foreground requests are also shared with other invocations through
+    window properties. Properties are not updated atomically, rarely two
+    invocations take the same slot or miss a foreground request of the
+    other, the limits of parallel requests only hold per process.
+    """
+    def __init__(self):
+        self._slots      = dict((k, threading.BoundedSemaphore(v)) for k, v in LIMITS.items())
+        self._cond       = threading.Condition()
+        self._next       = 0.0  #: earliest time of the next request
+        self._foreground = 0    #: running interactive and playback requests
+        self._held       = None #: value of the foreground property set last
+        self._waited     = dict.fromkeys(LIMITS, 0.0)
+        self._count      = dict.fromkeys(LIMITS, 0)
+
+    def _shared(self, prop):
+        """Time stored in window property, 0 if unset
+        """
+        try:
+            return float(xbmcgui.Window(10000).getProperty(prop) or 0)
+        except ValueError:
+            return 0.0
+
+    def _idle(self):
+        """Wait until background requests may run
+        """
+        monitor = xbmc.Monitor()
+        with self._cond:
+            while self._foreground:
+                self._cond.wait(1)
+        # foreground requests of other invocations
+        while self._shared(FOREGROUND_PROPERTY) > time.time():
+            if monitor.waitForAbort(0.25):
+                return
+        while xbmc.Player().isPlaying():
+            if monitor.waitForAbort(5):
+                return
+
+    def _pace(self):
+        """Wait for the rate limit
+        """
+        with self._cond:
+            now = time.time()
+            slot = max(now, self._next, self._shared(NEXT_PROPERTY))
+            self._next = slot + 1.0 / RATE
+            xbmcgui.Window(10000).setProperty(NEXT_PROPERTY, "%.3f" % self._next)
+        if slot > now:
+            time.sleep(slot - now)
+
+    def _hold(self):
+        """Announce a running foreground request to other invocations
+        Returns the value of the property
+        """
+        hold = "%.3f" % max(self._shared(FOREGROUND_PROPERTY), time.time() + HOLD)
+        xbmcgui.Window(10000).setProperty(FOREGROUND_PROPERTY, hold)
+        return hold
+
+    def _release(self, hold):
+        """End the announcement unless another invocation renewed it
+        """
+        window = xbmcgui.Window(10000)
+        if window.getProperty(FOREGROUND_PROPERTY) == hold:
+            window.setProperty(FOREGROUND_PROPERTY, "%.3f" % time.time())
+
+    @contextmanager
+    def request(self, url, priority):
+        """Run the request to url in the block with priority
+        """
+        start = time.time()
+        foreground = priority in (INTERACTIVE, PLAYBACK)
+        if priority == BACKGROUND:
+            self._idle()
+        elif foreground:
+            with self._cond:
+                self._foreground += 1
+                self._held = self._hold()
+        try:
+            with self._slots[priority]:
+                if u"://www.wakanim.tv/" in url:
+                    self._pace()
+                waited = time.time() - start
+                with self._cond:
+                    self._waited[priority] += waited
+                    self._count[priority] += 1
+                if waited > 0.05:
+                    xbmc.log("[PLUGIN] Wakanim: %s request waited %.3fs" % (priority, waited), xbmc.LOGDEBUG)
+                yield
+        finally:
+            if foreground:
+                with self._cond:
+                    self._foreground -= 1
+                    if not self._foreground:
+                        self._release(self._held)
+                    self._cond.notify_all()
+
+    def stats(self):
+        """Requests and seconds waited per priority class
+        """
+        with self._cond:
+            return dict((k, (self._count[k], self._waited[k])) for k in LIMITS)
+
+
+#: scheduler of this process
+scheduler = Scheduler()
+#: network or cassette, see start()
+transport = cassette.Live()
+#: transport mode and origin of transport
+setup = ("live", "")
+
+
+def openUrl(url, data=None, headers=None):
+    """Open url with the transport of this process
+    """
+    return transport.open(url, data, headers)
+
+
+def request(url, data=None, priority=INTERACTIVE):
+    """Load url through the scheduler
+    Returns tuple of response and HTML
+    """
+    with scheduler.request(url, priority):
+        response = openUrl(url, data)
+        return response, getHTML(response)
+
 
 def start(args):
     """Login and session handler
@@ -43,7 +209,7 @@ def start(args):
     args._cj = LWPCookieJar()
 
     # lets urllib handle cookies
-    opener = build_opener(HTTPCookieProcessor(args._cj))
+    opener = build_opener(HTTPCookieProcessor(args._cj), netcache.HTTPSHandler())
     opener.addheaders = [("User-Agent",      "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/67.0.3396.62 Safari/537.36"),
                          ("Accept-Encoding", "identity"),
                          ("Accept-Charset",  "utf-8"),
@@ -51,54 +217,81 @@ def start(args):
     install_opener(opener)
 
     # load cookies
-    try:
-        args._cj.load(getCookiePath(args), ignore_discard=True)
-    except IOError:
-        # cookie file does not exist
-        pass
+    args._cookies = loadCookies(args)
 
     args._cj.set_cookie(Cookie(0, "timezoneoffset", str(timezone//60), None, False, "www.wakanim.tv", False, False, "/", True, False, None, False, None, None, {"HttpOnly": None}, False))
 
+    # record or replay requests or use a stand-in server, hidden settings for development
+    global transport, setup
+    mode = (args._addon.getSetting("transport") or "live", args._addon.getSetting("origin"))
+    if mode != setup:
+        setup = mode
+        transport = cassette.create(mode[0], getProfilePath(args, u"cassette.json"),
+                                    (args._addon.getSetting("wakanim_username"), args._addon.getSetting("wakanim_password")),
+                                    float(args._addon.getSetting("replay_latency") or 1),
+                                    mode[1] or None)
+        xbmc.log("[PLUGIN] %s: Transport %s %s" % (args._addonname, type(transport).__name__, mode[1] or "www.wakanim.tv"), xbmc.LOGNOTICE)
+
 
 def close(args):
     """Saves cookies and session
     """
     if args._cj:
-        args._cj.save(getCookiePath(args), ignore_discard=True)
+        saveCookies(args)
+    transport.save()
 
 
-def getPage(args, url, data=None):
+def getPage(args, url, data=None, login=None, priority=INTERACTIVE):
     """Load HTML and login if necessary
+    By default only private pages login, public pages are returned as is
+    so browsing does not wait for a login. With login=True a public page is
+    loaded with login too, e.g. for the watch progress on a show page. With
+    login=False the page is returned as is, e.g. for background tasks which
+    must not open dialogs.
+    The page itself tells if the session is valid, so the check can not
+    run before or beside its download. Only without any session cookie
+    the login is sent first, as the page could only be logged out.
+    Returns "" if the page could not be loaded, e.g. on server errors,
+    callers show their error item like after a failed login.
     """
+    try:
+        return _loadPage(args, url, data, login, priority)
+    except (HTTPError, URLError, IncompleteRead, socket.error) as e:
+        xbmc.log("[PLUGIN] %s: Failed to load '%s': %s" % (args._addonname, url, e), xbmc.LOGWARNING)
+        return ""
+
+
+def _loadPage(args, url, data, login, priority):
+    """Load page of getPage(), network errors are raised
+    """
+    if login is None:
+        login = not isPublic(url)
+
     # encode data
     if data:
         data = urlencode(data).encode("utf-8")
 
+    # without any session cookie the page would be loaded twice,
+    # replayed responses never set cookies and have their own logins
+    fresh = login and transport.cookies and not hasSession(args)
+    if fresh:
+        postLogin(args, url, "utf-8", priority)
+
     # get page
-    response = urlopen(url, data)
-    html = getHTML(response)
+    response, html = request(url, data, priority)
 
     # check if loggedin
-    if isLoggedin(html):
+    if isLoggedin(html) or not login:
+        if fresh:
+            # new session, cached personal data may belong to another login
+            invalidateAccount(args)
         return html
 
-    # get account informations
-    username = args._addon.getSetting("wakanim_username")
-    password = args._addon.getSetting("wakanim_password")
-
-    # build POST data
-    post_data = urlencode({"Username":   username,
-                           "Password":   password,
-                           "RememberMe": True,
-                           "login":      "Verbindung"})
-
     # POST to login page
-    response = urlopen("https://www.wakanim.tv/" + args._country + "/v2/account/login?ReturnUrl=" + quote_plus(url.replace("https://www.wakanim.tv", "")),
-                       post_data.encode(getCharset(response)))
+    postLogin(args, url, getCharset(response), priority)
 
     # get page again
-    response = urlopen(url, data)
-    html = getHTML(response)
+    response, html = request(url, data, priority)
 
     # 2FA required
     if u"/v2/client/authorizewebclient" in html:
@@ -109,9 +302,8 @@ def getPage(args, url, data=None):
         # request 2FA email
         post_data = urlencode({"__RequestVerificationToken": RequestVerificationToken,
                                "method":                     "Email"})
-        response = urlopen("https://www.wakanim.tv/" + args._country + "/v2/client/generatetokenwebclient",
-                           post_data.encode(getCharset(response)))
-        getHTML(response)
+        request("https://www.wakanim.tv/" + args._country + "/v2/client/generatetokenwebclient",
+                post_data.encode(getCharset(response)), priority)
 
         # nuke session cookies and inform user
         xbmcgui.Dialog().ok(args._addonname, args._addon.getLocalizedString(30047))
@@ -120,9 +312,12 @@ def getPage(args, url, data=None):
         except WindowsError:
             pass
         args._cj = None
+        invalidateAccount(args)
         return ""
 
     if isLoggedin(html):
+        # new session, cached personal data may belong to another login
+        invalidateAccount(args)
         return html
     else:
         xbmc.log("[PLUGIN] %s: Login failed" % args._addonname, xbmc.LOGERROR)
@@ -130,12 +325,120 @@ def getPage(args, url, data=None):
         return ""
 
 
+def postLogin(args, url, charset, priority=INTERACTIVE):
+    """Send account informations to the login page
+    """
+    # get account informations
+    username = args._addon.getSetting("wakanim_username")
+    password = args._addon.getSetting("wakanim_password")
+
+    # build POST data
+    post_data = urlencode({"Username":   username,
+                           "Password":   password,
+                           "RememberMe": True,
+                           "login":      "Verbindung"})
+
+    request("https://www.wakanim.tv/" + args._country + "/v2/account/login?ReturnUrl=" + quote_plus(url.replace("https://www.wakanim.tv", "")),
+            post_data.encode(charset), priority)
+
+
+def hasSession(args):
+    """Check if the cookie jar holds any cookie of Wakanim
+    Without one the user is certainly not logged in.
+    """
+    if args._cj is None:
+        return False
+    return any(c.name != "timezoneoffset" and transport.domain in c.domain and not c.is_expired() for c in args._cj)
+
+
+def invalidateAccount(args):
+    """Drop cached data depending on the account
+    """
+    # cache imports this module
+    from . import cache
+    cache.invalidate(args, ["account"])
+
+
+def getConditional(args, url, validators, priority=BACKGROUND):
+    """Load HTML only if it has changed
+    Parameters:
+      validators: dict with ETag and Last-Modified of the last response
+    Returns tuple of HTML, None if unchanged, and the new validators
+    """
+    headers = {}
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("modified"):
+        headers["If-Modified-Since"] = validators["modified"]
+
+    try:
+        with scheduler.request(url, priority):
+            response = openUrl(url, None, headers)
+            html = getHTML(response)
+    except HTTPError as e:
+        if e.code == 304:
+            return None, validators
+        raise
+    return html, {"etag":     response.headers.get("ETag"),
+                  "modified": response.headers.get("Last-Modified")}
+
+
+def isPublic(url):
+    """Check if page can be loaded without login
+    """
+    return PUBLIC.match(url) is not None
+
+
 def isLoggedin(html):
     """Check if user logged in
     """
     return u"header-main_user_name" in html
 
 
+def loadCookies(args):
+    """Load cookie file into the cookie jar
+    The content is kept in a window property with the modification time of
+    the file, as long as the file is unchanged it is not read again.
+    Returns the loaded content, "" if there is no cookie file
+    """
+    path = getCookiePath(args)
+    window = xbmcgui.Window(10000)
+    try:
+        mtime = "%.6f" % os.path.getmtime(path)
+    except OSError:
+        # cookie file does not exist
+        window.clearProperty(COOKIES_PROPERTY)
+        return ""
+    hot = window.getProperty(COOKIES_PROPERTY)
+    if hot.startswith(mtime + "\n"):
+        content = hot[len(mtime) + 1:]
+    else:
+        try:
+            with open(path, "r") as f:
+                content = f.read()
+        except IOError:
+            return ""
+        window.setProperty(COOKIES_PROPERTY, mtime + "\n" + content)
+    try:
+        # LWPCookieJar only reads files, load() opens them the same way
+        args._cj._really_load(StringIO(content), path, True, False)
+    except (IOError, ValueError) as e:
+        xbmc.log("[PLUGIN] %s: Failed to load cookies: %s" % (args._addonname, e), xbmc.LOGERROR)
+    return content
+
+
+def saveCookies(args):
+    """Write cookie jar to the cookie file if cookies have changed
+    """
+    path = getCookiePath(args)
+    content = "#LWP-Cookies-2.0\n" + args._cj.as_lwp_str(ignore_discard=True)
+    if content == args._cookies:
+        return
+    args._cj.save(path, ignore_discard=True)
+    args._cookies = content
+    xbmcgui.Window(10000).setProperty(COOKIES_PROPERTY, "%.6f\n%s" % (os.path.getmtime(path), content))
+
+
 def getCookies(args):
     """Returns all cookies as string and urlencoded
     """
@@ -149,11 +452,22 @@ def getCookies(args):
 def getCookiePath(args):
     """Get cookie file path
     """
+    return getProfilePath(args, u"cookies.lwp")
+
+
+def getProfilePath(args, filename):
+    """Get path of a file in the addon profile folder
+    """
     profile_path = xbmc.translatePath(args._addon.getAddonInfo("profile"))
     if args.PY2:
-        return os.path.join(profile_path.decode("utf-8"), u"cookies.lwp")
-    else:
-        return os.path.join(profile_path, "cookies.lwp")
+        profile_path = profile_path.decode("utf-8")
+    if not os.path.isdir(profile_path):
+        try:
+            os.makedirs(profile_path)
+        except OSError:
+            # created in the meantime
+            pass
+    return os.path.join(profile_path, filename)
 
 
 def getCharset(response):
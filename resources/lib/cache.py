@@ -0,0 +1,393 @@
+# -*- coding: utf-8 -*-
+# Wakanim - Watch videos from the german anime platform Wakanim.tv on Kodi.
+# Copyright (C) 2017 MrKrabat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+
+import xbmc
+import xbmcgui
+
+from .api import getProfilePath
+
+
+#: cache files already read by this process, path -> [mtime, data]
+_loaded = {}
+#: guards all cache data of this process
+_lock = threading.RLock()
+#: caches with tagged entries
+TAGGED = ("extract", "prefetch", "resolved", "regions", "facets")
+
+#: caches with entries kept in the hot tier
+HOT = ("extract", "prefetch", "prefetch_history", "episodes", "facets")
+#: format of hot entries, change if cache values change
+HOT_VERSION = 2
+#: bytes of all hot entries
+HOT_SIZE = 512 * 1024
+#: bytes of the largest hot entry
+HOT_ENTRY = 64 * 1024
+#: window properties holding hot entries
+HOT_SLOTS = 128
+#: bytes of all hot entries left by eviction, so the next writes do not evict again
+HOT_LOW = HOT_SIZE * 3 // 4
+
+# id of show or episode page url
+_page = re.compile(r"/catalogue/(show|episode)/(\d+)")
+# window property names of the hot tier
+_hot = "plugin.video.wakanim.hot."
+# window property with the bytes of all hot entries
+_total = "plugin.video.wakanim.hot.total"
+# window property names of counters
+_counters = "plugin.video.wakanim.counters."
+
+
+class Hot(object):
+    """Recently used cache entries in window properties of Kodi
+    Window properties live as long as Kodi, so the next invocation reads
+    them without touching the disk. Every key has a fixed slot among
+    HOT_SLOTS properties, which holds the key hash and the entry, a second
+    property of the slot holds key hash, size and time of the last use.
+    Plugin invocations and the service write at the same time, so there is
+    no shared index which could lose updates. A running total of all sizes
+    is only an estimate, once it exceeds HOT_SIZE eviction scans all slots,
+    drops least recently used entries down to HOT_LOW and stores the exact
+    total. A key replaces another one of the same slot.
+    Key hashes contain HOT_VERSION and the addon version, entries of
+    another version never match and are evicted as oldest. Caches write
+    through, so the tier is never older than the cache files. The cookies
+    of the session have a property of their own, see api.loadCookies().
+    """
+    def __init__(self, args, name):
+        self._window  = xbmcgui.Window(10000)
+        self._version = "%d-%s" % (HOT_VERSION, args._addon.getAddonInfo("version"))
+        self._name    = name
+
+    def _slot(self, key):
+        """Key hash and property of the slot of key
+        """
+        digest = hashlib.sha1((self._version + self._name + "\n" + key).encode("utf-8")).hexdigest()
+        return digest[:20], _hot + str(int(digest[20:28], 16) % HOT_SLOTS)
+
+    def _use(self, prop, digest, size):
+        self._window.setProperty(prop + ".used", "%s %d %.3f" % (digest, size, time.time()))
+
+    def _size(self, prop):
+        """Bytes of the entry in slot, 0 if empty
+        """
+        meta = self._window.getProperty(prop + ".used").split()
+        return int(meta[1]) if len(meta) == 3 else 0
+
+    def _add(self, size):
+        """Add size to the total, returns the new total
+        """
+        try:
+            total = int(self._window.getProperty(_total) or 0) + size
+        except ValueError:
+            total = HOT_SIZE + 1
+        self._window.setProperty(_total, str(max(total, 0)))
+        return total
+
+    def _clear(self, prop, digest=None):
+        """Empty slot, only if it holds digest if given
+        """
+        if digest is None or self._window.getProperty(prop).startswith(digest + "\n"):
+            self._add(-self._size(prop))
+            self._window.clearProperty(prop)
+            self._window.clearProperty(prop + ".used")
+
+    def _evict(self):
+        """Drop least recently used entries above HOT_LOW
+        """
+        used = []
+        for i in range(HOT_SLOTS):
+            meta = self._window.getProperty(_hot + "%d.used" % i).split()
+            if len(meta) == 3:
+                used.append((float(meta[2]), int(meta[1]), _hot + str(i)))
+        total = sum(size for _, size, _ in used)
+        for _, size, prop in sorted(used):
+            if total <= HOT_LOW:
+                break
+            self._window.clearProperty(prop)
+            self._window.clearProperty(prop + ".used")
+            total -= size
+        self._window.setProperty(_total, str(total))
+
+    def get(self, key):
+        """Cache entry of key, None if not in the tier
+        """
+        digest, prop = self._slot(key)
+        raw = self._window.getProperty(prop)
+        if not raw.startswith(digest + "\n"):
+            return None
+        self._use(prop, digest, len(raw))
+        return json.loads(raw[len(digest) + 1:])
+
+    def set(self, key, entry):
+        """Store cache entry of key, drop least recently used entries
+        """
+        digest, prop = self._slot(key)
+        raw = digest + "\n" + json.dumps(entry, separators=(",", ":"))
+        if len(raw) > HOT_ENTRY:
+            # an older entry of key must not stay
+            self._clear(prop, digest)
+            return
+        grown = len(raw) - self._size(prop)
+        self._window.setProperty(prop, raw)
+        self._use(prop, digest, len(raw))
+        if grown and self._add(grown) > HOT_SIZE:
+            self._evict()
+
+    def delete(self, keys):
+        """Drop entries of keys
+        """
+        for key in keys:
+            digest, prop = self._slot(key)
+            self._clear(prop, digest)
+
+
+def _add(a, b):
+    """Sum of counters, numbers or lists or dicts of numbers
+    """
+    if isinstance(b, dict):
+        a = dict(a or {})
+        for k, v in b.items():
+            a[k] = _add(a.get(k), v)
+        return a
+    if isinstance(b, list):
+        return [x + y for x, y in zip(a or [0] * len(b), b)]
+    return (a or 0) + b
+
+
+class Counters(object):
+    """Counters of a cache added up in a window property
+    Counting on every click must not write the cache file, so counts are
+    kept in a window property until flush() adds them to the cache, when
+    it is written anyway. Counts of invocations running at the same time
+    may rarely get lost.
+    """
+    def __init__(self, args, name):
+        self._window = xbmcgui.Window(10000)
+        self._prop   = _counters + name
+
+    def pending(self):
+        """Counts not yet added to the cache, by key
+        """
+        try:
+            return json.loads(self._window.getProperty(self._prop) or "{}")
+        except ValueError:
+            return {}
+
+    def add(self, key, value):
+        """Count value for key, a number or list or dict of numbers
+        Returns the pending counts
+        """
+        pending = _add(self.pending(), {key: value})
+        self._window.setProperty(self._prop, json.dumps(pending, separators=(",", ":")))
+        return pending
+
+    def get(self, cache, key, default=None):
+        """Value of key in cache with the pending counts
+        """
+        value = self.pending().get(key)
+        stored = cache.get(key, default)
+        return stored if value is None else _add(stored, value)
+
+    def flush(self, cache):
+        """Add pending counts to cache, which has to be saved by the caller
+        """
+        pending = self.pending()
+        self._window.clearProperty(self._prop)
+        for key, value in pending.items():
+            cache.set(key, _add(cache.get(key), value))
+
+
+class Cache(object):
+    """Persistent key/value store in the addon profile
+    The JSON file is read on first access and only written by save() if
+    something has changed. Access is thread safe. Long running processes
+    like the service share the data of a file until it is changed on disk.
+    """
+    def __init__(self, args, name):
+        self._args  = args
+        self._path  = getProfilePath(args, name + u".json")
+        self._lock  = _lock
+        self._data  = None
+        self._dirty = False
+        self._hot   = Hot(args, name) if name in HOT else None
+
+    def _load(self):
+        """Read cache file
+        """
+        if self._data is not None:
+            return
+        try:
+            mtime = os.path.getmtime(self._path)
+        except OSError:
+            mtime = None
+        loaded = _loaded.get(self._path)
+        if loaded and loaded[0] == mtime:
+            self._data = loaded[1]
+            return
+        try:
+            with open(self._path, "r") as f:
+                self._data = json.load(f)
+        except (IOError, OSError, ValueError):
+            # cache file does not exist or is broken
+            self._data = {}
+        _loaded[self._path] = [mtime, self._data]
+
+    def _entry(self, key):
+        """Entry of key from the hot tier or the file
+        Entries read from the file are added to the hot tier until the
+        file is loaded anyway, missing keys as empty entry so looking them
+        up again does not read the file either.
+        """
+        if self._hot and self._data is None:
+            entry = self._hot.get(key)
+            if entry is None:
+                with self._lock:
+                    self._load()
+                    entry = self._data.get(key)
+                self._hot.set(key, entry or [])
+            return entry or None
+        with self._lock:
+            self._load()
+            return self._data.get(key)
+
+    def get(self, key, default=None, maxage=None):
+        """Get value of key
+        Entries older than maxage seconds are ignored.
+        """
+        entry = self._entry(key)
+        if entry is None:
+            return default
+        if maxage is not None and time.time() - entry[0] > maxage:
+            return default
+        return entry[1]
+
+    def age(self, key):
+        """Seconds since key has been set, None if unknown
+        """
+        entry = self._entry(key)
+        return None if entry is None else time.time() - entry[0]
+
+    def set(self, key, value, tags=None):
+        """Set value of key
+        Tags like 'show:123' or 'account' name the data the value depends
+        on, see invalidate().
+        """
+        with self._lock:
+            self._load()
+            self._data[key] = [time.time(), value, sorted(set(tags))] if tags else [time.time(), value]
+            self._dirty = True
+            if self._hot:
+                self._hot.set(key, self._data[key])
+
+    def touch(self, key):
+        """Mark value of key as current, e.g. after it has been confirmed
+        Value and tags are kept, only age() starts again.
+        """
+        with self._lock:
+            self._load()
+            entry = self._data.get(key)
+            if entry is None:
+                return
+            self._data[key] = [time.time()] + entry[1:]
+            self._dirty = True
+            if self._hot:
+                self._hot.set(key, self._data[key])
+
+    def invalidate(self, tags):
+        """Remove entries with any of tags
+        Returns number of removed entries
+        """
+        tags = set(tags)
+        with self._lock:
+            self._load()
+            keys = [k for k, entry in self._data.items() if len(entry) > 2 and tags.intersection(entry[2])]
+            for key in keys:
+                del self._data[key]
+            self._dirty = self._dirty or bool(keys)
+            if self._hot:
+                self._hot.delete(keys)
+        return len(keys)
+
+    def delete(self, key):
+        """Remove key
+        """
+        with self._lock:
+            self._load()
+            if self._data.pop(key, None) is not None:
+                self._dirty = True
+            if self._hot:
+                self._hot.delete([key])
+
+    def keys(self):
+        """List of all keys
+        """
+        with self._lock:
+            self._load()
+            return list(self._data.keys())
+
+    def __contains__(self, key):
+        with self._lock:
+            self._load()
+            return key in self._data
+
+    def save(self):
+        """Write cache file if modified
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            # invocations saving at the same time must not share the file
+            tmp = u"%s.%d-%d.tmp" % (self._path, os.getpid(), threading.current_thread().ident)
+            try:
+                with open(tmp, "w") as f:
+                    json.dump(self._data, f, separators=(",", ":"))
+                try:
+                    # atomic, readers never see a missing file
+                    os.rename(tmp, self._path)
+                except OSError:
+                    # Windows does not replace existing files
+                    os.remove(self._path)
+                    os.rename(tmp, self._path)
+                _loaded[self._path] = [os.path.getmtime(self._path), self._data]
+                self._dirty = False
+            except (IOError, OSError) as e:
+                xbmc.log("[PLUGIN] %s: Failed to save cache '%s': %s" % (self._args._addonname, self._path, e), xbmc.LOGERROR)
+
+
+def pageTags(urls):
+    """Tags of show and episode page urls, e.g. 'show:123' and 'episode:456'
+    """
+    return sorted(set("%s:%s" % m.groups() for m in (_page.search(url) for url in urls) if m))
+
+
+def invalidate(args, tags):
+    """Remove entries with any of tags from all tagged caches
+    Called on events changing data on Wakanim, e.g. a watched episode.
+    """
+    removed = 0
+    for name in TAGGED:
+        c = Cache(args, name)
+        removed += c.invalidate(tags)
+        c.save()
+    xbmc.log("[PLUGIN] %s: Invalidated %d cache entries of %s" % (args._addonname, removed, ", ".join(tags)), xbmc.LOGDEBUG)
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+# Wakanim - Watch videos from the german anime platform Wakanim.tv on Kodi.
+# Copyright (C) 2017 MrKrabat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import json
+import time
+import base64
+import threading
+try:
+    from urllib import urlencode
+    from urlparse import parse_qsl
+    from urllib2 import urlopen, Request, URLError, HTTPError
+except ImportError:
+    from urllib.parse import urlencode, parse_qsl
+    from urllib.request import urlopen, Request
+    from urllib.error import URLError, HTTPError
+
+
+#: response headers kept in cassettes
+HEADERS = ("Content-Type", "ETag", "Last-Modified", "Location")
+#: form fields replaced in recorded requests
+SECRET_FIELDS = ("Username", "Password", "__RequestVerificationToken")
+#: replacement of secrets
+SCRUBBED = "***"
+#: site served by a stand-in origin
+SITE = "https://www.wakanim.tv"
+
+
+class Response(object):
+    """Recorded response, used like the result of urlopen()
+    """
+    def __init__(self, url, status, headers, body):
+        self.url     = url
+        self.status  = status
+        self.headers = headers
+        self._body   = body
+
+    def read(self, size=-1):
+        body = self._body if size < 0 else self._body[:size]
+        self._body = self._body[len(body):]
+        return body
+
+    def getcode(self):
+        return self.status
+
+    def info(self):
+        return self.headers
+
+    def geturl(self):
+        return self.url
+
+
+def scrub(data):
+    """Request body without credentials
+    """
+    if not data:
+        return ""
+    text = data.decode("utf-8", "replace")
+    if text[:1] in "{[":
+        # JSON, e.g. playtime reports
+        return text
+    return urlencode([(k, SCRUBBED if k in SECRET_FIELDS else v) for k, v in parse_qsl(text, True)])
+
+
+def key(url, data):
+    """Key of a request in the cassette
+    """
+    return "%s %s %s" % ("POST" if data else "GET", url, scrub(data))
+
+
+class Live(object):
+    """Requests to the network
+    With origin, e.g. http://127.0.0.1:8080 of tools/standin.py, requests
+    to Wakanim are sent to this stand-in server instead.
+    """
+    #: responses set the session cookies
+    cookies = True
+
+    def __init__(self, origin=None):
+        self._origin = origin.rstrip("/") if origin else None
+
+    @property
+    def domain(self):
+        """Domain of the session cookies
+        """
+        return self._origin.split("://", 1)[-1].split(":")[0] if self._origin else "wakanim.tv"
+
+    def open(self, url, data=None, headers=None):
+        if self._origin and url.startswith(SITE):
+            url = self._origin + url[len(SITE):]
+        return urlopen(Request(url, data, headers or {}))
+
+    def save(self):
+        pass
+
+
+class Recorder(Live):
+    """Requests to the network, all responses are recorded
+    Request bodies are scrubbed of credentials, response bodies of the
+    given secrets, e.g. the user name. Cookies are never recorded.
+    """
+    def __init__(self, path, secrets=(), origin=None):
+        Live.__init__(self, origin)
+        self._path    = path
+        self._secrets = [s.encode("utf-8") for s in secrets if s]
+        self._lock    = threading.Lock()
+        self._records = []
+
+    def open(self, url, data=None, headers=None):
+        start = time.time()
+        error = None
+        try:
+            response = Live.open(self, url, data, headers)
+            status = response.getcode() or 200
+        except HTTPError as e:
+            response = error = e
+            status = e.code
+        info = response.info()
+        body = response.read()
+        latency = time.time() - start
+        result = Response(url, status, dict((k, info.get(k)) for k in HEADERS if info.get(k)), body)
+
+        for secret in self._secrets:
+            body = body.replace(secret, SCRUBBED.encode("utf-8"))
+        try:
+            recorded = {"body": body.decode("utf-8")}
+        except UnicodeDecodeError:
+            recorded = {"base64": base64.b64encode(body).decode("ascii")}
+        recorded.update({"request": key(url, data), "status": status, "headers": result.headers, "latency": latency})
+        with self._lock:
+            self._records.append(recorded)
+
+        if error:
+            raise error
+        return result
+
+    def save(self):
+        """Append recorded responses to the cassette file
+        """
+        with self._lock:
+            records, self._records = self._records, []
+        if not records:
+            return
+        try:
+            with open(self._path, "r") as f:
+                records = json.load(f) + records
+        except (IOError, OSError, ValueError):
+            pass
+        with open(self._path, "w") as f:
+            json.dump(records, f, indent=1)
+
+
+class Replayer(Live):
+    """Responses from a cassette instead of the network
+    Requests recorded several times get their responses in recorded order,
+    the last one is repeated. The recorded latency is multiplied by scale.
+    """
+    cookies = False
+
+    def __init__(self, path, scale=1.0):
+        Live.__init__(self)
+        self._scale   = scale
+        self._lock    = threading.Lock()
+        self._next    = {}
+        self._entries = {}
+        with open(path, "r") as f:
+            for record in json.load(f):
+                self._entries.setdefault(record["request"], []).append(record)
+
+    def open(self, url, data=None, headers=None):
+        k = key(url, data)
+        with self._lock:
+            entries = self._entries.get(k)
+            if not entries:
+                raise URLError("not in cassette: %s" % k)
+            i = self._next.get(k, 0)
+            self._next[k] = i + 1
+        record = entries[min(i, len(entries) - 1)]
+        if self._scale:
+            time.sleep(record["latency"] * self._scale)
+
+        if "base64" in record:
+            body = base64.b64decode(record["base64"])
+        else:
+            body = record["body"].encode("utf-8")
+        if record["status"] >= 300:
+            raise HTTPError(url, record["status"], "replayed", record["headers"], None)
+        return Response(url, record["status"], record["headers"], body)
+
+
+def create(mode, path, secrets=(), scale=1.0, origin=None):
+    """Transport of mode 'live', 'record' or 'replay'
+    """
+    if mode == "record":
+        return Recorder(path, secrets, origin)
+    if mode == "replay" and os.path.isfile(path):
+        return Replayer(path, scale)
+    return Live(origin)
@@ -15,16 +15,8 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import re
-import ssl
 import time
-import json
-from bs4 import BeautifulSoup
-try:
-    from urllib2 import urlopen, Request, URLError
-except ImportError:
-    from urllib.request import urlopen, Request
-    from urllib.error import URLError
+import threading
 
 import xbmc
 import xbmcgui
@@ -32,7 +24,31 @@ import xbmcplugin
 
 from . import api
 from . import view
-from .streamparams import getStreamParams
+from . import pool
+from . import cache
+from . import proxy
+from . import memo
+from . import facets
+from . import extract
+from . import prefetch
+from . import episodepage
+from .player import PlaybackMonitor
+from .streamparams import getStreamParams, checkInputstream
+
+
+#: listings available as widgets: path, marker and spec
+WIDGETS = {"last_episodes": ("/v2", u"js-slider-lastEp", extract.LAST_EPISODES),
+           "watchlist":     ("/v2/watchlist", u"<section", extract.WATCHLIST)}
+#: widget data older than this many seconds is refreshed
+WIDGET_MAXAGE = 900
+#: window property with stream type of the last playback
+STREAM_PROPERTY = "plugin.video.wakanim.stream"
+#: window property with show url of the listing refreshed after enrichment
+ENRICHED_PROPERTY = "plugin.video.wakanim.enriched"
+#: playback timings kept
+TIMINGS = 50
+#: seconds after which an episode page without details is fetched again
+EMPTY_MAXAGE = 3600
 
 
 def showCatalog(args):
@@ -40,39 +56,13 @@ def showCatalog(args):
     """
     # get website
     html = api.getPage(args, "https://www.wakanim.tv/" + args._country + "/v2/catalogue")
-    if not html:
-        view.add_item(args, {"title": args._addon.getLocalizedString(30041)})
-        view.endofdirectory(args)
-        return
+    items = listItems(args, html, "catalog:" + args._country, u"catalog_list", extract.CATALOG, True)
 
-    # parse html
-    soup = BeautifulSoup(html, "html.parser")
-    ul = soup.find("ul", {"class": "catalog_list"})
-
-    # for every list entry
-    for li in ul.find_all("li"):
-        # get values
-        plot  = li.find("p", {"class": "tooltip_text"})
-        stars = li.find("div", {"class": "stars"})
-        star  = stars.find_all("span", {"class": "-no"})
-        thumb = li.img["src"].replace(" ", "%20")
-        if thumb[:4] != "http":
-            thumb = "https:" + thumb
-
-        # add to view
-        view.add_item(args,
-                      {"url":         li.a["href"],
-                       "title":       li.find("div", {"class": "slider_item_description"}).span.strong.string.strip(),
-                       "tvshowtitle": li.find("div", {"class": "slider_item_description"}).span.strong.string.strip(),
-                       "mode":        "list_season",
-                       "thumb":       thumb,
-                       "fanart":      thumb,
-                       "rating":      str(10 - len(star) * 2),
-                       "plot":        plot.contents[3].string.strip(),
-                       "year":        li.time.string.strip()},
-                      isFolder=True, mediatype="video")
-
-    view.endofdirectory(args)
+    if items:
+        # filtered listings read the index only
+        facets.update(args, args._country, items)
+        # most likely next shows
+        prefetch.shows(args, items)
 
 
 def listLastEpisodes(args):
@@ -80,40 +70,7 @@ def listLastEpisodes(args):
     """
     # get website
     html = api.getPage(args, "https://www.wakanim.tv/" + args._country + "/v2")
-    if not html:
-        view.add_item(args, {"title": args._addon.getLocalizedString(30041)})
-        view.endofdirectory(args)
-        return
-
-    # parse html
-    soup = BeautifulSoup(html, "html.parser")
-    container = soup.find("div", {"class": "js-slider-lastEp"})
-    if not container:
-        view.add_item(args, {"title": args._addon.getLocalizedString(30041)})
-        view.endofdirectory(args)
-        return
-
-    # for every list entry
-    for li in container.find_all("li"):
-        # get values
-        progress = int(li.find("div", {"class": "ProgressBar"}).get("data-progress"))
-        thumb = li.img["src"].replace(" ", "%20")
-        if thumb[:4] != "http":
-            thumb = "https:" + thumb
-
-        # add to view
-        view.add_item(args,
-                      {"url":       li.a["href"],
-                       "title":     li.img["alt"],
-                       "mode":      "videoplay",
-                       "thumb":     thumb,
-                       "fanart":    thumb,
-                       "plot":      li.find("a", {"class": "slider_item_season"}).string.strip(),
-                       "playcount": "1" if progress > 90 else "0",
-                       "progress":  str(progress)},
-                      isFolder=False, mediatype="video")
-
-    view.endofdirectory(args)
+    listItems(args, html, "last_episodes:" + args._country, u"js-slider-lastEp", extract.LAST_EPISODES, False, True)
 
 
 def listLastSimulcasts(args):
@@ -121,43 +78,11 @@ def listLastSimulcasts(args):
     """
     # get website
     html = api.getPage(args, "https://www.wakanim.tv/" + args._country + "/v2")
-    if not html:
-        view.add_item(args, {"title": args._addon.getLocalizedString(30041)})
-        view.endofdirectory(args)
-        return
-
-    # parse html
-    soup = BeautifulSoup(html, "html.parser")
-    container = soup.find("div", {"class": "js-slider-lastShow"})
-    if not container:
-        view.add_item(args, {"title": args._addon.getLocalizedString(30041)})
-        view.endofdirectory(args)
-        return
-
-    # for every list entry
-    for li in container.find_all("li"):
-        # get values
-        plot  = li.find("p", {"class": "tooltip_text"})
-        stars = li.find("div", {"class": "stars"})
-        star  = stars.find_all("span", {"class": "-no"})
-        thumb = li.img["src"].replace(" ", "%20")
-        if thumb[:4] != "http":
-            thumb = "https:" + thumb
-
-        # add to view
-        view.add_item(args,
-                      {"url":         li.a["href"],
-                       "title":       li.find("div", {"class": "slider_item_description"}).span.strong.string.strip(),
-                       "tvshowtitle": li.find("div", {"class": "slider_item_description"}).span.strong.string.strip(),
-                       "mode":        "list_season",
-                       "thumb":       thumb,
-                       "fanart":      thumb,
-                       "rating":      str(10 - len(star) * 2),
-                       "plot":        plot.contents[-1].string.strip(),
-                       "year":        li.time.string.strip()},
-                      isFolder=True, mediatype="video")
+    items = listItems(args, html, "last_simulcasts:" + args._country, u"js-slider-lastShow", extract.SIMULCASTS, True)
 
-    view.endofdirectory(args)
+    # most likely next shows
+    if items:
+        prefetch.shows(args, items, True)
 
 
 def searchAnime(args):
@@ -170,38 +95,11 @@ def searchAnime(args):
 
     # get website
     html = api.getPage(args, "https://www.wakanim.tv/" + args._country + "/v2/catalogue/search", {"search": d})
+    items = listItems(args, html, "search:" + args._country + ":" + d, u"catalog_list", extract.SEARCH, True)
 
-    # parse html
-    soup = BeautifulSoup(html, "html.parser")
-    ul = soup.find("ul", {"class": "catalog_list"})
-    if not ul:
-        view.add_item(args, {"title": args._addon.getLocalizedString(30041)})
-        view.endofdirectory(args)
-        return
-
-    # for every list entry
-    for li in ul.find_all("li"):
-        # get values
-        plot  = li.find("p", {"class": "tooltip_text"})
-        stars = li.find("div", {"class": "stars"})
-        star  = stars.find_all("span", {"class": "-no"})
-        thumb = li.img["src"].replace(" ", "%20")
-        if thumb[:4] != "http":
-            thumb = "https:" + thumb
-
-        # add to view
-        view.add_item(args,
-                      {"url":    li.a["href"],
-                       "title":  li.find("div", {"class": "slider_item_description"}).span.strong.string.strip(),
-                       "mode":   "list_season",
-                       "thumb":  thumb,
-                       "fanart": thumb,
-                       "rating": str(10 - len(star) * 2),
-                       "plot":   plot.contents[3].string.strip(),
-                       "year":   li.time.string.strip()},
-                      isFolder=True, mediatype="video")
-
-    view.endofdirectory(args)
+    # most likely next shows
+    if items:
+        prefetch.shows(args, items)
 
 
 def myWatchlist(args):
@@ -209,39 +107,7 @@ def myWatchlist(args):
     """
     # get website
     html = api.getPage(args, "https://www.wakanim.tv/" + args._country + "/v2/watchlist")
-    if not html:
-        view.add_item(args, {"title": args._addon.getLocalizedString(30041)})
-        view.endofdirectory(args)
-        return
-
-    # parse html
-    soup = BeautifulSoup(html, "html.parser")
-    section = soup.find("section")
-    if not section:
-        view.add_item(args, {"title": args._addon.getLocalizedString(30041)})
-        view.endofdirectory(args)
-        return
-
-    # for every list entry
-    for div in section.find_all("div", {"class": "slider_item"}):
-        # get values
-        progress = int(div.find("div", {"class": "ProgressBar"}).get("data-progress"))
-        thumb = div.img["src"].replace(" ", "%20")
-        if thumb[:4] != "http":
-            thumb = "https:" + thumb
-
-        # add to view
-        view.add_item(args,
-                      {"url":       div.find("div", {"class": "slider_item_inner"}).a["href"],
-                       "title":     div.img["alt"],
-                       "mode":      "videoplay",
-                       "thumb":     thumb.replace(" ", "%20"),
-                       "fanart":    thumb.replace(" ", "%20"),
-                       "playcount": "1" if progress > 90 else "0",
-                       "progress":  str(progress)},
-                      isFolder=False, mediatype="video")
-
-    view.endofdirectory(args)
+    listItems(args, html, "watchlist:" + args._country, u"<section", extract.WATCHLIST, False, True)
 
 
 def myDownloads(args):
@@ -250,118 +116,120 @@ def myDownloads(args):
     """
     # get website
     html = api.getPage(args, "https://www.wakanim.tv/" + args._country + "/v2/mydownloads")
-    if not html:
-        view.add_item(args, {"title": args._addon.getLocalizedString(30041)})
-        view.endofdirectory(args)
-        return
+    listItems(args, html, "downloads:" + args._country, u"big-item-list", extract.BIG_ITEMS, True, True)
 
-    # parse html
-    soup = BeautifulSoup(html, "html.parser")
-    container = soup.find("div", {"class": "big-item-list"})
-    if not container:
-        view.add_item(args, {"title": args._addon.getLocalizedString(30041)})
-        view.endofdirectory(args)
-        return
 
-    # for every list entry
-    for div in container.find_all("div", {"class": "big-item-list_item"}):
-        # get values
-        thumb = div.img["src"].replace(" ", "%20")
-        if thumb[:4] != "http":
-            thumb = "https:" + thumb
+def myCollection(args):
+    """View collection
+    """
+    # get website
+    html = api.getPage(args, "https://www.wakanim.tv/" + args._country + "/v2/collection")
+    listItems(args, html, "collection:" + args._country, u"big-item-list", extract.BIG_ITEMS, True, True)
+
 
+def showWidget(args):
+    """Show listing for skin widgets from local data only
+    Stale or missing data is refreshed in the background for the next time.
+    """
+    start = time.time()
+    spec = WIDGETS[args.list][2]
+    kind = args.list + ":" + args._country
+    items = memo.stored(args, kind, spec)
+    age = memo.age(args, kind)
+    if items is None or age > WIDGET_MAXAGE:
+        queueRefresh(args, args.list)
+
+    # for every list entry
+    for item in items or []:
         # add to view
-        view.add_item(args,
-                      {"url":    div.a["href"].replace("mydownloads/detail", "catalogue/show"),
-                       "title":  div.find("h3", {"class": "big-item_title"}).string.strip(),
-                       "mode":   "list_season",
-                       "thumb":  thumb,
-                       "fanart": thumb},
-                      isFolder=True, mediatype="video")
+        view.add_item(args, spec.info(item), isFolder=False, mediatype="video")
 
     view.endofdirectory(args)
+    xbmc.log("[PLUGIN] %s: Widget '%s' served in %.1fms (%d items, data age %s)" % (args._addonname, args.list, (time.time() - start) * 1000, len(items or []), "%ds" % age if age is not None else "none"), xbmc.LOGDEBUG)
 
 
-def myCollection(args):
-    """View collection
+def queueRefresh(args, name):
+    """Let another invocation load widget data
+    Only one refresh per widget is queued per minute.
+    """
+    prop = "plugin.video.wakanim.widget." + name
+    window = xbmcgui.Window(10000)
+    queued = window.getProperty(prop)
+    if queued and time.time() - float(queued) < 60:
+        return
+    window.setProperty(prop, str(time.time()))
+    xbmc.executebuiltin("RunPlugin(%s?mode=widget_refresh&list=%s)" % (args._argv[0], name))
+
+
+def refreshWidget(args):
+    """Load and extract data of a widget
+    """
+    path, marker, spec = WIDGETS[args.list]
+    html = api.getPage(args, "https://www.wakanim.tv/" + args._country + path, login=False, priority=api.BACKGROUND)
+    if api.isLoggedin(html):
+        memo.extract(args, args.list + ":" + args._country, html, marker, spec=spec, tags=["country:" + args._country, "account"])
+    xbmcgui.Window(10000).clearProperty("plugin.video.wakanim.widget." + args.list)
+
+
+def listItems(args, html, kind, marker, spec, isFolder, account=False):
+    """Show items of a listing page
+    Parameters:
+      kind, marker: see memo.extract
+      spec: extract.Spec of the page
+      isFolder: items are shows instead of episodes
+      account: items depend on the account, e.g. watch progress
+    Returns the item records, None on error
     """
-    # get website
-    html = api.getPage(args, "https://www.wakanim.tv/" + args._country + "/v2/collection")
     if not html:
         view.add_item(args, {"title": args._addon.getLocalizedString(30041)})
         view.endofdirectory(args)
-        return
+        return None
 
     # parse html
-    soup = BeautifulSoup(html, "html.parser")
-    container = soup.find("div", {"class": "big-item-list"})
-    if not container:
+    tags = ["country:" + args._country] + (["account"] if account else [])
+    items = memo.extract(args, kind, html, marker, spec=spec, tags=tags)
+    if items is None:
         view.add_item(args, {"title": args._addon.getLocalizedString(30041)})
         view.endofdirectory(args)
-        return
+        return None
 
     # for every list entry
-    for div in container.find_all("div", {"class": "big-item-list_item"}):
-        # get values
-        thumb = div.img["src"].replace(" ", "%20")
-        if thumb[:4] != "http":
-            thumb = "https:" + thumb
-
+    for item in items:
         # add to view
-        view.add_item(args,
-                      {"url":    div.a["href"].replace("collection/detail", "catalogue/show"),
-                       "title":  div.find("h3", {"class": "big-item_title"}).string.strip(),
-                       "mode":   "list_season",
-                       "thumb":  thumb,
-                       "fanart": thumb},
-                      isFolder=True, mediatype="video")
+        view.add_item(args, spec.info(item), isFolder=isFolder, mediatype="video")
 
     view.endofdirectory(args)
+    return items
 
 
 def listSeason(args):
     """Show all seasons/arcs of an anime
     """
-    # get website
-    html = api.getPage(args, "https://www.wakanim.tv" + args.url)
-    if not html:
-        view.add_item(args, {"title": args._addon.getLocalizedString(30041)})
-        view.endofdirectory(args)
-        return
+    prefetched = prefetch.take(args, args.url)
+    if prefetched:
+        show = prefetched["show"]
+    else:
+        # get website
+        html = api.getPage(args, "https://www.wakanim.tv" + args.url)
+        if not html:
+            view.add_item(args, {"title": args._addon.getLocalizedString(30041)})
+            view.endofdirectory(args)
+            return
 
-    # parse html
-    soup = BeautifulSoup(html, "html.parser")
-
-    # get values
-    date = soup.find_all("span", {"class": "border-list_text"})[0].find_all("span")
-    year = date[2].string.strip()
-    date = year + "-" + date[1].string.strip() + "-" + date[0].string.strip()
-    originaltitle = soup.find_all("span", {"class": "border-list_text"})[1].string.strip()
-    plot = soup.find("div", {"class": "serie_description"}).get_text().strip()
-    credit = soup.find("div", {"class": "serie_description_more"})
-    credit = credit.p.get_text().strip() if credit else ""
-    trailer = soup.find("div", {"class": "TrailerEp-iframeWrapperRatio"})
-    try:
-        # get YouTube trailer
-        trailer = trailer.iframe["src"]
-        trailer = "plugin://plugin.video.youtube/play/?video_id=" + re.search(r"(?:\.be/|/embed)/?([^&=%:/\?]{11})", trailer).group(1)
+        # parse html
+        show = memo.extract(args, "show:" + args.url, html, (u"TrailerEp-iframeWrapperRatio", u"border-list_text", u"serie_description"), extract.showPage, tags=cache.pageTags([args.url]))
+
+    if show["trailer"]:
         view.add_item(args,
-                      {"url":    trailer,
+                      {"url":    show["trailer"],
                        "mode":   "trailer",
                        "thumb":  args.thumb.replace(" ", "%20"),
                        "fanart": args.fanart.replace(" ", "%20"),
                        "title":  args._addon.getLocalizedString(30024)},
                       isFolder=False, mediatype="video")
-    except AttributeError:
-        trailer = ""
 
     # for every list entry
-    for section in soup.find_all("h2", {"class": "slider-section_title"}):
-        # get values
-        if not section.span:
-            continue
-        title = section.get_text()[6:].strip()
-
+    for title in show["seasons"]:
         # add to view
         view.add_item(args,
                       {"url":           args.url,
@@ -370,73 +238,208 @@ def listSeason(args):
                        "thumb":         args.thumb.replace(" ", "%20"),
                        "fanart":        args.fanart.replace(" ", "%20"),
                        "season":        title,
-                       "plot":          plot,
+                       "plot":          show["plot"],
                        "plotoutline":   getattr(args, "plot", ""),
-                       "year":          year,
-                       "premiered":     date,
-                       "trailer":       trailer,
-                       "originaltitle": originaltitle,
-                       "credits":       credit},
+                       "year":          show["year"],
+                       "premiered":     show["premiered"],
+                       "trailer":       show["trailer"],
+                       "originaltitle": show["originaltitle"],
+                       "credits":       show["credits"]},
                       isFolder=True, mediatype="video")
 
     view.endofdirectory(args)
 
 
+def storedSeasons(args, url):
+    """Seasons of a show page loaded before, None if unknown
+    """
+    prefetched = cache.Cache(args, "prefetch").get(url)
+    if prefetched:
+        return extract.EPISODES.load(prefetched["seasons"])
+    return memo.stored(args, "episodes:" + url, extract.EPISODES)
+
+
+def episodeDetails(details, url):
+    """Details of an episode from the episode cache, None if unknown
+    Pages without details, e.g. a login page of an expired session, are
+    fetched again after EMPTY_MAXAGE.
+    """
+    info = details.get(url)
+    if info == {} and details.age(url) > EMPTY_MAXAGE:
+        return None
+    return info
+
+
+def seasonEpisodes(args, seasons):
+    """Episodes of the season in args.title, empty if not found
+    """
+    for season, episodes in seasons:
+        if view.quote_value(season, args.PY2) == view.quote_value(args.title, args.PY2):
+            return episodes
+    return []
+
+
 def listEpisodes(args):
     """Show all episodes of an season/arc
     """
-    # get website
-    html = api.getPage(args, "https://www.wakanim.tv" + args.url)
-    if not html:
-        view.add_item(args, {"title": args._addon.getLocalizedString(30041)})
-        view.endofdirectory(args)
-        return
+    seasons = None
+    window = xbmcgui.Window(10000)
+    if window.getProperty(ENRICHED_PROPERTY) == args.url:
+        # refreshed for new details, the show page has just been read
+        window.clearProperty(ENRICHED_PROPERTY)
+        seasons = storedSeasons(args, args.url)
+    if seasons is None:
+        prefetched = prefetch.take(args, args.url, opened=False)
+        if prefetched:
+            seasons = extract.EPISODES.load(prefetched["seasons"])
+    if seasons is None:
+        # get website
+        # login for the watch progress of the public show page
+        html = api.getPage(args, "https://www.wakanim.tv" + args.url, login=True)
+        if not html:
+            view.add_item(args, {"title": args._addon.getLocalizedString(30041)})
+            view.endofdirectory(args)
+            return
 
-    # parse html
-    soup = BeautifulSoup(html, "html.parser")
-
-    # for every season
-    for section in soup.find_all("section", {"class": "seasonSection"}):
-        # get values
-        season = section.find("h2", {"class": "slider-section_title"}).get_text().split("%", 1)[1].strip()
-        if view.quote_value(season, args.PY2) != view.quote_value(args.title, args.PY2):
-            continue
-
-        # for every episode
-        for li in section.find_all("li", {"class": "slider_item"}):
-            progress = int(li.find("div", {"class": "ProgressBar"}).get("data-progress"))
-            thumb = li.img["src"].replace(" ", "%20")
-            if thumb[:4] != "http":
-                thumb = "https:" + thumb
-
-            # add to view
-            view.add_item(args,
-                          {"url":       li.a["href"],
-                           "title":     li.img["alt"],
-                           "mode":      "videoplay",
-                           "thumb":     thumb.replace(" ", "%20"),
-                           "fanart":    args.fanart.replace(" ", "%20"),
-                           "playcount": "1" if progress > 90 else "0",
-                           "progress":  str(progress)},
-                          isFolder=False, mediatype="video")
-
-        break
+        # parse html
+        seasons = memo.extract(args, "episodes:" + args.url, html, u"seasonSection", spec=extract.EPISODES, tags=cache.pageTags([args.url]) + ["account"], partial=True)
+    details = cache.Cache(args, "episodes")
+    missing = False
+
+    # for every episode
+    for episode in seasonEpisodes(args, seasons):
+        # use episode details already loaded
+        info = episodeDetails(details, episode.url)
+        if info is None:
+            missing = True
+        info = dict(info or {})
+
+        # add to view
+        info.update(extract.EPISODES.info(episode))
+        info["fanart"] = args.fanart.replace(" ", "%20")
+        view.add_item(args, info, isFolder=False, mediatype="video")
 
     view.endofdirectory(args)
 
+    # load missing details in another invocation, this one ends now
+    if missing and args._addon.getSetting("enrich_episodes") == "true":
+        xbmc.executebuiltin("RunPlugin(%s?mode=enrich_episodes&url=%s&title=%s&listing=%s)" % (
+            args._argv[0], view.quote_arg(args.url, args.PY2), view.quote_arg(args.title, args.PY2), view.quote_arg(args._argv[2], args.PY2)))
+
+
+def logStages(args, stages):
+    """Log durations of playback stages and keep the last ones
+    """
+    durations = [(name, round(t - stages[i][1], 3)) for i, (name, t) in enumerate(stages[1:])]
+    total = stages[-1][1] - stages[0][1]
+    xbmc.log("[PLUGIN] %s: Playback resolved in %.3fs (%s)" % (args._addonname, total, ", ".join("%s %.3fs" % d for d in durations)), xbmc.LOGNOTICE)
+
+    timings = cache.Cache(args, "timings")
+    history = timings.get("playback", [])[-(TIMINGS - 1):]
+    history.append({"time": stages[0][1], "total": round(total, 3), "stages": durations})
+    timings.set("playback", history)
+    timings.save()
+
+
+def enrichEpisodes(args):
+    """Load missing details of the episodes of a season in parallel
+    Started by listEpisodes as its own invocation, so the listing is not
+    kept busy. Every episode page is fetched until it has been read once,
+    the results are stored in the episode cache and shown by refreshing the
+    listing if it is still open.
+    """
+    details = cache.Cache(args, "episodes")
+    urls = [e.url for e in seasonEpisodes(args, storedSeasons(args, args.url) or []) if episodeDetails(details, e.url) is None]
+    if not urls:
+        return
+
+    def fetch(url):
+        html = api.getPage(args, "https://www.wakanim.tv" + url, login=False, priority=api.BACKGROUND)
+        if html:
+            details.set(url, episodepage.details(html))
+
+    start = time.time()
+    pool.map(fetch, urls, 4)
+    details.save()
+    xbmc.log("[PLUGIN] %s: Loaded details of %d episodes in %.2fs" % (args._addonname, len(urls), time.time() - start), xbmc.LOGDEBUG)
+
+    if xbmc.getInfoLabel("Container.FolderPath") == args._argv[0] + args.listing:
+        xbmcgui.Window(10000).setProperty(ENRICHED_PROPERTY, args.url)
+        xbmc.executebuiltin("Container.Refresh")
+
+
+def reactivate(args, page, html, priority=api.INTERACTIVE):
+    """Reactivate the video of the episode page of args.url
+    Returns analysis and HTML of the reloaded page, its access is still
+    REACTIVATE if it has failed
+    """
+    if not page.reactivate_url:
+        return page, html
+    api.getPage(args, "https://www.wakanim.tv" + page.reactivate_url, priority=priority)
+
+    # reload page
+    html = api.getPage(args, "https://www.wakanim.tv" + args.url, priority=priority)
+    page = episodepage.analyze(html)
+
+    # listings of the show may contain the old state
+    cache.invalidate(args, cache.pageTags([args.url]) + (["show:%s" % page.showid] if page.showid else []))
+    return page, html
+
+
+def precheck(args):
+    """Start InputStreamHelper check of the stream type played last
+    Returns function for getStreamParams(checked=), None if unknown
+    """
+    last = xbmcgui.Window(10000).getProperty(STREAM_PROPERTY)
+    if not last:
+        return None
+    proto, drm = last.split("|", 1)
+    result = {}
+
+    def run():
+        try:
+            result["ok"] = checkInputstream(proto, drm or None)
+        except Exception as e:
+            # done again by getStreamParams, which shows the error
+            xbmc.log("[PLUGIN] %s: InputStreamHelper check in advance failed: %s" % (args._addonname, e), xbmc.LOGDEBUG)
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+
+    def checked(p, d):
+        if (p, d) != (proto, drm or None):
+            return None
+        thread.join()
+        return result.get("ok")
+    return checked
+
 
 def startplayback(args):
     """Plays a video
+    The InputStreamHelper check of the stream type played last runs while
+    the episode page loads. Every stage is timed and kept in the timings
+    cache.
     """
+    stages = [("start", time.time())]
+
+    def mark(name):
+        stages.append((name, time.time()))
+
+    checked = precheck(args)
+
     # get website
-    html = api.getPage(args, "https://www.wakanim.tv" + args.url)
+    html = api.getPage(args, "https://www.wakanim.tv" + args.url, priority=api.PLAYBACK)
+    mark("page")
     if not html:
         item = xbmcgui.ListItem(getattr(args, "title", "Title not provided"))
         xbmcplugin.setResolvedUrl(int(args._argv[1]), False, item)
         return
 
     # check if not premium
-    if (u"Diese Folge ist für Abonnenten reserviert" in html) or (u"Cet épisode est reservé à nos abonnés" in html) or (u"This episode is reserved for our subscribers" in html) or (u"Эта серия зарезервирована для наших подписчиков" in html):
+    page = episodepage.analyze(html)
+    mark("analyze")
+    if page.access == episodepage.RESERVED:
         xbmc.log("[PLUGIN] %s: You need to own this video or be a premium member '%s'" % (args._addonname, args.url), xbmc.LOGERROR)
         item = xbmcgui.ListItem(getattr(args, "title", "Title not provided"))
         xbmcplugin.setResolvedUrl(int(args._argv[1]), False, item)
@@ -444,19 +447,12 @@ def startplayback(args):
         return
 
     # check if we have to reactivate video
-    if u"reactivate" in html:
-        # parse html
-        soup = BeautifulSoup(html, "html.parser")
-
-        # reactivate video
-        a = soup.find("div", {"id": "jwplayer-container"}).a["href"]
-        html = api.getPage(args, "https://www.wakanim.tv" + a)
-
-        # reload page
-        html = api.getPage(args, "https://www.wakanim.tv" + args.url)
+    if page.access == episodepage.REACTIVATE:
+        page, html = reactivate(args, page, html, api.PLAYBACK)
+        mark("reactivate")
 
         # check if successfull
-        if u"reactivate" in html:
+        if page.access == episodepage.REACTIVATE:
             xbmc.log("[PLUGIN] %s: Reactivation failed '%s'" % (args._addonname, args.url), xbmc.LOGERROR)
             item = xbmcgui.ListItem(getattr(args, "title", "Title not provided"))
             xbmcplugin.setResolvedUrl(int(args._argv[1]), False, item)
@@ -464,9 +460,9 @@ def startplayback(args):
             return
 
     # playing stream
-    if u"jwplayer-container" in html:
+    if page.access != episodepage.NO_PLAYER:
         # streaming is only for premium subscription
-        if ((u"<span>Kostenlos</span>" in html) or (u"<span>Gratuit</span>" in html) or (u"<span>Free</span>" in html) or (u"<span>Бесплатный аккаунт</span>" in html)) and not (u"episode_premium_title" in html):
+        if page.access == episodepage.NO_PREMIUM:
             xbmc.log("[PLUGIN] %s: You need to own this video or be a premium member '%s'" % (args._addonname, args.url), xbmc.LOGERROR)
             item = xbmcgui.ListItem(getattr(args, "title", "Title not provided"))
             xbmcplugin.setResolvedUrl(int(args._argv[1]), False, item)
@@ -474,12 +470,26 @@ def startplayback(args):
             return
 
         # get stream parameters
-        params = getStreamParams(args, html)
+        params = getStreamParams(args, page.config or html, checked)
+        mark("config")
         if not params:
             item = xbmcgui.ListItem(getattr(args, "title", "Title not provided"))
             xbmcplugin.setResolvedUrl(int(args._argv[1]), False, item)
             return
 
+        # stream type to check in advance next time
+        properties = params["properties"]
+        if not params["legacy"]:
+            xbmcgui.Window(10000).setProperty(STREAM_PROPERTY, "%s|%s" % (properties.get("inputstream.adaptive.manifest_type"), properties.get("inputstream.adaptive.license_type") or ""))
+
+        # route stream through local read-ahead proxy
+        streamproxy = None
+        if args._addon.getSetting("proxy") == "true":
+            streamproxy = proxy.Proxy(readahead=int(args._addon.getSetting("proxy_readahead") or 4),
+                                      log=lambda msg: xbmc.log("[PLUGIN] %s: %s" % (args._addonname, msg), xbmc.LOGNOTICE))
+            streamproxy.start()
+            params["url"] = streamproxy.url(params["url"])
+
         # play stream
         url = params["url"]
         item = xbmcgui.ListItem(getattr(args, "title", "Title not provided"), path=url)
@@ -491,58 +501,17 @@ def startplayback(args):
         item.setContentLookup(False)
 
         xbmcplugin.setResolvedUrl(int(args._argv[1]), True, item)
-
-        if args._addon.getSetting("sync_playtime") == "true":
-            # get required infos
-            player = xbmc.Player()
-            regex = r"idepisode=(.*?)&(?:.*?)&idserie=(.*?)\","
-            matches = re.search(regex, html)
-            episodeid = int(matches.group(1))
-            showid = int(matches.group(2))
-
-            # wait for video to begin
-            timeout = time.time() + 20
-            while not xbmc.getCondVisibility("Player.IsInternetStream"):
-                xbmc.sleep(50)
-                # timeout to prevent infinite loop
-                if time.time() > timeout:
-                    xbmc.log("[PLUGIN] %s: Timeout reached, video did not start in 20 seconds" % args._addonname, xbmc.LOGERROR)
-                    return
-
-            # ask if user want to continue playback
-            resume = int(getattr(args, "progress", 0))
-            if resume >= 5 and resume <= 90:
-                player.pause()
-                if xbmcgui.Dialog().yesno(args._addonname, args._addon.getLocalizedString(30045) % resume):
-                    player.seekTime(player.getTotalTime() * (resume/100.0))
-                player.pause()
-
-            # update playtime at wakanim
-            try:
-                while url == player.getPlayingFile():
-                    # wait 10 seconds
-                    xbmc.sleep(10000)
-
-                    # calculate message
-                    post = {"ShowId":          showid,
-                            "EpisodeId":       episodeid,
-                            "PlayTime":        player.getTime(),
-                            "Duration":        player.getTotalTime(),
-                            "TotalPlayedTime": 4,
-                            "FromSVOD":        "true"}
-
-                    # send data
-                    try:
-                        req = Request("https://www.wakanim.tv/" + args._country + "/v2/svod/saveplaytimeprogress",
-                                      json.dumps(post).encode("utf-8"),
-                                      headers={"Content-type": "application/json"})
-                        response = urlopen(req)
-                        html = response.read()
-                    except (ssl.SSLError, URLError) as e:
-                        # catch timeout exception
-                        pass
-            except RuntimeError:
-                xbmc.log("[PLUGIN] %s: Playback aborted" % args._addonname, xbmc.LOGDEBUG)
+        mark("resolved")
+        logStages(args, stages)
+
+        sync = args._addon.getSetting("sync_playtime") == "true" and page.episodeid is not None
+        if sync or streamproxy:
+            # resume and update playtime at wakanim, keep proxy alive
+            PlaybackMonitor(args, url, page.showid if sync else None, page.episodeid, streamproxy).run()
+        if streamproxy:
+            # playback has ended or Kodi never used the proxy
+            xbmc.log("[PLUGIN] %s: Proxy %s" % (args._addonname, streamproxy.stats()), xbmc.LOGNOTICE)
+            streamproxy.stop()
     else:
         xbmc.log("[PLUGIN] %s: You need to own this video or be a premium member '%s'" % (args._addonname, args.url), xbmc.LOGERROR)
         xbmcgui.Dialog().ok(args._addonname, args._addon.getLocalizedString(30043))
@@ -0,0 +1,355 @@
+# -*- coding: utf-8 -*-
+# Wakanim - Watch videos from the german anime platform Wakanim.tv on Kodi.
+# Copyright (C) 2017 MrKrabat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import re
+import ssl
+import json
+import time
+import socket
+import threading
+try:
+    from urlparse import urljoin, parse_qsl
+    from urllib2 import urlopen, Request, URLError
+except ImportError:
+    from urllib.parse import urljoin, parse_qsl
+    from urllib.request import urlopen, Request
+    from urllib.error import URLError
+
+import xbmc
+import xbmcvfs
+import xbmcgui
+import xbmcplugin
+
+from . import api
+from . import view
+from . import pool
+from . import controller
+from . import episodepage
+from .streamparams import getStream, getStreamParams
+
+
+#: parallel segment downloads per job
+WORKERS = 4
+#: attempts per segment
+RETRIES = 3
+
+# regex for URI attributes of EXT-X-KEY and EXT-X-MAP
+_uri = re.compile(r"URI=\"([^\"]+)\"")
+
+
+def getDownloadPath(args, name=""):
+    """Get folder of all downloads or of one download
+    The folder may be on a network share like smb://, so files of downloads
+    are only accessed through xbmcvfs.
+    """
+    path = xbmc.translatePath(args._addon.getSetting("download_path"))
+    if not path:
+        path = api.getProfilePath(args, u"downloads")
+    elif args.PY2:
+        path = path.decode("utf-8")
+    return join(path, name) if name else path
+
+
+def join(folder, name):
+    """Path of name in folder, also for Kodi paths like smb://
+    """
+    return folder.rstrip("/\\") + "/" + name
+
+
+def readFile(path):
+    """Content of a file as text, None if it does not exist
+    """
+    if not xbmcvfs.exists(path):
+        return None
+    f = xbmcvfs.File(path)
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+
+def writeFile(path, content):
+    """Write text or bytes to file
+    """
+    if not isinstance(content, bytes):
+        content = content.encode("utf-8")
+    f = xbmcvfs.File(path, "w")
+    try:
+        if not f.write(bytearray(content)):
+            raise IOError("failed to write '%s'" % path)
+    finally:
+        f.close()
+
+
+def download(args):
+    """Download episode for offline viewing
+    Only HLS streams without DRM can be downloaded.
+    """
+    html = api.getPage(args, "https://www.wakanim.tv" + args.url)
+    page = episodepage.analyze(html)
+    if page.access == episodepage.REACTIVATE:
+        page, html = controller.reactivate(args, page, html)
+        if page.access == episodepage.REACTIVATE:
+            xbmc.log("[PLUGIN] %s: Reactivation failed '%s'" % (args._addonname, args.url), xbmc.LOGERROR)
+            xbmcgui.Dialog().ok(args._addonname, args._addon.getLocalizedString(30042))
+            return
+    if page.access != episodepage.OK or page.episodeid is None:
+        xbmcgui.Dialog().ok(args._addonname, args._addon.getLocalizedString(30043))
+        return
+
+    # DRM streams are refused before InputStreamHelper checks them
+    stream = getStream(args, page.config or html)
+    if stream and (stream["proto"] != "hls" or stream["drm"]):
+        xbmcgui.Dialog().ok(args._addonname, args._addon.getLocalizedString(30049))
+        return
+
+    params = getStreamParams(args, page.config or html)
+    if not params:
+        return
+    if not params["legacy"]:
+        xbmcgui.Dialog().ok(args._addonname, args._addon.getLocalizedString(30049))
+        return
+
+    # stream url contains headers for Kodi
+    url, _, headers = params["url"].partition("|")
+    job = Job(args, getDownloadPath(args, str(page.episodeid)), url, dict(parse_qsl(headers)),
+              {"title": getattr(args, "title", ""),
+               "thumb": getattr(args, "thumb", ""),
+               "url":   args.url})
+    job.run()
+
+
+class Job(object):
+    """Download of one HLS stream
+    Segments are loaded in parallel by a bounded pool. The manifest.json of
+    the download lists all segments, so an interrupted download continues
+    with the missing segments only.
+    """
+    def __init__(self, args, folder, url, headers, info):
+        self._args     = args
+        self._folder   = folder
+        self._url      = url
+        self._headers  = headers
+        self._info     = info
+        self._lock     = threading.Lock()
+        self._done     = 0
+        self._bytes    = 0
+        self._failed   = 0
+        self._cancel   = False
+        self.manifest  = None
+
+    def _fetch(self, url):
+        """Open url with stream headers
+        """
+        return urlopen(Request(url, headers=self._headers), timeout=30)
+
+    def _path(self, name):
+        return join(self._folder, name)
+
+    def _save(self):
+        """Write manifest of download
+        """
+        writeFile(self._path("manifest.json"), json.dumps(self.manifest))
+
+    def prepare(self):
+        """Load manifest or build it from the HLS playlists
+        """
+        if not xbmcvfs.exists(self._folder + "/"):
+            xbmcvfs.mkdirs(self._folder)
+        try:
+            self.manifest = json.loads(readFile(self._path("manifest.json")) or "")
+            return
+        except ValueError:
+            pass
+
+        # master playlist, choose variant with highest bandwidth
+        url = self._url
+        playlist = api.getHTML(self._fetch(url))
+        if "#EXT-X-STREAM-INF" in playlist:
+            best = -1
+            variant = None
+            lines = playlist.splitlines()
+            for i, line in enumerate(lines):
+                if not line.startswith("#EXT-X-STREAM-INF") or i + 1 >= len(lines):
+                    continue
+                m = re.search(r"BANDWIDTH=(\d+)", line)
+                bandwidth = int(m.group(1)) if m else 0
+                # without any bandwidth the first variant is used
+                if variant is None or bandwidth > best:
+                    best = bandwidth
+                    variant = urljoin(url, lines[i + 1].strip())
+            if variant is None:
+                raise IOError("no variant in master playlist")
+            url = variant
+            playlist = api.getHTML(self._fetch(url))
+
+        # collect segments, keys and init segments and rewrite playlist
+        segments = []
+        local = []
+        for line in playlist.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("#"):
+                m = _uri.search(line)
+                if m and (line.startswith("#EXT-X-KEY") or line.startswith("#EXT-X-MAP")):
+                    name = "res%05d" % len(segments)
+                    segments.append({"url": urljoin(url, m.group(1)), "file": name, "size": None})
+                    line = line[:m.start(1)] + name + line[m.end(1):]
+                local.append(line)
+            else:
+                name = "seg%05d.ts" % len(segments)
+                segments.append({"url": urljoin(url, line), "file": name, "size": None})
+                local.append(name)
+
+        writeFile(self._path("index.m3u8"), u"\n".join(local) + u"\n")
+        self.manifest = dict(self._info, segments=segments, complete=False, bytes=0, seconds=0)
+        self._save()
+
+    def _segment(self, segment):
+        """Download one segment and count the result
+        """
+        ok = False
+        try:
+            ok = self._load(segment)
+        finally:
+            with self._lock:
+                if ok:
+                    self._done += 1
+                else:
+                    self._failed += 1
+
+    def _load(self, segment):
+        """Download one segment and verify its size
+        """
+        path = self._path(segment["file"])
+        if segment["size"] is not None and xbmcvfs.exists(path) and xbmcvfs.Stat(path).st_size() == segment["size"]:
+            # already downloaded
+            return True
+
+        for attempt in range(RETRIES):
+            if self._cancel:
+                return False
+            try:
+                response = self._fetch(segment["url"])
+                length = response.headers.get("Content-Length")
+                size = 0
+                f = xbmcvfs.File(path + ".part", "w")
+                try:
+                    while True:
+                        chunk = response.read(65536)
+                        if not chunk:
+                            break
+                        if not f.write(bytearray(chunk)):
+                            raise IOError("failed to write '%s'" % path)
+                        size += len(chunk)
+                finally:
+                    f.close()
+                if length is not None and int(length) != size:
+                    raise IOError("size mismatch %d != %s" % (size, length))
+                if xbmcvfs.exists(path):
+                    xbmcvfs.delete(path)
+                if not xbmcvfs.rename(path + ".part", path):
+                    raise IOError("failed to rename '%s'" % path)
+                with self._lock:
+                    segment["size"] = size
+                    self._bytes += size
+                return True
+            except (ssl.SSLError, URLError, socket.error, IOError) as e:
+                xbmc.log("[PLUGIN] %s: Download of '%s' failed (%d): %s" % (self._args._addonname, segment["url"], attempt + 1, e), xbmc.LOGNOTICE)
+        return False
+
+    def run(self):
+        """Download all missing segments and report progress
+        """
+        try:
+            self.prepare()
+        except (ssl.SSLError, URLError, socket.error, IOError, OSError) as e:
+            xbmc.log("[PLUGIN] %s: Download failed: %s" % (self._args._addonname, e), xbmc.LOGERROR)
+            xbmcgui.Dialog().notification(self._args._addonname, self._args._addon.getLocalizedString(30041), xbmcgui.NOTIFICATION_ERROR)
+            return False
+
+        segments = self.manifest["segments"]
+        monitor = xbmc.Monitor()
+        progress = xbmcgui.DialogProgressBG()
+        progress.create(self._args._addonname, self.manifest["title"])
+        start = time.time()
+
+        workers = pool.Pool(WORKERS)
+        for segment in segments:
+            workers.submit(self._segment, segment)
+
+        # wait for workers, save manifest regularly for resume
+        while self._done + self._failed < len(segments):
+            progress.update(100 * self._done // max(1, len(segments)))
+            if monitor.waitForAbort(1):
+                self._cancel = True
+                break
+            with self._lock:
+                self._save()
+        workers.join()
+        progress.close()
+
+        seconds = time.time() - start
+        with self._lock:
+            self.manifest["complete"] = not self._failed and not self._cancel
+            self.manifest["bytes"] += self._bytes
+            self.manifest["seconds"] += seconds
+            self._save()
+
+        rate = self._bytes / 1048576.0 / max(seconds, 0.001)
+        xbmc.log("[PLUGIN] %s: Downloaded %d/%d segments, %.1f MB in %.1fs (%.2f MB/s)" % (self._args._addonname, self._done, len(segments), self._bytes / 1048576.0, seconds, rate), xbmc.LOGNOTICE)
+        if self.manifest["complete"]:
+            xbmcgui.Dialog().notification(self._args._addonname, self._args._addon.getLocalizedString(30050) % rate)
+        else:
+            xbmcgui.Dialog().notification(self._args._addonname, self._args._addon.getLocalizedString(30041), xbmcgui.NOTIFICATION_ERROR)
+        return self.manifest["complete"]
+
+
+def listDownloads(args):
+    """Show completed downloads
+    """
+    path = getDownloadPath(args)
+    names = sorted(xbmcvfs.listdir(path + "/")[0]) if xbmcvfs.exists(path + "/") else []
+    for name in names:
+        try:
+            manifest = json.loads(readFile(join(join(path, name), "manifest.json")) or "")
+        except ValueError:
+            continue
+        if not manifest.get("complete"):
+            continue
+
+        # add to view
+        view.add_item(args,
+                      {"title":    manifest["title"] or name,
+                       "download": name,
+                       "mode":     "play_offline",
+                       "thumb":    manifest["thumb"],
+                       "fanart":   manifest["thumb"]},
+                      isFolder=False, mediatype="video")
+
+    view.endofdirectory(args)
+
+
+def playDownload(args):
+    """Play completed download from local files
+    """
+    path = join(getDownloadPath(args, args.download), "index.m3u8")
+    item = xbmcgui.ListItem(getattr(args, "title", "Title not provided"), path=path)
+    item.setMimeType("application/vnd.apple.mpegurl")
+    item.setContentLookup(False)
+    xbmcplugin.setResolvedUrl(int(args._argv[1]), xbmcvfs.exists(path), item)
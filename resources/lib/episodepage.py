@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+# Wakanim - Watch videos from the german anime platform Wakanim.tv on Kodi.
+# Copyright (C) 2017 MrKrabat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import re
+try:
+    from HTMLParser import HTMLParser
+    unescape = HTMLParser().unescape
+except ImportError:
+    from html import unescape
+
+
+# access states of an episode page
+OK          = "ok"          #: stream can be played
+RESERVED    = "reserved"    #: episode is reserved for subscribers
+REACTIVATE  = "reactivate"  #: bought video has to be reactivated first
+NO_PREMIUM  = "no_premium"  #: free account, streaming requires premium
+NO_PLAYER   = "no_player"   #: page contains no player
+
+# localized markers, add one entry per region language
+RESERVED_TEXT = (u"Diese Folge ist für Abonnenten reserviert",
+                 u"Cet épisode est reservé à nos abonnés",
+                 u"This episode is reserved for our subscribers",
+                 u"Эта серия зарезервирована для наших подписчиков")
+FREE_BADGE    = (u"<span>Kostenlos</span>",
+                 u"<span>Gratuit</span>",
+                 u"<span>Free</span>",
+                 u"<span>Бесплатный аккаунт</span>")
+
+#: text preceeding the JWPlayer config
+PLAYER_SETUP = u"jwplayer(\"jwplayer-container\").setup({"
+
+
+def _compile():
+    """Build one regex matching every marker of the episode page
+    """
+    return re.compile(u"|".join([
+        u"(?P<reserved>" + u"|".join(re.escape(s) for s in RESERVED_TEXT) + u")",
+        u"(?P<free>" + u"|".join(re.escape(s) for s in FREE_BADGE) + u")",
+        u"(?P<setup>" + re.escape(PLAYER_SETUP) + u")",
+        u"(?P<container>id=[\"']jwplayer-container[\"'])",
+        u"(?P<player>jwplayer-container)",
+        u"(?P<premium>episode_premium_title)",
+        u"(?P<ids>idepisode=(?P<episodeid>.*?)&(?:.*?)&idserie=(?P<showid>.*?)\",)",
+        u"(?P<reactivate>reactivate)"]))
+
+_markers = _compile()
+_href    = re.compile(u"<a\\s[^>]*?href=[\"']([^\"']+)[\"']")
+
+
+class EpisodePage(object):
+    """Everything startplayback needs to know about an episode page
+    """
+    __slots__ = ("reserved", "reactivate", "player", "free", "premium",
+                 "reactivate_url", "episodeid", "showid", "config")
+
+    def __init__(self):
+        self.reserved       = False  #: reserved for subscribers text found
+        self.reactivate     = False  #: page asks to reactivate the video
+        self.player         = False  #: page contains the JWPlayer
+        self.free           = False  #: user has a free account
+        self.premium        = False  #: episode is part of the premium offer
+        self.reactivate_url = None   #: link to reactivate the video
+        self.episodeid      = None   #: Wakanim episode id
+        self.showid         = None   #: Wakanim show id
+        self.config         = u""    #: raw JWPlayer setup block
+
+    @property
+    def access(self):
+        """Access state of the episode
+        """
+        if self.reserved:
+            return RESERVED
+        if self.reactivate:
+            return REACTIVATE
+        if not self.player:
+            return NO_PLAYER
+        if self.free and not self.premium:
+            return NO_PREMIUM
+        return OK
+
+
+def analyze(html):
+    """Read an episode page in a single pass
+    Parameters:
+      html: HTML page content
+    Returns EpisodePage
+    """
+    page = EpisodePage()
+    for m in _markers.finditer(html):
+        kind = m.lastgroup
+        if kind == "reserved":
+            page.reserved = True
+        elif kind == "free":
+            page.free = True
+        elif kind == "premium":
+            page.premium = True
+        elif kind == "reactivate":
+            page.reactivate = True
+        elif kind == "ids":
+            if page.episodeid is None:
+                try:
+                    page.episodeid = int(m.group("episodeid"))
+                    page.showid = int(m.group("showid"))
+                except ValueError:
+                    pass
+        elif kind == "setup":
+            page.player = True
+            if not page.config:
+                # config ends with the first '});'
+                end = html.find(u"});", m.start())
+                if end >= 0:
+                    page.config = html[m.start():end + 3]
+        else:
+            page.player = True
+            if kind == "container" and page.reactivate_url is None:
+                a = _href.search(html, m.end())
+                if a:
+                    page.reactivate_url = a.group(1).replace(u"&amp;", u"&")
+    return page
+
+
+_detail_markers = re.compile(u"|".join([
+    # og:description is the blurb of the series, only the episode's own description is its plot
+    u"(?:itemprop=[\"']description[\"']\\s+content=\"|class=[\"'][^\"']*\\bepisode_description\\b[^\"']*[\"'][^>]*>\\s*(?:<p[^>]*>)?)(?P<plot>[^\"<]*)",
+    u"(?:itemprop=[\"']duration[\"']\\s+content=[\"']|\"duration\"\\s*:\\s*\")(?P<duration>PT[0-9HMS.]+)",
+    u"(?:itemprop=[\"'](?:uploadDate|datePublished)[\"']\\s+content=[\"']|\"(?:uploadDate|datePublished)\"\\s*:\\s*\")(?P<aired>\\d{4}-\\d{2}-\\d{2})",
+    u"(?:itemprop=[\"']episodeNumber[\"'][^>]*>\\s*|\"episodeNumber\"\\s*:\\s*\"?)(?P<episode>\\d+)",
+    u"<title>[^<]*?(?:Episode|Épisode|Folge|Серия)\\s+(?P<title>\\d+)"]), re.IGNORECASE)
+_iso_duration = re.compile(u"PT(?:(\\d+)H)?(?:(\\d+)M)?(?:(\\d+)(?:\\.\\d+)?S)?")
+
+
+def details(html):
+    """Get plot, duration, air date and episode number of an episode page
+    Parameters:
+      html: HTML page content
+    Returns dict with infoLabels 'plot', 'duration' (seconds), 'aired'
+    (YYYY-MM-DD) and 'episode', missing values are left out
+    """
+    result = {}
+    for m in _detail_markers.finditer(html):
+        kind = m.lastgroup
+        if kind in result:
+            continue
+        value = m.group(kind)
+        if kind == "plot":
+            value = unescape(value).strip()
+        elif kind == "duration":
+            d = _iso_duration.match(value)
+            value = int(d.group(1) or 0) * 3600 + int(d.group(2) or 0) * 60 + int(d.group(3) or 0)
+        elif kind in ("episode", "title"):
+            value = int(value)
+        if value:
+            result[kind] = value
+
+    # episode number from page title is only a fallback
+    title = result.pop("title", None)
+    if title and "episode" not in result:
+        result["episode"] = title
+    return result
@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+# Wakanim - Watch videos from the german anime platform Wakanim.tv on Kodi.
+# Copyright (C) 2017 MrKrabat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import re
+from bs4 import BeautifulSoup, SoupStrainer
+
+
+class Field(object):
+    """How to get one value of an item
+    Parameters:
+      tag, cls: first element below the item with this tag and class,
+                tag None for the item element itself
+      path: child tags to follow from the element, e.g. ("span", "strong")
+      get: attribute name, "string" for the stripped text of the element or
+           a function called with the element
+      count: count matching elements instead of reading the first one
+      convert: function called with the value
+    """
+    def __init__(self, tag=None, cls=None, path=(), get="string", count=False, convert=None):
+        self.tag     = tag
+        self.cls     = cls
+        self.path    = path
+        self.get     = get
+        self.count   = count
+        self.convert = convert
+
+    def find(self, element):
+        """Read value from the first matching element below element
+        """
+        return self.value(element.find(self.tag, {"class": self.cls} if self.cls else {}))
+
+    def value(self, element):
+        """Read value from the selected element
+        """
+        for name in self.path:
+            element = getattr(element, name)
+        if callable(self.get):
+            value = self.get(element)
+        elif self.get == "string":
+            value = element.string.strip()
+        else:
+            value = element[self.get]
+        return self.convert(value) if self.convert else value
+
+
+class Item(object):
+    """Base of compact item records
+    Only values read from the page are stored, constants and aliases of
+    the spec are added by info().
+    """
+    __slots__ = ()
+    _const = {}
+    _alias = {}
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    def values(self):
+        return [getattr(self, name) for name in self.__slots__]
+
+    def info(self):
+        """Item as dict for view.add_item
+        """
+        info = dict(self._const)
+        for name in self.__slots__:
+            info[name] = getattr(self, name)
+        for name, source in self._alias.items():
+            info[name] = info[source]
+        return info
+
+
+class Spec(object):
+    """Declarative description of the items of a page
+    Parameters:
+      name: name of the item records
+      container: (tag, class) of the element holding all items, only this
+                 part of the page is parsed
+      item: (tag, class) of the item elements inside the container
+      fields: list of (name, Field) pairs
+      const: values equal for all items
+      alias: field names which copy the value of another field
+      derive: function called with the info dict to add computed values
+      group: (tag, class, Field) to group items, e.g. by season
+    The fields are compiled once into a plan which reads every item element
+    in one walk over its descendants.
+    """
+    def __init__(self, name, container, item, fields, const=None, alias=None, derive=None, group=None):
+        self.container = container
+        self.item      = item
+        self.fields    = fields
+        self.derive    = derive
+        self.group     = group
+        self.progress  = any(n == "progress" for n, _ in fields)  #: items show the watch progress
+        self.record    = type(name, (Item,), {"__slots__": tuple(n for n, _ in fields),
+                                               "_const":    const or {},
+                                               "_alias":    alias or {}})
+
+        # plan: tag -> list of (class, field index, count)
+        self._plan  = {}
+        self._self  = []
+        self._first = 0
+        for i, (_, field) in enumerate(fields):
+            if field.tag is None:
+                self._self.append(i)
+                continue
+            self._plan.setdefault(field.tag, []).append((field.cls, i, field.count))
+            if not field.count:
+                self._first += 1
+        self._counting = any(f.count for _, f in fields)
+
+    def _read(self, element):
+        """Read all fields of one item element in a single walk
+        """
+        found = [None] * len(self.fields)
+        counts = [0] * len(self.fields)
+        for i in self._self:
+            found[i] = element
+        missing = self._first
+        plan = self._plan
+        for node in element.descendants:
+            selectors = plan.get(node.name)
+            if not selectors:
+                continue
+            classes = node.get("class") or ()
+            for cls, i, count in selectors:
+                if cls is not None and cls not in classes:
+                    continue
+                if count:
+                    counts[i] += 1
+                elif found[i] is None:
+                    found[i] = node
+                    missing -= 1
+            if not missing and not self._counting:
+                break
+
+        values = []
+        for i, (_, field) in enumerate(self.fields):
+            if field.count:
+                values.append(field.convert(counts[i]) if field.convert else counts[i])
+            else:
+                values.append(field.value(found[i]))
+        return self.record(*values)
+
+    def _items(self, root):
+        tag, cls = self.item
+        return [self._read(e) for e in root.find_all(tag, {"class": cls} if cls else {})]
+
+    def extract(self, html):
+        """Get item records of a page
+        Returns list of records, for grouped specs list of (title, records)
+        pairs, or None if the page has no container.
+        """
+        if self.group:
+            tag, cls, field = self.group
+            soup = BeautifulSoup(html, "html.parser", parse_only=SoupStrainer(tag, {"class": cls}))
+            return [(field.find(g), self._items(g)) for g in soup.find_all(tag, {"class": cls})]
+
+        tag, cls = self.container
+        soup = BeautifulSoup(html, "html.parser", parse_only=SoupStrainer(tag, {"class": cls} if cls else {}))
+        root = soup.find(tag, {"class": cls} if cls else {})
+        if not root:
+            return None
+        return self._items(root)
+
+    def info(self, record):
+        """Item record as dict for view.add_item
+        """
+        info = record.info()
+        if self.derive:
+            self.derive(info)
+        return info
+
+    def urls(self, items):
+        """Urls of all items
+        """
+        if self.group:
+            return [r.url for _, records in items for r in records]
+        return [r.url for r in items]
+
+    def dump(self, items):
+        """Items as JSON compatible lists
+        """
+        if self.group:
+            return [[title, [r.values() for r in records]] for title, records in items]
+        return [r.values() for r in items]
+
+    def load(self, data):
+        """Item records from dump()
+        """
+        if self.group:
+            return [(title, [self.record(*v) for v in records]) for title, records in data]
+        return [self.record(*v) for v in data]
+
+
+def showPage(html):
+    """Get informations and seasons/arcs of a show page
+    """
+    soup = BeautifulSoup(html, "html.parser")
+
+    # get values
+    date = soup.find_all("span", {"class": "border-list_text"})[0].find_all("span")
+    year = date[2].string.strip()
+    date = year + "-" + date[1].string.strip() + "-" + date[0].string.strip()
+    originaltitle = soup.find_all("span", {"class": "border-list_text"})[1].string.strip()
+    plot = soup.find("div", {"class": "serie_description"}).get_text().strip()
+    title = soup.find("h1")
+    title = title.get_text().strip() if title else ""
+    credit = soup.find("div", {"class": "serie_description_more"})
+    credit = credit.p.get_text().strip() if credit else ""
+    trailer = soup.find("div", {"class": "TrailerEp-iframeWrapperRatio"})
+    try:
+        # get YouTube trailer
+        trailer = trailer.iframe["src"]
+        trailer = "plugin://plugin.video.youtube/play/?video_id=" + re.search(r"(?:\.be/|/embed)/?([^&=%:/\?]{11})", trailer).group(1)
+    except (AttributeError, TypeError):
+        trailer = ""
+
+    # for every season
+    seasons = []
+    for section in soup.find_all("h2", {"class": "slider-section_title"}):
+        if section.span:
+            seasons.append(section.get_text()[6:].strip())
+
+    return {"title":         title,
+            "year":          year,
+            "premiered":     date,
+            "originaltitle": originaltitle,
+            "plot":          plot,
+            "credits":       credit,
+            "trailer":       trailer,
+            "seasons":       seasons}
+
+
+def thumb(src):
+    """Normalize thumbnail url
+    """
+    src = src.replace(" ", "%20")
+    return src if src[:4] == "http" else "https:" + src
+
+
+def progress(info):
+    """Set playcount from progress
+    """
+    info["playcount"] = "1" if int(info["progress"]) > 90 else "0"
+
+
+def shows(plot):
+    """Fields of show sliders of catalog, search and home page
+    Parameters:
+      plot: index of the plot in the tooltip paragraph
+    """
+    return [("url",    Field("a", get="href")),
+            ("title",  Field("div", "slider_item_description", path=("span", "strong"))),
+            ("thumb",  Field("img", get="src", convert=thumb)),
+            ("rating", Field("div", "stars", get=lambda d: str(10 - len(d.find_all("span", {"class": "-no"})) * 2))),
+            ("plot",   Field("p", "tooltip_text", get=lambda p: p.contents[plot].string.strip())),
+            ("year",   Field("time"))]
+
+
+def episode(url):
+    """Fields of episode sliders
+    """
+    return [("url",      url),
+            ("title",    Field("img", get="alt")),
+            ("thumb",    Field("img", get="src", convert=thumb)),
+            ("progress", Field("div", "ProgressBar", get="data-progress", convert=lambda p: str(int(p))))]
+
+
+CATALOG = Spec("CatalogItem", ("ul", "catalog_list"), ("li", None),
+               shows(3),
+               const={"mode": "list_season"},
+               alias={"tvshowtitle": "title", "fanart": "thumb"})
+
+# search results have no tvshowtitle
+SEARCH = Spec("SearchItem", ("ul", "catalog_list"), ("li", None),
+              shows(3),
+              const={"mode": "list_season"},
+              alias={"fanart": "thumb"})
+
+SIMULCASTS = Spec("SimulcastItem", ("div", "js-slider-lastShow"), ("li", None),
+                  shows(-1),
+                  const={"mode": "list_season"},
+                  alias={"tvshowtitle": "title", "fanart": "thumb"})
+
+LAST_EPISODES = Spec("LastEpisodeItem", ("div", "js-slider-lastEp"), ("li", None),
+                     episode(Field("a", get="href")) + [("plot", Field("a", "slider_item_season"))],
+                     const={"mode": "videoplay"},
+                     alias={"fanart": "thumb"},
+                     derive=progress)
+
+WATCHLIST = Spec("WatchlistItem", ("section", None), ("div", "slider_item"),
+                 episode(Field("div", "slider_item_inner", path=("a",), get="href")) +
+                 [("show", Field("a", "slider_item_season", get=lambda a: a.get("href", "") if a else ""))],
+                 const={"mode": "videoplay"},
+                 alias={"fanart": "thumb"},
+                 derive=progress)
+
+BIG_ITEMS = Spec("BigItem", ("div", "big-item-list"), ("div", "big-item-list_item"),
+                 [("url",   Field("a", get="href", convert=lambda u: u.replace("mydownloads/detail", "catalogue/show").replace("collection/detail", "catalogue/show"))),
+                  ("title", Field("h3", "big-item_title")),
+                  ("thumb", Field("img", get="src", convert=thumb))],
+                 const={"mode": "list_season"},
+                 alias={"fanart": "thumb"})
+
+EPISODES = Spec("EpisodeItem", None, ("li", "slider_item"),
+                episode(Field("a", get="href")),
+                const={"mode": "videoplay"},
+                derive=progress,
+                group=("section", "seasonSection",
+                       Field("h2", "slider-section_title", get=lambda h: h.get_text().split("%", 1)[1].strip())))
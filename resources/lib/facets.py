@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+# Wakanim - Watch videos from the german anime platform Wakanim.tv on Kodi.
+# Copyright (C) 2017 MrKrabat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+import unicodedata
+
+import xbmc
+
+from . import api
+from . import view
+from . import memo
+from . import cache
+from . import extract
+
+
+#: facets and the label of their name
+FACETS = (("year", 30059), ("rating", 30060), ("letter", 30061))
+#: facets selecting values of at least the chosen one
+MINIMUM = ("rating",)
+
+
+def letter(title):
+    """Initial letter of title, # for digits and symbols
+    """
+    for c in unicodedata.normalize("NFKD", title):
+        if c.isalpha():
+            return c.upper()
+        if c.isalnum():
+            break
+    return u"#"
+
+
+def build(items):
+    """Row numbers of catalog items per facet and value
+    """
+    index = dict((name, {}) for name, _ in FACETS)
+    for row, item in enumerate(items):
+        index["year"].setdefault(item.year, []).append(row)
+        index["rating"].setdefault(item.rating, []).append(row)
+        index["letter"].setdefault(letter(item.title), []).append(row)
+    return index
+
+
+def update(args, country, items):
+    """Build facet index of a catalog unless it is up to date
+    Called after the catalog has been extracted, so filtered listings only
+    read the stored catalog and index.
+    Returns the index
+    """
+    entry = cache.Cache(args, "extract").get("catalog:" + country) or {}
+    facets = cache.Cache(args, "facets")
+    stored = facets.get(country)
+    if stored and stored["hash"] == entry.get("hash"):
+        return stored["index"]
+
+    start = time.time()
+    index = build(items)
+    facets.set(country, {"hash": entry.get("hash"), "index": index}, ["country:" + country])
+    facets.save()
+    xbmc.log("[PLUGIN] %s: Built facet index of %d shows in %.3fs" % (args._addonname, len(items), time.time() - start), xbmc.LOGDEBUG)
+    return index
+
+
+def parseFilter(value):
+    """Selected values from filter argument, e.g. 'year:2018,rating:8'
+    """
+    return dict(part.split(":", 1) for part in value.split(",") if ":" in part)
+
+
+def formatFilter(selected):
+    """Filter argument of selected values
+    """
+    return ",".join("%s:%s" % (name, selected[name]) for name, _ in FACETS if name in selected)
+
+
+def values(index, name, value):
+    """Values of facet name matching the selected value
+    """
+    if name in MINIMUM:
+        return [v for v in index[name] if int(v) >= int(value)]
+    return [value]
+
+
+def select(index, selected):
+    """Sorted row numbers of items matching all selected values
+    """
+    rows = None
+    for name, value in selected.items():
+        if name not in index:
+            continue
+        matching = set(row for v in values(index, name, value) for row in index[name].get(v, []))
+        rows = matching if rows is None else rows & matching
+    return sorted(rows) if rows is not None else []
+
+
+def load(args):
+    """Stored catalog items and facet index of the current country
+    The catalog is only loaded if it has never been stored.
+    Returns pair of items and index, None if the catalog can not be loaded
+    """
+    items = memo.stored(args, "catalog:" + args._country, extract.CATALOG)
+    if items is None:
+        html = api.getPage(args, "https://www.wakanim.tv/" + args._country + "/v2/catalogue")
+        if not html:
+            return None
+        items = memo.extract(args, "catalog:" + args._country, html, u"catalog_list", spec=extract.CATALOG, tags=["country:" + args._country], partial=True)
+        if items is None:
+            return None
+    return items, update(args, args._country, items)
+
+
+def showFilter(args):
+    """Show facets to narrow the catalog and the shows matching the filter
+    """
+    loaded = load(args)
+    if not loaded:
+        view.add_item(args, {"title": args._addon.getLocalizedString(30041)})
+        view.endofdirectory(args)
+        return
+    items, index = loaded
+    selected = parseFilter(getattr(args, "filter", ""))
+
+    # facets not filtered yet
+    for name, label in FACETS:
+        if name not in selected:
+            view.add_item(args,
+                          {"title":  args._addon.getLocalizedString(label),
+                           "mode":   "facet",
+                           "facet":  name,
+                           "filter": formatFilter(selected)})
+
+    # for every matching show
+    for row in select(index, selected) if selected else []:
+        view.add_item(args, extract.CATALOG.info(items[row]), isFolder=True, mediatype="video")
+
+    view.endofdirectory(args)
+
+
+def listValues(args):
+    """Show values of a facet with the number of matching shows
+    """
+    loaded = load(args)
+    if not loaded:
+        view.add_item(args, {"title": args._addon.getLocalizedString(30041)})
+        view.endofdirectory(args)
+        return
+    _, index = loaded
+    selected = parseFilter(getattr(args, "filter", ""))
+    name = args.facet
+
+    # newest years and best ratings first
+    for value in sorted(index[name], key=int if name in MINIMUM else None, reverse=name != "letter"):
+        chosen = dict(selected, **{name: value})
+        count = len(select(index, chosen))
+        if not count:
+            continue
+        view.add_item(args,
+                      {"title":  u"%s%s (%d)" % (value, "+" if name in MINIMUM else "", count),
+                       "mode":   "catalog_filter",
+                       "filter": formatFilter(chosen)})
+
+    view.endofdirectory(args)
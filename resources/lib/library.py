@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+# Wakanim - Watch videos from the german anime platform Wakanim.tv on Kodi.
+# Copyright (C) 2017 MrKrabat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import re
+import time
+import hashlib
+from xml.sax.saxutils import escape
+
+import xbmc
+import xbmcgui
+import xbmcvfs
+
+from . import api
+from . import pool
+from . import memo
+from . import cache
+from . import extract
+
+
+# number in season titles like 'Staffel 2' or 'Saison 2 VF'
+_season = re.compile(r"(?:Staffel|Saison|Season|Сезон)\s*(\d+)", re.IGNORECASE)
+# number in episode titles like 'Episode 3'
+_episode = re.compile(r"(?:Episode|Épisode|Folge|Серия)\s*(\d+)", re.IGNORECASE)
+
+
+def export(args):
+    """Export shows of watchlist and collection to the Kodi library
+    Only new or changed files are written and files of vanished episodes
+    are removed. The state of the last export is kept in a manifest.
+    """
+    root = args._addon.getSetting("library_path")
+    if not root:
+        args._addon.openSettings()
+        return
+
+    start = time.time()
+    shows = getShows(args)
+    if shows is None:
+        xbmcgui.Dialog().notification(args._addonname, args._addon.getLocalizedString(30041), xbmcgui.NOTIFICATION_ERROR)
+        return
+
+    # load all shows in parallel
+    details = cache.Cache(args, "episodes")
+    urls = sorted(shows.keys())
+    files = {}
+    failed = set()
+    loaded = []
+    for url, show in zip(urls, pool.map(lambda u: loadShow(args, u, shows[u]), urls, 4)):
+        if show:
+            loaded.append(show)
+        else:
+            failed.add(url)
+
+    # shows with the same title must not share a folder
+    names = [cleanName(show["title"]) for show in loaded]
+    for name, show in zip(names, loaded):
+        if names.count(name) > 1:
+            name = "%s [%s]" % (name, re.search(r"/show/(\d+)", show["url"]).group(1))
+        files.update(showFiles(args, show, details, name))
+
+    written, removed = sync(args, root, files, failed)
+    xbmc.log("[PLUGIN] %s: Library export of %d shows, %d files written, %d removed in %.2fs" % (args._addonname, len(shows), written, removed, time.time() - start), xbmc.LOGNOTICE)
+
+    if written or removed:
+        xbmc.executebuiltin("UpdateLibrary(video)")
+    xbmcgui.Dialog().notification(args._addonname, args._addon.getLocalizedString(30048) % (written, removed))
+
+
+def getShows(args):
+    """Get urls and titles of all shows in watchlist and collection
+    """
+    shows = {}
+
+    # collection contains shows
+    html = api.getPage(args, "https://www.wakanim.tv/" + args._country + "/v2/collection", priority=api.BACKGROUND)
+    if not html:
+        return None
+    tags = ["country:" + args._country, "account"]
+    for item in memo.extract(args, "collection:" + args._country, html, u"big-item-list", spec=extract.BIG_ITEMS, tags=tags) or []:
+        shows[item.url] = item.title
+
+    # watchlist contains episodes linked to their show
+    html = api.getPage(args, "https://www.wakanim.tv/" + args._country + "/v2/watchlist", priority=api.BACKGROUND)
+    if not html:
+        return None
+    for item in memo.extract(args, "watchlist:" + args._country, html, u"<section", spec=extract.WATCHLIST, tags=tags) or []:
+        if "/catalogue/show/" in item.show and item.show not in shows:
+            shows[item.show] = ""
+
+    return shows
+
+
+def loadShow(args, url, title):
+    """Get title, plot and all episodes of a show
+    """
+    html = api.getPage(args, "https://www.wakanim.tv" + url, login=False, priority=api.BACKGROUND)
+    if not html:
+        return None
+    tags = cache.pageTags([url])
+    page = memo.extract(args, "show:" + url, html, (u"TrailerEp-iframeWrapperRatio", u"border-list_text", u"serie_description"), extract.showPage, tags=tags)
+    # without login, the watch progress is not stored with the listings of the plugin
+    seasons = memo.extract(args, "library:" + url, html, u"seasonSection", spec=extract.EPISODES, tags=tags) or []
+
+    show = {"url":     url,
+            "title":   title or page.get("title") or url.rstrip("/").rsplit("/", 1)[-1],
+            "plot":    page["plot"],
+            "seasons": []}
+
+    # for every season
+    for season, records in seasons:
+        episodes = []
+
+        # for every episode
+        for record in records:
+            m = re.search(r"/episode/(\d+)", record.url)
+            if not m:
+                continue
+            episodes.append({"id":    m.group(1),
+                             "url":   record.url,
+                             "title": record.title,
+                             "thumb": record.thumb})
+        show["seasons"].append({"title": season, "episodes": episodes})
+
+    return show
+
+
+def showFiles(args, show, details, folder):
+    """Build strm and nfo files of a show
+    Season and episode numbers are read from the page, so files keep their
+    names if the site reorders or inserts entries. The position is used
+    only for entries without a number.
+    Returns dict with relative path as key and a tuple of file content and
+    show url as value.
+    """
+    files = {folder + "/tvshow.nfo": nfo("tvshow",
+                                         [("title", show["title"]),
+                                          ("plot",  show["plot"])])}
+
+    for position, season in enumerate(show["seasons"], 1):
+        m = _season.search(season["title"])
+        s = int(m.group(1)) if m else position
+        for e, episode in enumerate(season["episodes"], 1):
+            info = details.get(episode["url"]) or {}
+            m = _episode.search(episode["title"])
+            e = info.get("episode") or (int(m.group(1)) if m else e)
+            name = "%s/S%02dE%02d - %s" % (folder, s, e, cleanName(episode["title"]))
+            if name + ".strm" in files:
+                # e.g. seasons of dubbed and subtitled episodes
+                name += " [%s]" % episode["id"]
+            files[name + ".strm"] = "plugin://" + args._addonid + "/?id=" + episode["id"]
+            files[name + ".nfo"] = nfo("episodedetails",
+                                       [("title",     episode["title"]),
+                                        ("showtitle", show["title"]),
+                                        ("season",    s),
+                                        ("episode",   e),
+                                        ("plot",      info.get("plot", "")),
+                                        ("aired",     info.get("aired", "")),
+                                        ("runtime",   info.get("duration", 0) // 60 or ""),
+                                        ("thumb",     episode["thumb"])])
+    return dict((path, (content, show["url"])) for path, content in files.items())
+
+
+def sync(args, root, files, failed):
+    """Write changed files and remove vanished files
+    Files of shows which failed to load are kept.
+    Returns number of written and removed files.
+    """
+    manifest = cache.Cache(args, "library")
+    root = root.rstrip("/\\") + "/"
+    written = 0
+    removed = 0
+
+    # write new or changed files
+    for path, (content, show) in files.items():
+        content = content.encode("utf-8")
+        digest = hashlib.md5(content).hexdigest()
+        if manifest.get(path, [None])[0] == digest:
+            continue
+        folder = root + path.rsplit("/", 1)[0] + "/"
+        if not xbmcvfs.exists(folder):
+            xbmcvfs.mkdirs(folder)
+        f = xbmcvfs.File(root + path, "w")
+        f.write(bytearray(content))
+        f.close()
+        manifest.set(path, [digest, show])
+        written += 1
+
+    # remove files of vanished episodes and shows
+    folders = set()
+    for path in manifest.keys():
+        if path in files or manifest.get(path)[1] in failed:
+            continue
+        xbmcvfs.delete(root + path)
+        manifest.delete(path)
+        folders.add(root + path.rsplit("/", 1)[0] + "/")
+        removed += 1
+    for folder in folders:
+        dirs, remaining = xbmcvfs.listdir(folder)
+        if not dirs and not remaining:
+            xbmcvfs.rmdir(folder)
+
+    manifest.save()
+    return written, removed
+
+
+def nfo(tag, values):
+    """Create nfo file content
+    """
+    lines = [u"<?xml version=\"1.0\" encoding=\"UTF-8\" standalone=\"yes\"?>", u"<" + tag + u">"]
+    for key, value in values:
+        if value or value == 0:
+            lines.append(u"    <%s>%s</%s>" % (key, escape(u"%s" % value), key))
+    lines.append(u"</" + tag + u">")
+    return u"\n".join(lines) + u"\n"
+
+
+def cleanName(name):
+    """Remove characters not allowed in file names
+    """
+    return re.sub(r"[\\/:*?\"<>|]", "", name).strip(" .") or "_"
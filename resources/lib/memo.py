@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+# Wakanim - Watch videos from the german anime platform Wakanim.tv on Kodi.
+# Copyright (C) 2017 MrKrabat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import time
+import struct
+import hashlib
+
+import xbmc
+
+from . import cache
+from . import snapshot
+from .api import getProfilePath
+
+
+#: extracted pages kept, the least recently used are dropped
+MAX_ENTRIES = 200
+#: snapshots without entry are removed after this many seconds
+ORPHAN_AGE = 60
+#: seconds after which the entry of an unchanged page is marked as current
+TOUCH = 300
+
+
+def container(html, markers):
+    """Part of the page holding the items
+    Starts at the first of markers and ends before the footer, so header
+    parts like tokens or the user menu do not change the hash.
+    """
+    if not isinstance(markers, tuple):
+        markers = (markers,)
+    found = [i for i in (html.find(m) for m in markers) if i >= 0]
+    if not found:
+        return None
+    start = min(found)
+    end = html.find(u"<footer", start)
+    return html[start:end if end >= 0 else len(html)]
+
+
+def getFolder(args):
+    """Folder of the item snapshots
+    """
+    path = getProfilePath(args, u"snapshots")
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    return path
+
+
+def store(args, kind, digest, spec, items):
+    """Write items to a snapshot file, returns its name
+    The name depends on kind and page hash, so an open snapshot of an
+    older page is never overwritten. Older snapshots of kind are removed.
+    """
+    prefix = hashlib.sha1(kind.encode("utf-8")).hexdigest()[:16]
+    name = prefix + "-" + digest[:16] + ".snap"
+    folder = getFolder(args)
+    snapshot.write(os.path.join(folder, name), spec, items)
+    for old in os.listdir(folder):
+        if old.startswith(prefix) and old != name:
+            try:
+                os.remove(os.path.join(folder, old))
+            except OSError:
+                # still mapped by another process
+                pass
+    return name
+
+
+def prune(args, memo):
+    """Drop least recently used pages above MAX_ENTRIES and snapshot files
+    no entry refers to, e.g. of invalidated entries
+    """
+    keys = [k for k in memo.keys() if not k.startswith("_")]
+    dropped = set()
+    if len(keys) > MAX_ENTRIES:
+        keys.sort(key=memo.age)
+        for key in keys[MAX_ENTRIES:]:
+            dropped.add(memo.get(key).get("snapshot"))
+            memo.delete(key)
+        xbmc.log("[PLUGIN] %s: Dropped %d extracted pages" % (args._addonname, len(keys) - MAX_ENTRIES), xbmc.LOGDEBUG)
+
+    used = set(memo.get(k).get("snapshot") for k in keys[:MAX_ENTRIES])
+    folder = getFolder(args)
+    now = time.time()
+    for name in os.listdir(folder):
+        path = os.path.join(folder, name)
+        try:
+            # a snapshot just written by another invocation has no entry yet
+            if name in dropped or (name not in used and now - os.path.getmtime(path) > ORPHAN_AGE):
+                os.remove(path)
+        except OSError:
+            # removed meanwhile or still mapped by another process
+            pass
+
+
+def load(args, entry, spec):
+    """Items of a stored extraction, None if they can not be read
+    Snapshots stay mapped for the records read on access, until release().
+    """
+    if "items" in entry:
+        return spec.load(entry["items"])
+    try:
+        mapped = snapshot.Snapshot(os.path.join(getFolder(args), entry["snapshot"]))
+    except (IOError, OSError, ValueError, KeyError, struct.error):
+        return None
+    args._snapshots.append(mapped)
+    return mapped.load(spec)
+
+
+def release(args):
+    """Close snapshots mapped by the invocation, its records can not be
+    read anymore
+    """
+    while args._snapshots:
+        args._snapshots.pop().close()
+
+
+def extract(args, kind, html, marker, func=None, spec=None, tags=None, partial=False):
+    """Extract items of a page, reuse result of an unchanged page
+    Parameters:
+      kind: page type and all parameters the extraction depends on
+      html: HTML page content
+      marker: text at the start of the container with the items, or tuple
+              of texts of which the first found in html is used
+      func: function extracting the items from html, may return None
+      spec: extract.Spec used instead of func, records with watch progress
+            are tagged with their show and episode ids
+      tags: tags of the stored items, see cache.Cache.set()
+      partial: only some records are read, e.g. one season, the records
+               of spec are stored in a snapshot file read row by row,
+               otherwise in the cache, which is faster to read in full
+    Returns the result of func
+    """
+    if spec:
+        func = spec.extract
+    record = spec.record.__name__ if spec else None
+    part = container(html, marker)
+    if part is None:
+        return func(html)
+    digest = hashlib.sha1(part.encode("utf-8")).hexdigest()
+
+    memo = cache.Cache(args, "extract")
+    # statistics are counted without writing the cache on every reuse
+    counters = cache.Counters(args, "extract")
+    entry = memo.get(kind)
+    if entry and entry["hash"] == digest and entry.get("record") == record:
+        items = load(args, entry, spec) if spec else entry["items"]
+        if items is not None:
+            # page unchanged, skip parsing
+            counters.add("_stats", {"skipped": 1, "saved": entry["time"]})
+            if memo.age(kind) > TOUCH:
+                # age() and pruning count from the last check, not the last parse
+                memo.touch(kind)
+                counters.flush(memo)
+                memo.save()
+            stats = counters.get(memo, "_stats", {})
+            xbmc.log("[PLUGIN] %s: Reused items of '%s', saved %.3fs (%d parses skipped, %.1fs saved in total)" % (args._addonname, kind, entry["time"], stats.get("skipped", 0), stats.get("saved", 0.0)), xbmc.LOGDEBUG)
+            return items
+
+    start = time.time()
+    items = func(html)
+    if items is not None:
+        counters.add("_stats", {"parsed": 1})
+        entry = {"hash":   digest,
+                 "time":   time.time() - start,
+                 "record": record}
+        if spec and spec.progress:
+            # only listings showing the watch state change with it
+            tags = list(tags or []) + cache.pageTags(spec.urls(items))
+        if spec and partial:
+            try:
+                entry["snapshot"] = store(args, kind, digest, spec, items)
+            except (IOError, OSError) as e:
+                xbmc.log("[PLUGIN] %s: Failed to write snapshot of '%s': %s" % (args._addonname, kind, e), xbmc.LOGERROR)
+                entry["items"] = spec.dump(items)
+        else:
+            entry["items"] = spec.dump(items) if spec else items
+        memo.set(kind, entry, tags)
+        counters.flush(memo)
+        prune(args, memo)
+        memo.save()
+    return items
+
+
+def stored(args, kind, spec):
+    """Items of the last extraction of kind without any page, None if unknown
+    """
+    entry = cache.Cache(args, "extract").get(kind)
+    if not entry or entry.get("record") != spec.record.__name__:
+        return None
+    return load(args, entry, spec)
+
+
+def age(args, kind):
+    """Seconds since the items of kind have been extracted or found
+    unchanged, at most TOUCH seconds more, None if unknown
+    """
+    return cache.Cache(args, "extract").age(kind)
@@ -48,6 +48,10 @@ class Args(object):
         self._addonname = sys.modules["__main__"]._plugin
         self._addonid   = sys.modules["__main__"]._plugId
         self._cj        = None
+        self._cookies   = None  #: content of the cookie file when loaded
+        self._snapshots = []    #: snapshots mapped by memo.load, see memo.release
+        self._items     = None  #: collected directory items in service
+        self._done      = None  #: called with collected items in service
 
         for key, value in kwargs.items():
             if value:
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+# Wakanim - Watch videos from the german anime platform Wakanim.tv on Kodi.
+# Copyright (C) 2017 MrKrabat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import ssl
+import json
+import time
+import socket
+import threading
+try:
+    from httplib import HTTPSConnection, HTTPResponse, HTTPException
+    from urllib2 import HTTPSHandler as _HTTPSHandler, URLError
+except ImportError:
+    from http.client import HTTPSConnection, HTTPResponse, HTTPException
+    from urllib.request import HTTPSHandler as _HTTPSHandler
+    from urllib.error import URLError
+
+import xbmc
+import xbmcgui
+
+
+#: seconds resolved addresses are used
+DNS_TTL = 300
+#: window property with resolved addresses, shared by all invocations
+DNS_PROPERTY = "plugin.video.wakanim.dns"
+#: idle connections kept per host
+IDLE = 4
+#: seconds an idle connection is kept, servers close them after a while
+KEEPALIVE = 30
+
+#: TLS context of the process, sessions can only be resumed with it
+_context  = ssl.create_default_context()
+#: guards module data
+_lock     = threading.Lock()
+#: host -> [expiry time, address]
+_dns      = {}
+#: host -> ssl.SSLSession
+_sessions = {}
+#: average seconds of uncached lookups and of full handshakes
+_average  = {"dns": [0.0, 0], "tls": [0.0, 0]}
+#: host -> list of [idle since, Connection]
+_idle     = {}
+
+
+def _measured(kind, seconds):
+    with _lock:
+        total, count = _average[kind]
+        _average[kind] = [total + seconds, count + 1]
+
+
+def _mean(kind):
+    with _lock:
+        total, count = _average[kind]
+    return total / count if count else 0.0
+
+
+def resolve(host, port, fresh=False):
+    """Get address of host, cached for DNS_TTL seconds
+    Returns tuple of (address, port) and True if it was cached
+    """
+    now = time.time()
+    if not fresh:
+        with _lock:
+            entry = _dns.get(host)
+        if not entry:
+            # resolved by another invocation
+            try:
+                entry = json.loads(xbmcgui.Window(10000).getProperty(DNS_PROPERTY) or "{}").get(host)
+            except ValueError:
+                entry = None
+        if entry and entry[0] > now:
+            return (entry[1], port), True
+
+    start = time.time()
+    address = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)[0][4][0]
+    _measured("dns", time.time() - start)
+    with _lock:
+        _dns[host] = [now + DNS_TTL, address]
+        shared = dict((k, v) for k, v in _dns.items() if v[0] > now)
+    xbmcgui.Window(10000).setProperty(DNS_PROPERTY, json.dumps(shared))
+    return (address, port), False
+
+
+def acquire(host, timeout):
+    """Idle connection to host, a new one if there is none
+    Returns the connection and True if it has been used before
+    """
+    now = time.time()
+    with _lock:
+        idle = _idle.get(host, [])
+        while idle:
+            since, conn = idle.pop()
+            if now - since < KEEPALIVE:
+                conn.timeout = timeout
+                if conn.sock is not None:
+                    conn.sock.settimeout(timeout if isinstance(timeout, (int, float)) else socket.getdefaulttimeout())
+                return conn, True
+            conn.close()
+    return Connection(host, timeout=timeout, context=_context), False
+
+
+def release(host, conn):
+    """Keep connection for the next request to host
+    """
+    with _lock:
+        idle = _idle.setdefault(host, [])
+        if len(idle) < IDLE:
+            idle.append([time.time(), conn])
+            return
+    conn.close()
+
+
+class Response(HTTPResponse):
+    """Response which hands its connection back once the body has been read
+    """
+    #: called when the body has been read completely
+    done = None
+
+    def _close_conn(self):
+        HTTPResponse._close_conn(self)
+        done, self.done = self.done, None
+        if done:
+            done()
+
+    def close(self):
+        if self.fp is not None:
+            # unread data is left on the connection
+            self.done = None
+        HTTPResponse.close(self)
+
+
+class Connection(HTTPSConnection):
+    """HTTPS connection with cached DNS and resumed TLS sessions
+    """
+    response_class = Response
+
+    def connect(self):
+        if getattr(self, "_tunnel_host", None):
+            # connections through a proxy are left alone
+            return HTTPSConnection.connect(self)
+
+        start = time.time()
+        address, cached = resolve(self.host, self.port or 443)
+        resolved = time.time()
+        try:
+            sock = socket.create_connection(address, self.timeout)
+        except socket.error:
+            if not cached:
+                raise
+            # address has changed
+            address, cached = resolve(self.host, self.port or 443, True)
+            sock = socket.create_connection(address, self.timeout)
+        connected = time.time()
+
+        kwargs = {"server_hostname": self.host}
+        with _lock:
+            session = _sessions.get(self.host)
+        if session is not None:
+            kwargs["session"] = session
+        self.sock = _context.wrap_socket(sock, **kwargs)
+        done = time.time()
+
+        reused = getattr(self.sock, "session_reused", False)
+        if not reused:
+            _measured("tls", done - connected)
+        saved = (_mean("dns") if cached else 0.0) + (max(0.0, _mean("tls") - (done - connected)) if reused else 0.0)
+        xbmc.log("[PLUGIN] Wakanim: Connected to %s in %.3fs (dns %.3fs%s, tls %.3fs%s), %.3fs saved" % (self.host, done - start, resolved - start, " cached" if cached else "", done - connected, " resumed" if reused else "", saved), xbmc.LOGDEBUG)
+
+    def getresponse(self, *args, **kwargs):
+        # the connection may drop its socket when the response is read
+        sock = self.sock
+        response = HTTPSConnection.getresponse(self, *args, **kwargs)
+        # session tickets of TLS 1.3 arrive after the handshake
+        session = getattr(sock, "session", None)
+        if session is not None:
+            with _lock:
+                _sessions[self.host] = session
+        return response
+
+
+class HTTPSHandler(_HTTPSHandler):
+    """urllib handler using Connection
+    Connections are kept alive and reused by the next request to the same
+    host, so a process sending several requests, like the service, only
+    connects once. A kept connection closed by the server meanwhile is
+    replaced by a new one.
+    """
+    def https_open(self, req):
+        if getattr(req, "_tunnel_host", None):
+            # connections through a proxy are left alone
+            return self.do_open(Connection, req, context=_context)
+
+        headers = dict(req.unredirected_hdrs)
+        headers.update((k, v) for k, v in req.headers.items() if k not in headers)
+        headers = dict((k.title(), v) for k, v in headers.items())
+        headers["Connection"] = "keep-alive"
+        host = req.host
+
+        while True:
+            conn, reused = acquire(host, req.timeout)
+            try:
+                conn.request(req.get_method(), req.selector, req.data, headers)
+                response = conn.getresponse()
+                break
+            except (socket.error, HTTPException) as e:
+                conn.close()
+                if not reused:
+                    raise URLError(e)
+
+        if not response.will_close:
+            response.done = lambda: release(host, conn)
+        response.url = req.get_full_url()
+        response.msg = response.reason
+        return response
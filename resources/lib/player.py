@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+# Wakanim - Watch videos from the german anime platform Wakanim.tv on Kodi.
+# Copyright (C) 2017 MrKrabat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import re
+import ssl
+import json
+import threading
+try:
+    from urllib2 import URLError
+except ImportError:
+    from urllib.error import URLError
+
+import xbmc
+import xbmcgui
+
+from . import api
+from . import cache
+
+
+class PlaybackMonitor(xbmc.Player):
+    """Follows the playback of one stream
+    Reacts to Kodi player events to resume playback and to report the
+    playtime back to Wakanim. Between events the monitor sleeps in
+    waitForAbort, so it costs nothing and stops at once on Kodi shutdown.
+    Events only set flags, dialogs and requests run in run(), so they never
+    block the player callback thread of Kodi.
+    """
+    #: seconds between progress reports while the video is playing
+    interval = 10
+    #: seconds to wait for the video to start
+    timeout = 20
+
+    def __init__(self, args, url, showid, episodeid, proxy=None):
+        xbmc.Player.__init__(self)
+        self._args      = args
+        self._url       = url
+        self._showid    = showid     #: None to not report the playtime
+        self._episodeid = episodeid
+        self._proxy     = proxy      #: local stream proxy to watch
+        self._monitor   = xbmc.Monitor()
+        self._lock      = threading.Lock()
+        self._started   = False
+        self._finished  = False
+        self._changed   = False      #: position changed by the user, report soon
+        self._playtime  = 0.0
+        self._duration  = 0.0
+        self._requests  = 0          #: proxy requests seen at the last check
+
+    def run(self):
+        """Block until playback has finished or Kodi shuts down
+        """
+        # wait for video to begin
+        waited = 0
+        while not self._started:
+            if self._finished:
+                return
+            if self._playing():
+                # started before the monitor was created, no event will come
+                self._start()
+                continue
+            if waited >= self.timeout:
+                if self._proxy and self._streaming():
+                    # slow start, Kodi still reads the stream through the proxy
+                    waited = 0
+                    continue
+                xbmc.log("[PLUGIN] %s: Timeout reached, video did not start in %d seconds" % (self._args._addonname, self.timeout), xbmc.LOGERROR)
+                return
+            if self._monitor.waitForAbort(1):
+                return
+            waited += 1
+
+        self._resume()
+        self._report()
+
+        # track position every second, report it regularly and on changes
+        waited = 0
+        while not self._finished:
+            if self._monitor.waitForAbort(1):
+                xbmc.log("[PLUGIN] %s: Kodi is shutting down, stop playback monitor" % self._args._addonname, xbmc.LOGDEBUG)
+                return
+            self._position()
+            waited += 1
+            if (waited >= self.interval or self._changed) and not self._finished:
+                waited = 0
+                self._changed = False
+                self._send()
+                if self._proxy:
+                    xbmc.log("[PLUGIN] %s: Proxy %s" % (self._args._addonname, self._proxy.stats()), xbmc.LOGDEBUG)
+        self._finish()
+
+    def _playing(self):
+        """Check if Kodi plays the video of this monitor
+        """
+        try:
+            return self.isPlayingVideo() and self.getPlayingFile() == self._url
+        except RuntimeError:
+            return False
+
+    def _streaming(self):
+        """Check if Kodi is busy with the stream of the proxy
+        True while the player is active or the proxy served requests since
+        the last check.
+        """
+        requests = self._proxy.stats()["requests"]
+        busy = requests != self._requests or self.isPlaying()
+        self._requests = requests
+        return busy
+
+    def _start(self):
+        """Mark the video as started, by the event or by run() if the event
+        came before the monitor existed, whichever is first
+        """
+        with self._lock:
+            if self._started or self._finished:
+                return
+            try:
+                if self._url != self.getPlayingFile():
+                    # another file is playing
+                    self._finished = True
+                    return
+            except RuntimeError:
+                return
+            self._started = True
+
+    def _resume(self):
+        """Ask if user want to continue playback
+        """
+        resume = int(getattr(self._args, "progress", 0))
+        if resume >= 5 and resume <= 90:
+            self.pause()
+            if xbmcgui.Dialog().yesno(self._args._addonname, self._args._addon.getLocalizedString(30045) % resume):
+                self.seekTime(self.getTotalTime() * (resume/100.0))
+            self.pause()
+
+    def onAVStarted(self):
+        """Video and audio streams are ready
+        """
+        self._start()
+
+    def onPlayBackStarted(self):
+        """Kodi 17 has no onAVStarted event
+        """
+        version = re.match(r"\d+", xbmc.getInfoLabel("System.BuildVersion"))
+        if version and int(version.group(0)) < 18:
+            self._start()
+
+    def onPlayBackSeek(self, time, seekOffset):
+        """User jumped to another position
+        """
+        self._changed = True
+
+    def onPlayBackPaused(self):
+        """User paused the video
+        """
+        self._changed = True
+
+    def onPlayBackStopped(self):
+        """User stopped the video
+        """
+        self._finished = True
+
+    def onPlayBackEnded(self):
+        """Video played until the end
+        """
+        self._finished = True
+
+    def onPlayBackError(self):
+        """Video could not be played
+        """
+        self._finished = True
+
+    def _finish(self):
+        """Send last known playtime, at most a second old
+        """
+        self._send()
+        if self._showid is not None and self._duration and self._playtime / self._duration > 0.9:
+            # episode is watched now, drop cached listings showing it
+            cache.invalidate(self._args, ["show:%s" % self._showid, "episode:%s" % self._episodeid])
+        xbmc.log("[PLUGIN] %s: Playback finished" % self._args._addonname, xbmc.LOGDEBUG)
+
+    def _position(self):
+        """Read playtime from player
+        """
+        try:
+            if self._url != self.getPlayingFile():
+                self._finished = True
+                return
+            playtime = self.getTime()
+            duration = self.getTotalTime()
+        except RuntimeError:
+            # player is not playing anything anymore, keep the last position
+            return
+        if not self._finished:
+            # a stopped player may already report 0
+            self._playtime = playtime
+            self._duration = duration
+
+    def _report(self):
+        """Read playtime from player and send it to Wakanim
+        """
+        self._position()
+        self._send()
+
+    def _send(self):
+        """Send playtime to Wakanim
+        """
+        if not self._duration or self._showid is None:
+            return
+
+        # calculate message
+        post = {"ShowId":          self._showid,
+                "EpisodeId":       self._episodeid,
+                "PlayTime":        self._playtime,
+                "Duration":        self._duration,
+                "TotalPlayedTime": 4,
+                "FromSVOD":        "true"}
+
+        # send data
+        url = "https://www.wakanim.tv/" + self._args._country + "/v2/svod/saveplaytimeprogress"
+        try:
+            with api.scheduler.request(url, api.PROGRESS):
+                response = api.openUrl(url, json.dumps(post).encode("utf-8"), {"Content-type": "application/json"})
+                response.read()
+        except (ssl.SSLError, URLError):
+            # catch timeout exception
+            pass
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+# Wakanim - Watch videos from the german anime platform Wakanim.tv on Kodi.
+# Copyright (C) 2017 MrKrabat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import re
+import time
+import hashlib
+import traceback
+
+import xbmc
+import xbmcgui
+import xbmcaddon
+
+from . import api
+from . import memo
+from . import cache
+from . import model
+from . import extract
+from . import wakanim
+
+
+#: requests per hour at most
+MAX_REQUESTS = 12
+
+# id of episode links
+_episode = re.compile(r"/catalogue/episode/(\d+)")
+
+
+class Poller(object):
+    """Looks for new episodes on the home page and the watchlist
+    Pages are requested conditionally and only the set of episode ids is
+    read from them. Items are extracted only when new ids have shown up.
+    """
+    def __init__(self, session):
+        self._session = session
+
+    def _args(self):
+        """Arguments of a background request
+        """
+        args = model.parse(["plugin://plugin.video.wakanim/", "-1", ""])
+        args._addon = xbmcaddon.Addon(id=args._addonid)
+        wakanim.setCountry(args)
+        return args
+
+    def run(self, monitor):
+        """Poll until Kodi shuts down
+        """
+        while not monitor.waitForAbort(60):
+            addon = xbmcaddon.Addon()
+            if addon.getSetting("poll_episodes") != "true":
+                continue
+            snapshots = None
+            try:
+                args = self._args()
+                snapshots = cache.Cache(args, "poller")
+                interval = int(addon.getSetting("poll_interval") or 60) * 60
+                if snapshots.age("_last") is not None and snapshots.age("_last") < interval:
+                    continue
+                snapshots.set("_last", True)
+                self.poll(args, snapshots)
+            except Exception:
+                xbmc.log("[PLUGIN] Wakanim: Polling failed\n%s" % traceback.format_exc(), xbmc.LOGERROR)
+            if snapshots:
+                snapshots.save()
+
+    def _allowed(self, snapshots):
+        """Count request, False if the hourly cap is reached
+        """
+        now = time.time()
+        requests = [t for t in snapshots.get("_requests", []) if now - t < 3600]
+        if len(requests) >= MAX_REQUESTS:
+            return False
+        snapshots.set("_requests", requests + [now])
+        return True
+
+    def poll(self, args, snapshots):
+        """Check home page and watchlist once
+        """
+        self._session.attach(args)
+        new = []
+        for url, marker, spec in (("https://www.wakanim.tv/" + args._country + "/v2", u"js-slider-lastEp", extract.LAST_EPISODES),
+                                  ("https://www.wakanim.tv/" + args._country + "/v2/watchlist", u"<section", extract.WATCHLIST)):
+            if not self._allowed(snapshots):
+                xbmc.log("[PLUGIN] %s: Polling paused, %d requests per hour reached" % (args._addonname, MAX_REQUESTS), xbmc.LOGDEBUG)
+                break
+            new.extend(self.check(args, snapshots, url, marker, spec))
+        self._session.save(args)
+
+        # one notification per poll
+        new = [title for i, title in enumerate(new) if title not in new[:i]]
+        if len(new) == 1:
+            xbmcgui.Dialog().notification(args._addonname, args._addon.getLocalizedString(30051) % new[0])
+        elif new:
+            xbmcgui.Dialog().notification(args._addonname, args._addon.getLocalizedString(30052) % len(new))
+
+    def check(self, args, snapshots, url, marker, spec):
+        """Compare episode ids of url with the last snapshot
+        Returns titles of new episodes
+        """
+        start = time.time()
+        snapshot = snapshots.get(url, {})
+        html, validators = api.getConditional(args, url, snapshot.get("validators", {}))
+        if html is None:
+            xbmc.log("[PLUGIN] %s: Poll of '%s' not modified (%.3fs)" % (args._addonname, url, time.time() - start), xbmc.LOGDEBUG)
+            return []
+
+        part = memo.container(html, marker)
+        if part is None or not api.isLoggedin(html):
+            # watchlist needs the session of the plugin
+            return []
+        digest = hashlib.sha1(part.encode("utf-8")).hexdigest()
+        if digest == snapshot.get("hash"):
+            snapshots.set(url, dict(snapshot, validators=validators))
+            xbmc.log("[PLUGIN] %s: Poll of '%s' unchanged (%.3fs)" % (args._addonname, url, time.time() - start), xbmc.LOGDEBUG)
+            return []
+
+        ids = sorted(set(_episode.findall(part)))
+        added = set(ids) - set(snapshot.get("ids", ids))
+        snapshots.set(url, {"validators": validators, "hash": digest, "ids": ids})
+        if not added:
+            return []
+
+        # only now the items are extracted
+        titles = []
+        for record in spec.extract(html) or []:
+            m = _episode.search(record.url)
+            if m and m.group(1) in added:
+                titles.append(record.title)
+        xbmc.log("[PLUGIN] %s: Poll of '%s' found %d new episodes (%.3fs)" % (args._addonname, url, len(added), time.time() - start), xbmc.LOGNOTICE)
+        return titles
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+# Wakanim - Watch videos from the german anime platform Wakanim.tv on Kodi.
+# Copyright (C) 2017 MrKrabat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import threading
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+
+import xbmc
+
+
+class Pool(object):
+    """Bounded pool of worker threads
+    Threads are started on demand up to size and stop after join().
+    """
+    def __init__(self, size):
+        self._size    = max(1, size)
+        self._queue   = Queue()
+        self._threads = []
+
+    def submit(self, func, *args):
+        """Run func(*args) on one of the workers
+        """
+        self._queue.put((func, args))
+        if len(self._threads) < self._size:
+            t = threading.Thread(target=self._worker)
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+    def join(self):
+        """Wait until all submitted tasks are done
+        """
+        for _ in self._threads:
+            self._queue.put(None)
+        for t in self._threads:
+            t.join()
+        self._threads = []
+
+    def _worker(self):
+        """Process tasks until join() is called
+        """
+        while True:
+            task = self._queue.get()
+            if task is None:
+                return
+            func, args = task
+            try:
+                func(*args)
+            except Exception as e:
+                xbmc.log("[PLUGIN] Wakanim: Worker task failed: %s" % e, xbmc.LOGERROR)
+
+
+def map(func, items, size):
+    """Apply func to every item in parallel
+    Returns the results in order of items, None for failed tasks.
+    """
+    items = list(items)
+    results = [None] * len(items)
+
+    def run(i, item):
+        results[i] = func(item)
+
+    pool = Pool(min(size, len(items)))
+    for i, item in enumerate(items):
+        pool.submit(run, i, item)
+    pool.join()
+    return results
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+# Wakanim - Watch videos from the german anime platform Wakanim.tv on Kodi.
+# Copyright (C) 2017 MrKrabat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+
+import xbmc
+
+from . import api
+from . import pool
+from . import memo
+from . import cache
+from . import extract
+
+
+#: show pages fetched ahead per listing
+BUDGET = 4
+#: parallel fetches
+WORKERS = 2
+#: prefetched show pages are used this many seconds
+MAXAGE = 300
+#: pending history entries written without waiting for the next prefetch
+FLUSH = 20
+
+
+def rank(args, urls, recent):
+    """Most likely next shows of a listing
+    Shows opened before come first, then recently aired ones, ties keep the
+    order of the listing.
+    """
+    history = cache.Cache(args, "prefetch_history")
+    counters = cache.Counters(args, "prefetch_history")
+    scored = []
+    for position, url in enumerate(urls):
+        score = 3 * counters.get(history, url, [0, 0])[0] + (2 if url in recent else 0)
+        if score:
+            scored.append((-score, position, url))
+    return [url for _, _, url in sorted(scored)]
+
+
+def shows(args, items, simulcasts=False):
+    """Fetch and extract show pages of a rendered listing ahead of time
+    Parameters:
+      items: records of the listing with url attribute
+      simulcasts: listing contains recently aired shows only
+    """
+    if args._addon.getSetting("prefetch") != "true":
+        return
+    if not api.hasSession(args):
+        # pages without login have no watch progress and are never used
+        return
+    urls = [item.url for item in items]
+    if simulcasts:
+        recent = set(urls)
+    else:
+        recent = set(item.url for item in memo.stored(args, "last_simulcasts:" + args._country, extract.SIMULCASTS) or [])
+
+    # shows opened since the last prefetch
+    history = cache.Cache(args, "prefetch_history")
+    cache.Counters(args, "prefetch_history").flush(history)
+    history.save()
+
+    pages = cache.Cache(args, "prefetch")
+    for key in pages.keys():
+        if pages.age(key) > MAXAGE:
+            pages.delete(key)
+    urls = [url for url in rank(args, urls, recent) if pages.get(url, maxage=MAXAGE // 2) is None][:BUDGET]
+    if not urls:
+        return
+
+    expired = []
+
+    def load(url):
+        if expired:
+            return False
+        html = api.getPage(args, "https://www.wakanim.tv" + url, login=False, priority=api.BACKGROUND)
+        if not api.isLoggedin(html):
+            # session expired, opening the show will login, the rest of
+            # the budget is not spent
+            expired.append(url)
+            return False
+        seasons = extract.EPISODES.extract(html)
+        pages.set(url, {"show":    extract.showPage(html),
+                        "seasons": extract.EPISODES.dump(seasons)},
+                  cache.pageTags([url] + extract.EPISODES.urls(seasons)) + ["account", "country:" + args._country])
+        pages.save()
+        return True
+
+    start = time.time()
+    done = pool.map(load, urls, WORKERS)
+    xbmc.log("[PLUGIN] %s: Prefetched %d of %d show pages in %.2fs" % (args._addonname, done.count(True), len(urls), time.time() - start), xbmc.LOGDEBUG)
+
+
+def take(args, url, opened=True):
+    """Get prefetched show page, None if there is no fresh one
+    Parameters:
+      opened: the user entered the show, counts for ranking and hit rate
+    Returns dict with show informations and seasons
+    """
+    entry = cache.Cache(args, "prefetch").get(url, maxage=MAXAGE)
+    if not opened:
+        return entry
+
+    # per show: times opened, prefetch hits, written by the next prefetch
+    history = cache.Cache(args, "prefetch_history")
+    counters = cache.Counters(args, "prefetch_history")
+    counters.add(url, [1, 1 if entry else 0])
+    pending = counters.add("_stats", {"hits" if entry else "misses": 1})
+    if len(pending) > FLUSH:
+        counters.flush(history)
+        history.save()
+    stats = counters.get(history, "_stats", {})
+    xbmc.log("[PLUGIN] %s: Prefetch %s for '%s' (%d hits, %d misses)" % (args._addonname, "hit" if entry else "miss", url, stats.get("hits", 0), stats.get("misses", 0)), xbmc.LOGDEBUG)
+    return entry
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+# Wakanim - Watch videos from the german anime platform Wakanim.tv on Kodi.
+# Copyright (C) 2017 MrKrabat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import time
+try:
+    from urlparse import parse_qs
+except ImportError:
+    from urllib.parse import parse_qs
+
+import xbmc
+
+from . import api
+from . import view
+
+
+#: number of kept profiles
+MAX_DUMPS = 20
+#: functions shown per profile
+TOP = 15
+
+
+def getFolder(args):
+    """Folder of the profile dumps
+    """
+    path = api.getProfilePath(args, u"profiles")
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    return path
+
+
+def run(args, func, argv):
+    """Run func(argv) with cProfile and keep the result
+    Dumps are named <time>-<milliseconds>-<mode>.pstats, only the newest
+    MAX_DUMPS are kept.
+    """
+    import cProfile
+
+    profile = cProfile.Profile()
+    start = time.time()
+    try:
+        return profile.runcall(func, argv)
+    finally:
+        duration = time.time() - start
+        mode = parse_qs(argv[2][1:]).get("mode", ["menu"])[0] if argv[2] else "menu"
+        folder = getFolder(args)
+        profile.dump_stats(os.path.join(folder, "%d-%d-%s.pstats" % (start, duration * 1000, mode)))
+        for name in sorted(os.listdir(folder))[:-MAX_DUMPS]:
+            os.remove(os.path.join(folder, name))
+        xbmc.log("[PLUGIN] %s: Profiled '%s' in %.3fs" % (args._addonname, mode, duration), xbmc.LOGNOTICE)
+
+
+def funcKey(func):
+    """Argument naming function (file, line, name) of a profile
+    """
+    return "%s:%d:%s" % func
+
+
+def listProfiles(args):
+    """Show slowest recent invocations, the top functions of one or the
+    callers of a function
+    """
+    import pstats
+
+    folder = getFolder(args)
+    if hasattr(args, "dump"):
+        stats = pstats.Stats(os.path.join(folder, args.dump)).stats
+        # (file, line, function) -> (calls, primitive calls, own time, cumulative time, callers)
+        if hasattr(args, "func"):
+            path, line, name = args.func.rsplit(":", 2)
+            # caller -> (calls, primitive calls, own time, cumulative time) of the calls to func
+            callers = stats.get((path, int(line), name), (0, 0, 0, 0, {}))[4]
+            top = sorted(((f, v[3], v[1], v[2]) for f, v in callers.items() if f in stats and funcKey(f) != args.func), key=lambda s: s[1], reverse=True)
+        else:
+            top = [(f, v[3], v[1], v[2]) for f, v in sorted(stats.items(), key=lambda s: s[1][3], reverse=True)[:TOP]]
+        for func, cumulative, calls, own in top:
+            # every function links to its callers
+            view.add_item(args,
+                          {"title": "%.3fs  %s  (%s:%d, %d calls, %.3fs own)" % (cumulative, func[2], os.path.basename(func[0]), func[1], calls, own),
+                           "mode":  "diagnostics",
+                           "dump":  args.dump,
+                           "func":  funcKey(func)})
+    else:
+        dumps = []
+        for name in os.listdir(folder):
+            parts = name[:-7].split("-", 2)
+            if name.endswith(".pstats") and len(parts) == 3:
+                dumps.append((int(parts[1]), int(parts[0]), parts[2], name))
+        for duration, started, mode, name in sorted(dumps, reverse=True):
+            view.add_item(args,
+                          {"title": "%.3fs  %s  %s" % (duration / 1000.0, mode, time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(started))),
+                           "mode":  "diagnostics",
+                           "dump":  name})
+    view.endofdirectory(args)
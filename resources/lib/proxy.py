@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+# Wakanim - Watch videos from the german anime platform Wakanim.tv on Kodi.
+# Copyright (C) 2017 MrKrabat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import re
+import ssl
+import time
+import socket
+import threading
+from collections import OrderedDict
+try:
+    from urlparse import urljoin
+    from urllib2 import urlopen, Request, URLError, HTTPError
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from urllib.parse import urljoin
+    from urllib.request import urlopen, Request
+    from urllib.error import URLError, HTTPError
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+
+
+#: request headers passed on to the origin
+FORWARD_HEADERS = ("cookie", "user-agent", "authorization", "referer", "accept", "accept-language", "range")
+#: response headers passed on to the player
+RESPONSE_HEADERS = ("Content-Type", "Content-Range", "Accept-Ranges")
+#: manifests are kept this many seconds
+MANIFEST_TTL = 30
+
+# number in the last path component, e.g. segment-123.m4s
+_number = re.compile(r"(\d+)(?=[^/\d]*(?:\?.*)?$)")
+# absolute urls in manifests
+_absolute = re.compile(r"(https?)://")
+# absolute urls in DASH manifests, leaving XML namespaces alone
+_dash = re.compile(r"(<BaseURL>\s*|(?:media|initialization|sourceURL)=\")(https?)://")
+
+
+class Proxy(object):
+    """Local HTTP proxy for stream manifests and segments
+    Manifests are rewritten to point to the proxy and kept for a short time.
+    When a segment is requested the next segments are fetched ahead with
+    parallel connections and served from memory. Everything not in the
+    manifest, like license requests, never touches the proxy.
+    Urls are mapped to http://127.0.0.1:port/<scheme>/<host>/<path>, so
+    relative urls inside the manifests keep working.
+    """
+    def __init__(self, readahead=4, workers=4, cachesize=64 * 1048576, log=None):
+        self._readahead = readahead
+        self._cachesize = cachesize
+        self._log       = log or (lambda msg: None)
+        self._lock      = threading.Lock()
+        self._workers   = threading.BoundedSemaphore(workers)
+        self._cache     = OrderedDict()  # url -> (status, headers, body)
+        self._bytes     = 0
+        self._manifests = {}             # url -> (time, (status, headers, body))
+        self._inflight  = {}             # url -> threading.Event
+        self._order     = {}             # segment url -> (playlist, index)
+        self._playlists = []             # segment urls of HLS media playlists
+        self._last      = {}             # url pattern -> last segment number
+        self._ahead     = set()          # prefetched but not yet played
+        self._stats     = {"requests": 0, "hits": 0, "misses": 0, "prefetched": 0,
+                           "prefetch_hits": 0, "wasted": 0, "bytes": 0}
+        self._server    = _Server(("127.0.0.1", 0), _Handler)
+        self._server.proxy = self
+
+    @property
+    def address(self):
+        return "http://127.0.0.1:%d" % self._server.server_address[1]
+
+    def start(self):
+        """Start serving in background thread
+        """
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        """Stop serving
+        """
+        self._server.shutdown()
+        self._server.server_close()
+
+    def url(self, url):
+        """Map origin url to proxy, Kodi header suffix after '|' is kept
+        """
+        url, sep, headers = url.partition("|")
+        return _absolute.sub(self.address + r"/\1/", url, 1) + sep + headers
+
+    def origin(self, path):
+        """Map proxy path to origin url
+        """
+        parts = path.lstrip("/").split("/", 1)
+        if len(parts) != 2 or parts[0] not in ("http", "https"):
+            return None
+        return parts[0] + "://" + parts[1]
+
+    def stats(self):
+        """Counters of requests, cache hits and prefetching
+        'buffer' is the number of prefetched segments waiting to be played,
+        'hit_rate' the share of prefetched segments which have been played.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["buffer"] = len(self._ahead)
+        stats["hit_rate"] = stats["prefetch_hits"] / float(stats["prefetched"]) if stats["prefetched"] else 0.0
+        return stats
+
+    def fetch(self, url, headers):
+        """Load url from origin
+        Returns tuple of status, response headers and body.
+        """
+        try:
+            response = urlopen(Request(url, headers=headers), timeout=30)
+            status = response.getcode() or 200
+        except HTTPError as e:
+            response = e
+            status = e.code
+        except (ssl.SSLError, URLError, socket.error) as e:
+            self._log("Proxy failed to load '%s': %s" % (url, e))
+            return 502, {}, b""
+        info = response.info()
+        result = dict((k, info.get(k)) for k in RESPONSE_HEADERS if info.get(k))
+        return status, result, response.read()
+
+    def get(self, url, headers):
+        """Get manifest or segment
+        Returns tuple of status, response headers and body.
+        """
+        with self._lock:
+            self._stats["requests"] += 1
+        path = url.split("?", 1)[0].lower()
+        if path.endswith(".m3u8") or path.endswith(".mpd"):
+            return self._manifest(url, headers)
+        if any(k.lower() == "range" for k in headers):
+            # byte ranges are passed through
+            return self.fetch(url, headers)
+        return self._segment(url, headers)
+
+    def _manifest(self, url, headers):
+        """Get rewritten manifest
+        """
+        with self._lock:
+            cached = self._manifests.get(url)
+            if cached and time.time() - cached[0] < MANIFEST_TTL:
+                self._stats["hits"] += 1
+                return cached[1]
+            self._stats["misses"] += 1
+
+        status, info, body = self.fetch(url, headers)
+        if status != 200:
+            return status, info, body
+        text = body.decode("utf-8", "replace")
+
+        if url.split("?", 1)[0].lower().endswith(".m3u8"):
+            # remember order of segments for read-ahead
+            segments = [urljoin(url, l.strip()) for l in text.splitlines() if l.strip() and not l.startswith("#")]
+            with self._lock:
+                n = len(self._playlists)
+                self._playlists.append(segments)
+                for i, segment in enumerate(segments):
+                    self._order[segment] = (n, i)
+
+        if url.split("?", 1)[0].lower().endswith(".mpd"):
+            text = _dash.sub(r"\1" + self.address + r"/\2/", text)
+        else:
+            text = _absolute.sub(self.address + r"/\1/", text)
+        entry = (status, info, text.encode("utf-8"))
+        with self._lock:
+            self._manifests[url] = (time.time(), entry)
+        return entry
+
+    def _take(self, url):
+        """Get segment from memory, caller holds the lock
+        """
+        entry = self._cache.get(url)
+        if entry:
+            self._stats["hits"] += 1
+            if url in self._ahead:
+                self._ahead.discard(url)
+                self._stats["prefetch_hits"] += 1
+        return entry
+
+    def _segment(self, url, headers):
+        """Get segment from memory or origin and read ahead
+        """
+        owner = False
+        with self._lock:
+            entry = self._take(url)
+            if not entry:
+                event = self._inflight.get(url)
+                if not event:
+                    owner = True
+                    event = self._inflight[url] = threading.Event()
+
+        if not entry and not owner:
+            # segment is being prefetched, wait for it
+            event.wait(30)
+            with self._lock:
+                entry = self._take(url)
+
+        self._prefetch(url, headers)
+        if entry:
+            return entry
+
+        with self._lock:
+            self._stats["misses"] += 1
+        entry = self.fetch(url, headers)
+        with self._lock:
+            if entry[0] == 200:
+                self._store(url, entry)
+            if owner:
+                self._inflight.pop(url, None)
+        if owner:
+            event.set()
+        return entry
+
+    def _store(self, url, entry):
+        """Keep segment in memory, drop oldest segments if full
+        Caller holds the lock.
+        """
+        self._cache[url] = entry
+        self._bytes += len(entry[2])
+        self._stats["bytes"] += len(entry[2])
+        while self._bytes > self._cachesize and len(self._cache) > 1:
+            old, (_, _, body) = self._cache.popitem(last=False)
+            self._bytes -= len(body)
+            if old in self._ahead:
+                self._ahead.discard(old)
+                self._stats["wasted"] += 1
+
+    def _next(self, url):
+        """Urls of the segments after url
+        """
+        with self._lock:
+            order = self._order.get(url)
+            if order:
+                segments = self._playlists[order[0]]
+                return segments[order[1] + 1:order[1] + 1 + self._readahead]
+
+            # numbered segments, e.g. DASH $Number$ templates, once two
+            # consecutive numbers have been requested
+            m = _number.search(url)
+            if not m:
+                return []
+            pattern = url[:m.start()] + "#" + url[m.end():]
+            number = int(m.group(1))
+            last = self._last.get(pattern)
+            self._last[pattern] = number
+            if last != number - 1:
+                return []
+            width = len(m.group(1))
+            return [url[:m.start()] + str(number + i).zfill(width) + url[m.end():] for i in range(1, self._readahead + 1)]
+
+    def _prefetch(self, url, headers):
+        """Load the next segments in background
+        """
+        for nxt in self._next(url):
+            with self._lock:
+                if nxt in self._cache or nxt in self._inflight:
+                    continue
+                self._inflight[nxt] = threading.Event()
+                self._stats["prefetched"] += 1
+            thread = threading.Thread(target=self._preload, args=(nxt, headers))
+            thread.daemon = True
+            thread.start()
+
+    def _preload(self, url, headers):
+        """Load one segment ahead of the playhead
+        """
+        with self._workers:
+            entry = self.fetch(url, headers)
+        with self._lock:
+            if entry[0] == 200:
+                self._store(url, entry)
+                self._ahead.add(url)
+            event = self._inflight.pop(url, None)
+        if event:
+            event.set()
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Pass GET requests to the proxy
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        proxy = self.server.proxy
+        url = proxy.origin(self.path)
+        if not url:
+            self.send_error(404)
+            return
+        headers = dict((k, v) for k, v in self.headers.items() if k.lower() in FORWARD_HEADERS)
+        status, info, body = proxy.get(url, headers)
+        self.send_response(status)
+        for k, v in info.items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # keep Kodi log clean
+        pass
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+# Wakanim - Watch videos from the german anime platform Wakanim.tv on Kodi.
+# Copyright (C) 2017 MrKrabat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import re
+import time
+import unicodedata
+
+import xbmc
+
+from . import api
+from . import view
+from . import pool
+from . import memo
+from . import cache
+from . import extract
+
+
+#: all regions of Wakanim
+COUNTRIES = ("de", "fr", "sc", "ru")
+
+# characters ignored when comparing titles
+_ignored = re.compile(r"[\W_]+", re.UNICODE)
+# id of a show, equal in all regions
+_showid = re.compile(r"/catalogue/show/(\d+)")
+
+
+def getRegions(args):
+    """Regions enabled in the settings
+    """
+    return [c for c in COUNTRIES if args._addon.getSetting("region_" + c) == "true"]
+
+
+def titleKey(title):
+    """Normalized title to find the same show in several regions
+    """
+    title = unicodedata.normalize("NFKD", title)
+    title = u"".join(c for c in title if not unicodedata.combining(c))
+    return _ignored.sub(u"", title.lower())
+
+
+def buildIndex(args, catalogs):
+    """Merge catalogs of several regions
+    Shows are the same if their show id in the url matches, the id is
+    shared by all regions while titles are localized. Shows with another
+    id are still merged if their original title, known once the show page
+    has been opened, matches.
+    Parameters:
+      catalogs: list of country and catalog records pairs
+    Returns list of dicts with the show and its url per region
+    """
+    extracted = cache.Cache(args, "extract")
+    index = {}
+    order = []
+    for country, items in catalogs:
+        for record in items:
+            m = _showid.search(record.url)
+            keys = ["id:" + m.group(1) if m else "title:" + titleKey(record.title)]
+            show = (extracted.get("show:" + record.url) or {}).get("items") or {}
+            if show.get("originaltitle"):
+                keys.append("original:" + titleKey(show["originaltitle"]))
+            entry = next((index[k] for k in keys if k in index), None)
+            if entry is None:
+                entry = dict(extract.CATALOG.info(record), regions={})
+                order.append(entry)
+            for k in keys:
+                index.setdefault(k, entry)
+            entry["regions"].setdefault(country, record.url)
+    return order
+
+
+def showCatalog(args):
+    """Show catalogs of all enabled regions as one
+    The catalogs are loaded at the same time, every show is listed once
+    with the regions it is available in.
+    """
+    countries = getRegions(args) or [args._country]
+
+    def load(country):
+        html = api.getPage(args, "https://www.wakanim.tv/" + country + "/v2/catalogue", login=False)
+        if not html:
+            return None
+        return memo.extract(args, "catalog:" + country, html, u"catalog_list", spec=extract.CATALOG, tags=["country:" + country], partial=True)
+
+    start = time.time()
+    catalogs = [(c, items) for c, items in zip(countries, pool.map(load, countries, len(countries))) if items is not None]
+    stored = cache.Cache(args, "regions")
+    key = ",".join(countries)
+    if len(catalogs) == len(countries):
+        shows = buildIndex(args, catalogs)
+        stored.set(key, shows, ["country:" + c for c in countries])
+        stored.save()
+    else:
+        # a region failed, use last complete index
+        shows = stored.get(key) or buildIndex(args, catalogs)
+    xbmc.log("[PLUGIN] %s: Merged catalogs of %s to %d shows in %.2fs" % (args._addonname, ", ".join(c for c, _ in catalogs), len(shows), time.time() - start), xbmc.LOGDEBUG)
+
+    if not shows:
+        view.add_item(args, {"title": args._addon.getLocalizedString(30041)})
+        view.endofdirectory(args)
+        return
+
+    # for every show
+    for show in shows:
+        show = dict(show)
+        regions = show.pop("regions")
+        available = [c for c in countries if c in regions]
+        # prefer the region of the settings
+        show["url"] = regions.get(args._country) or regions[available[0]]
+        show["country"] = " / ".join(c.upper() for c in available)
+        show["title"] = u"%s  [%s]" % (show["title"], show["country"])
+
+        # add to view
+        view.add_item(args, show, isFolder=True, mediatype="video")
+
+    view.endofdirectory(args)
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+# Wakanim - Watch videos from the german anime platform Wakanim.tv on Kodi.
+# Copyright (C) 2017 MrKrabat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import io
+import json
+import time
+try:
+    from urllib import quote_plus
+except ImportError:
+    from urllib.parse import quote_plus
+
+import xbmc
+import xbmcgui
+
+from . import api
+from . import pool
+from . import cache
+from . import episodepage
+from .streamparams import getStreamParams
+
+
+#: parallel page loads
+WORKERS = 4
+#: resolved episodes are reused this many seconds
+MAXAGE = 600
+#: default window property of the result
+PROPERTY = "plugin.video.wakanim.resolved"
+
+
+def resolve(args):
+    """Resolve stream parameters and metadata of many episodes at once
+    For other addons, e.g.
+      RunPlugin(plugin://plugin.video.wakanim/?mode=resolve&ids=123,456)
+    Parameters of the invocation:
+      ids: comma separated episode ids
+      output: file to write the result to, default is the window property
+              plugin.video.wakanim.resolved (or the one given by property)
+    The result is a JSON object mapping every id to a dict with 'access',
+    'stream' (see streamparams.getStreamParams, None if not playable),
+    'play' (plugin url playing the episode) and 'info' (plot, duration,
+    aired, episode, showid).
+    Streams are resolved without any dialog. They carry no session cookies,
+    which must neither be stored nor published to every addon, so they are
+    played with the plugin url, which adds them from the cookie jar.
+    """
+    start = time.time()
+    ids = [i.strip() for i in args.ids.split(",") if i.strip()]
+    resolved = cache.Cache(args, "resolved")
+    for key in resolved.keys():
+        if "play" not in resolved.get(key):
+            # stored by older versions with session cookies
+            resolved.delete(key)
+    results = dict((i, resolved.get(i, maxage=MAXAGE)) for i in ids)
+    missing = [i for i in ids if results[i] is None]
+
+    def load(episodeid, login=False):
+        url = "https://www.wakanim.tv/" + args._country + "/v2/catalogue/episode/" + episodeid
+        html = api.getPage(args, url, login=login)
+        return html, episodepage.analyze(html) if html else None
+
+    # first page logs in if necessary, the others share the session and
+    # do not try again, a failed login shows one dialog only
+    pages = [load(missing[0], True)] + pool.map(load, missing[1:], WORKERS) if missing else []
+
+    for episodeid, loaded in zip(missing, pages):
+        play = args._argv[0] + "?mode=videoplay&url=" + quote_plus("/" + args._country + "/v2/catalogue/episode/" + episodeid)
+        if not loaded or loaded[1] is None:
+            results[episodeid] = {"access": None, "stream": None, "play": play, "info": {}}
+            continue
+        html, page = loaded
+        info = episodepage.details(html)
+        info["showid"] = page.showid
+        stream = getStreamParams(args, page.config or html, quiet=True) if page.access == episodepage.OK else None
+        results[episodeid] = {"access": page.access, "stream": withoutCookies(stream), "play": play, "info": info}
+        if stream:
+            resolved.set(episodeid, results[episodeid], ["episode:" + episodeid, "account"])
+    resolved.save()
+
+    # hand over result
+    data = json.dumps(results)
+    output = getattr(args, "output", None)
+    if output:
+        with io.open(xbmc.translatePath(output), "w", encoding="utf-8") as f:
+            f.write(data if isinstance(data, type(u"")) else data.decode("utf-8"))
+    else:
+        xbmcgui.Window(10000).setProperty(getattr(args, "property", PROPERTY), data)
+    xbmc.log("[PLUGIN] %s: Resolved %d episodes (%d cached) in %.2fs" % (args._addonname, len(ids), len(ids) - len(missing), time.time() - start), xbmc.LOGNOTICE)
+
+
+def withoutCookies(stream):
+    """Stream parameters without the headers with session cookies
+    """
+    if not stream:
+        return None
+    properties = dict((k, v) for k, v in stream["properties"].items() if k != "inputstream.adaptive.stream_headers")
+    return dict(stream, url=stream["url"].split("|", 1)[0], properties=properties)
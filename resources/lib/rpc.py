@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+# Wakanim - Watch videos from the german anime platform Wakanim.tv on Kodi.
+# Copyright (C) 2017 MrKrabat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import time
+import socket
+
+import xbmc
+import xbmcgui
+import xbmcplugin
+
+from . import view
+from . import model
+
+
+#: window property with address of the running service
+PROPERTY = "plugin.video.wakanim.service"
+
+#: modes which only build a directory listing and can run in the service
+MODES = ["catalog", "catalog_regions", "catalog_filter", "facet", "last_episodes", "last_simulcasts", "watchlist",
+         "downloads", "collection", "list_season", "list_episodes", "widget"]
+
+
+def publish(port, token):
+    """Announce the service to plugin invocations
+    """
+    xbmcgui.Window(10000).setProperty(PROPERTY, "%d:%s" % (port, token))
+
+
+def unpublish():
+    """Remove service announcement
+    """
+    xbmcgui.Window(10000).clearProperty(PROPERTY)
+
+
+def send(sock, message):
+    """Send one JSON message
+    """
+    sock.sendall(json.dumps(message).encode("utf-8") + b"\n")
+
+
+def receive(sock):
+    """Receive one JSON message
+    """
+    data = b""
+    while not data.endswith(b"\n"):
+        chunk = sock.recv(65536)
+        if not chunk:
+            raise socket.error("connection closed")
+        data += chunk
+    return json.loads(data.decode("utf-8"))
+
+
+def forward(argv):
+    """Let the service build the directory listing
+    Returns False if the service is not running, the caller has to run
+    the request itself then. A request the service has received is never
+    run again, even if it failed or timed out.
+    """
+    start = time.time()
+    args = model.parse(argv)
+    if hasattr(args, "mode"):
+        if args.mode not in MODES:
+            return False
+    elif hasattr(args, "id") or hasattr(args, "url"):
+        # playback started by other plugins
+        return False
+
+    address = xbmcgui.Window(10000).getProperty(PROPERTY)
+    if not address:
+        return False
+    port, token = address.split(":", 1)
+
+    sock = None
+    try:
+        sock = socket.create_connection(("127.0.0.1", int(port)), 1)
+        sock.settimeout(120)
+        send(sock, {"token": token, "argv": list(argv)})
+    except (socket.error, ValueError) as e:
+        if sock:
+            sock.close()
+        xbmc.log("[PLUGIN] %s: Service not reachable: %s" % (args._addonname, e), xbmc.LOGDEBUG)
+        return False
+    try:
+        result = receive(sock)
+    except (socket.error, ValueError) as e:
+        result = {"error": "no answer: %s" % e}
+    finally:
+        sock.close()
+    if "error" in result:
+        # the service may have sent requests already or still be running,
+        # running it again could send them twice, e.g. a login
+        xbmc.log("[PLUGIN] %s: Service failed: %s" % (args._addonname, result["error"]), xbmc.LOGERROR)
+        xbmcgui.Dialog().notification(args._addonname, args._addon.getLocalizedString(30041), xbmcgui.NOTIFICATION_ERROR)
+        xbmcplugin.endOfDirectory(handle=int(args._argv[1]), succeeded=False)
+        return True
+
+    # show listing
+    xbmcplugin.setContent(int(args._argv[1]), "tvshows")
+    for item in result["items"]:
+        view.render(args, item)
+    if result["done"]:
+        view.endofdirectory(args)
+    else:
+        xbmcplugin.endOfDirectory(handle=int(args._argv[1]), succeeded=False)
+
+    xbmc.log("[PLUGIN] %s: Served by service in %.3fs" % (args._addonname, time.time() - start), xbmc.LOGDEBUG)
+    return True
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+# Wakanim - Watch videos from the german anime platform Wakanim.tv on Kodi.
+# Copyright (C) 2017 MrKrabat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import time
+import uuid
+import threading
+import traceback
+try:
+    from SocketServer import ThreadingTCPServer, StreamRequestHandler
+except ImportError:
+    from socketserver import ThreadingTCPServer, StreamRequestHandler
+
+import xbmc
+import xbmcaddon
+
+from . import api
+from . import memo
+from . import rpc
+from . import model
+from . import poller
+from . import wakanim
+
+
+class Session(object):
+    """Login session shared by all requests
+    Keeps the cookie jar and url opener alive between plugin invocations,
+    the process keeps the connections to Wakanim open, see netcache.
+    Invocations running outside of the service share the cookie file, so
+    the jar is loaded again whenever the file has been changed by them and
+    only written if its cookies have changed.
+    """
+    def __init__(self):
+        self._lock    = threading.Lock()
+        self._args    = None
+        self._mtime   = None  #: mtime of the cookie file when loaded or saved
+        self._cookies = None  #: cookies when loaded or saved
+
+    def attach(self, args):
+        """Let args use the shared session
+        """
+        with self._lock:
+            mtime = modified(args)
+            if self._args is None or self._args._cj is None or mtime != self._mtime:
+                api.start(args)
+                self._args    = args
+                self._mtime   = mtime
+                self._cookies = cookies(args._cj)
+            args._cj = self._args._cj
+
+    def save(self, args):
+        """Save cookies or drop session if it has been destroyed
+        """
+        with self._lock:
+            if args._cj is None:
+                # session nuked by login handler
+                self._args = None
+            elif self._args:
+                state = cookies(self._args._cj)
+                if state == self._cookies:
+                    api.transport.save()
+                elif modified(self._args) != self._mtime:
+                    # another invocation saved its session meanwhile, keep it
+                    self._args = None
+                else:
+                    api.close(self._args)
+                    self._mtime   = modified(self._args)
+                    self._cookies = state
+
+
+def modified(args):
+    """Modification time of the cookie file, None if there is none
+    """
+    try:
+        return os.path.getmtime(api.getCookiePath(args))
+    except OSError:
+        return None
+
+
+def cookies(jar):
+    """Comparable state of all cookies in jar
+    """
+    return sorted((c.domain, c.path, c.name, c.value, c.expires) for c in jar)
+
+
+class Handler(StreamRequestHandler):
+    """Run one plugin request
+    """
+    def handle(self):
+        message = rpc.receive(self.connection)
+        if message.get("token") != self.server.token:
+            return
+
+        start = time.time()
+        reply = threading.Event()
+
+        def done(items):
+            # send listing as soon as it is complete
+            if not reply.is_set():
+                reply.set()
+                rpc.send(self.connection, {"items": items, "done": True})
+
+        args = model.parse(message["argv"])
+        args._addon = xbmcaddon.Addon(id=args._addonid)
+        args._items = []
+        args._done = done
+        try:
+            if wakanim.init(args):
+                self.server.session.attach(args)
+                wakanim.check_mode(args)
+                self.server.session.save(args)
+            if not reply.is_set():
+                reply.set()
+                rpc.send(self.connection, {"items": args._items, "done": False})
+        except Exception:
+            xbmc.log("[PLUGIN] %s: Service request failed\n%s" % (args._addonname, traceback.format_exc()), xbmc.LOGERROR)
+            if not reply.is_set():
+                reply.set()
+                rpc.send(self.connection, {"error": traceback.format_exc().splitlines()[-1]})
+        finally:
+            memo.release(args)
+        xbmc.log("[PLUGIN] %s: Service request '%s' took %.3fs" % (args._addonname, message["argv"][2], time.time() - start), xbmc.LOGDEBUG)
+
+
+class Server(ThreadingTCPServer):
+    """Local RPC server
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        ThreadingTCPServer.__init__(self, ("127.0.0.1", 0), Handler)
+        self.token = uuid.uuid4().hex
+        self.session = Session()
+
+
+class Monitor(xbmc.Monitor):
+    """Announce the service only while it is enabled
+    """
+    def __init__(self, server):
+        xbmc.Monitor.__init__(self)
+        self._server = server
+        self.onSettingsChanged()
+
+    def onSettingsChanged(self):
+        if xbmcaddon.Addon().getSetting("service") == "true":
+            rpc.publish(self._server.server_address[1], self._server.token)
+        else:
+            rpc.unpublish()
+
+
+def run():
+    """Serve plugin requests until Kodi shuts down
+    """
+    server = Server()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    xbmc.log("[PLUGIN] Wakanim: Service listening on port %d" % server.server_address[1], xbmc.LOGNOTICE)
+
+    monitor = Monitor(server)
+    thread = threading.Thread(target=poller.Poller(server.session).run, args=(monitor,))
+    thread.daemon = True
+    thread.start()
+    monitor.waitForAbort()
+
+    rpc.unpublish()
+    server.shutdown()
+    server.server_close()
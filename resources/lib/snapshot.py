@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+# Wakanim - Watch videos from the german anime platform Wakanim.tv on Kodi.
+# Copyright (C) 2017 MrKrabat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import mmap
+import struct
+
+
+#: first bytes of every snapshot file
+MAGIC = b"WKSN"
+#: format version, files of other versions are ignored
+VERSION = 1
+#: string index of None values
+NONE = 0xFFFFFFFF
+
+# magic, version, grouped, columns, rows, groups, strings
+_header = struct.Struct("<4sHHIIII")
+_index = struct.Struct("<I")
+
+
+def write(path, spec, items):
+    """Store item records of spec in a snapshot file
+    Layout after the header, all numbers are little endian uint32:
+      column names: one string index per column
+      group table: title string index, first row and row count per group
+      row table: one string index per column and row
+      string offsets: start of every string in the pool and end of the pool
+      string pool: UTF-8 text of every distinct value, stored only once and
+                   ended by a null byte
+    Every row has the same size, so a reader finds any row without
+    decoding the rows before it.
+    """
+    strings = []
+    interned = {}
+
+    def intern(value):
+        if value is None:
+            return NONE
+        i = interned.get(value)
+        if i is None:
+            i = interned[value] = len(strings)
+            strings.append(value)
+        return i
+
+    groups = items if spec.group else [(None, items)]
+    names = spec.record.__slots__
+    columns = [intern(n) for n in names]
+    table = []
+    rows = []
+    for title, records in groups:
+        table.extend((intern(title), len(rows), len(records)))
+        for record in records:
+            rows.append([intern(v) for v in record.values()])
+
+    pool = [s.encode("utf-8") + b"\0" for s in strings]
+    offsets = [0]
+    for data in pool:
+        if data.index(b"\0") != len(data) - 1:
+            raise ValueError("Null byte in value: %r" % data)
+        offsets.append(offsets[-1] + len(data))
+
+    numbers = columns + table + [i for row in rows for i in row] + offsets
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(_header.pack(MAGIC, VERSION, 1 if spec.group else 0, len(names), len(rows), len(table) // 3, len(strings)))
+        f.write(struct.pack("<%dI" % len(numbers), *numbers))
+        f.write(b"".join(pool))
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(tmp, path)
+
+
+class Snapshot(object):
+    """Read only view of a snapshot file
+    The file is mapped into memory, strings are decoded on first use and
+    rows are only read when accessed.
+    """
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, grouped, self.columns, self.size, self.groups, strings = _header.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError("No snapshot of version %d: %s" % (VERSION, path))
+        self.grouped = bool(grouped)
+        self._table   = _header.size + self.columns * 4
+        self._rows    = self._table + self.groups * 12
+        self._pool    = self._rows + self.size * self.columns * 4 + (strings + 1) * 4
+        self._count   = strings
+        if len(self._map) < self._pool or len(self._map) < self._pool + _index.unpack_from(self._map, self._pool - 4)[0]:
+            # rows are read later, a truncated file must fail here
+            self.close()
+            raise ValueError("Truncated snapshot: %s" % path)
+        self._offsets = None
+        self._strings = {NONE: None}
+        self.names    = tuple(self.string(_index.unpack_from(self._map, _header.size + i * 4)[0]) for i in range(self.columns))
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def strings(self, indices):
+        """Texts of string indices, every string is decoded only once
+        """
+        missing = set(indices).difference(self._strings)
+        if len(missing) > self._count // 4:
+            # decoding the whole pool at once is faster than string by string
+            texts = self._map[self._pool:].decode("utf-8").split(u"\0")
+            self._strings.update(zip(range(self._count), texts))
+        elif missing:
+            if self._offsets is None:
+                # one call for the whole table is cheaper than one per string
+                self._offsets = struct.unpack_from("<%dI" % (self._count + 1), self._map, self._pool - (self._count + 1) * 4)
+            offsets = self._offsets
+            for i in missing:
+                self._strings[i] = self._map[self._pool + offsets[i]:self._pool + offsets[i + 1] - 1].decode("utf-8")
+        return list(map(self._strings.__getitem__, indices))
+
+    def string(self, i):
+        """Text of string index i
+        """
+        return self.strings((i,))[0]
+
+    def rows(self, first, count):
+        """Values of count rows starting at row first
+        """
+        columns = self.columns
+        values = self.strings(struct.unpack_from("<%dI" % (count * columns), self._map, self._rows + first * columns * 4))
+        return [values[i:i + columns] for i in range(0, len(values), columns)]
+
+    def group(self, i):
+        """Title, first row and row count of group i
+        """
+        title, first, count = struct.unpack_from("<III", self._map, self._table + i * 12)
+        return self.string(title), first, count
+
+    def load(self, spec):
+        """Item records like spec.extract(), rows are read on access
+        Returns None if the snapshot was written for another record type.
+        """
+        if self.names != spec.record.__slots__:
+            return None
+        if not self.grouped:
+            return Rows(self, spec.record, 0, self.size)
+        return [(title, Rows(self, spec.record, first, count)) for title, first, count in (self.group(i) for i in range(self.groups))]
+
+
+class Rows(object):
+    """Sequence of records stored in a snapshot
+    """
+    def __init__(self, snapshot, record, first, count):
+        self._snapshot = snapshot
+        self._record   = record
+        self._first    = first
+        self._count    = count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(self._count)
+            if step != 1:
+                return [self[j] for j in range(start, stop, step)]
+            return [self._record(*v) for v in self._snapshot.rows(self._first + start, max(stop - start, 0))]
+        if i < 0:
+            i += self._count
+        if not 0 <= i < self._count:
+            raise IndexError(i)
+        return self._record(*self._snapshot.rows(self._first + i, 1)[0])
+
+    def __iter__(self):
+        return iter(self[:])
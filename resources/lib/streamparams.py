@@ -156,19 +156,20 @@ def get_stream_params_fallback(html):
         return None
 
 
-def getStreamParams(args, html):
-    """Get stream parameters and check with InputStreamHelper:
-       * Parse JWPlayer config using JSON and get stream parameters, fallback to old method in case of parsing errors
-       * Check stream parameters with InputStreamHelper
-       * Prepare parameters for xbmcgui.ListItem
+def checkInputstream(proto, drm):
+    """Check stream type with InputStreamHelper
+       Returns True if the stream can be played, may raise InputStreamException
+    """
+    return inputstreamhelper.Helper(proto, drm).check_inputstream()
+
+
+def getStream(args, html):
+    """Get stream of the JWPlayer config without any check
        Parameters:
          args: plugin args class
          html: HTML page content with JWPlayer config
-       Returns dict with following keys:
-         'legacy': use Kodi buildin playback (e.g. for HLS streams)
-         'url': stream url
-         'content-type': Content type (e.g. application/vnd.apple.mpegurl)
-         'properties': dict with parameters to pass to xbmcgui.ListItem.setProperty(key, value)
+       Returns dict with 'proto' (e.g. 'hls' or 'dash'), 'drm', 'url' and
+       more, None if there is no valid config
     """
     try:
         # remove stuff that cannot be parsed by JSON parser
@@ -179,9 +180,32 @@ def getStreamParams(args, html):
         log(args, "Error parsing JWPlayer config, trying old method", xbmc.LOGNOTICE)
         # fallback to old method
         result = get_stream_params_fallback(html)
+    return result or None
+
+
+def getStreamParams(args, html, checked=None, quiet=False):
+    """Get stream parameters and check with InputStreamHelper:
+       * Parse JWPlayer config using JSON and get stream parameters, fallback to old method in case of parsing errors
+       * Check stream parameters with InputStreamHelper
+       * Prepare parameters for xbmcgui.ListItem
+       Parameters:
+         args: plugin args class
+         html: HTML page content with JWPlayer config
+         checked: function (proto, drm) returning result of an InputStreamHelper
+                  check done in advance, None if it has not been done
+         quiet: show no dialogs, e.g. for many episodes at once, the
+                InputStreamHelper check is left to the playback then
+       Returns dict with following keys:
+         'legacy': use Kodi buildin playback (e.g. for HLS streams)
+         'url': stream url
+         'content-type': Content type (e.g. application/vnd.apple.mpegurl)
+         'properties': dict with parameters to pass to xbmcgui.ListItem.setProperty(key, value)
+    """
+    result = getStream(args, html)
     if not result:
         log(args, "Invalid JWPlayer config", xbmc.LOGERROR)
-        errdlg(args)
+        if not quiet:
+            errdlg(args)
         return None
 
     log(args, "Stream proto '{0}' drm '{1}'".format(result['proto'], result['drm']), xbmc.LOGDEBUG)
@@ -206,12 +230,16 @@ def getStreamParams(args, html):
 
     # check stream parameters with InputStreamHelper
     try:
-        if not inputstreamhelper.Helper(result['proto'], result['drm']).check_inputstream():
+        ok = checked(result['proto'], result['drm']) if checked else None
+        if ok is None and not quiet:
+            ok = checkInputstream(result['proto'], result['drm'])
+        if ok is False or (not ok and not quiet):
             log(args, "InputStreamHelper: check stream failed", xbmc.LOGERROR)
             return None
     except inputstreamhelper.Helper.InputStreamException as e:
         log(args, "InputStreamHelper: {0}".format(e), xbmc.LOGERROR)
-        errdlg(args)
+        if not quiet:
+            errdlg(args)
         return None
 
     # prepare parameters for InputStream Adaptive
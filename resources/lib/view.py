@@ -34,6 +34,11 @@ types = ["count", "size", "date", "genre", "country", "year", "episode", "season
 
 
 def endofdirectory(args):
+    if args._items is not None:
+        # running in service, hand collected items over to the plugin
+        args._done(args._items)
+        return
+
     # sort methods are required in library mode
     xbmcplugin.addSortMethod(int(args._argv[1]), xbmcplugin.SORT_METHOD_NONE)
 
@@ -49,37 +54,61 @@ def add_item(args, info, isFolder=True, total_items=0, mediatype="video"):
         info.pop("playcount", None)
         info.pop("progress", None)
 
-    # create list item
-    li = xbmcgui.ListItem(label = info["title"])
-
     # get infoLabels
     infoLabels = make_infolabel(args, info)
 
     # get url
     u = build_url(args, info)
 
-    if isFolder:
-        # directory
-        li.setInfo(mediatype, infoLabels)
-    else:
+    if not isFolder:
         # playable video
         infoLabels["mediatype"] = "video"
-        li.setInfo(mediatype, infoLabels)
-        li.setProperty("IsPlayable", "true")
 
     # set media image
-    li.setArt({"thumb":  info.get("thumb",  "DefaultFolder.png"),
-               "poster": info.get("thumb",  "DefaultFolder.png"),
-               "banner": info.get("thumb",  "DefaultFolder.png"),
-               "fanart": info.get("fanart", xbmc.translatePath(args._addon.getAddonInfo("fanart"))),
-               "icon":   info.get("thumb",  "DefaultFolder.png")})
+    art = {"thumb":  info.get("thumb",  "DefaultFolder.png"),
+           "poster": info.get("thumb",  "DefaultFolder.png"),
+           "banner": info.get("thumb",  "DefaultFolder.png"),
+           "fanart": info.get("fanart", xbmc.translatePath(args._addon.getAddonInfo("fanart"))),
+           "icon":   info.get("thumb",  "DefaultFolder.png")}
+
+    item = {"label":     info["title"],
+            "url":       u,
+            "info":      infoLabels,
+            "art":       art,
+            "isFolder":  isFolder,
+            "total":     total_items,
+            "mediatype": mediatype,
+            "context":   []}
+
+    if info.get("mode") == "videoplay":
+        # offer offline download
+        item["context"].append((args._addon.getLocalizedString(30029),
+                                "RunPlugin(" + build_url(args, dict(info, mode="download")) + ")"))
+
+    if args._items is not None:
+        # running in service, collect item
+        args._items.append(item)
+    else:
+        render(args, item)
+
+
+def render(args, item):
+    """Create list item and add it to directory listing.
+    """
+    li = xbmcgui.ListItem(label = item["label"])
+    li.setInfo(item["mediatype"], item["info"])
+    if not item["isFolder"]:
+        li.setProperty("IsPlayable", "true")
+    li.setArt(item["art"])
+    if item["context"]:
+        li.addContextMenuItems([tuple(c) for c in item["context"]])
 
     # add item to list
     xbmcplugin.addDirectoryItem(handle     = int(args._argv[1]),
-                                url        = u,
+                                url        = item["url"],
                                 listitem   = li,
-                                isFolder   = isFolder,
-                                totalItems = total_items)
+                                isFolder   = item["isFolder"],
+                                totalItems = item["total"])
 
 
 def quote_value(value, PY2):
@@ -95,6 +124,14 @@ def quote_value(value, PY2):
         return quote_plus(value)
 
 
+def quote_arg(value, PY2):
+    """Quote value which has to arrive unchanged as argument
+    parse() decodes arguments twice, so a single quoted value loses escaped
+    characters like '%2F' or '+'.
+    """
+    return quote_value(quote_value(value, PY2), PY2)
+
+
 def build_url(args, info):
     """Create url
     """
@@ -15,6 +15,8 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import re
+import time
 import inputstreamhelper
 
 import xbmc
@@ -23,6 +25,7 @@ import xbmcaddon
 import xbmcplugin
 
 from . import api
+from . import memo
 from . import view
 from . import model
 from . import controller
@@ -31,6 +34,7 @@ from . import controller
 def main(argv):
     """Main function for the addon
     """
+    start = time.time()
     args = model.parse(argv)
 
     # inputstream adaptive settings
@@ -40,11 +44,47 @@ def main(argv):
             xbmcaddon.Addon(id="inputstream.adaptive").openSettings()
         return True
 
+    if not init(args):
+        return False
+
+    # widgets only read local data, no session needed
+    if hasattr(args, "mode") and args.mode == "widget":
+        controller.showWidget(args)
+        memo.release(args)
+        return True
+
+    # list menue
+    api.start(args)
+    xbmcplugin.setContent(int(args._argv[1]), "tvshows")
+    check_mode(args)
+    memo.release(args)
+    api.close(args)
+    xbmc.log("[PLUGIN] %s: Served in-process in %.3fs" % (args._addonname, time.time() - start), xbmc.LOGDEBUG)
+    xbmc.log("[PLUGIN] %s: Requests and waiting time per priority %s" % (args._addonname, api.scheduler.stats()), xbmc.LOGDEBUG)
+
+
+def init(args):
+    """Set country and check account informations
+    """
     # get account informations
     username = args._addon.getSetting("wakanim_username")
     password = args._addon.getSetting("wakanim_password")
 
     # set country
+    setCountry(args)
+
+    if not (username and password):
+        # open addon settings
+        view.add_item(args, {"title": args._addon.getLocalizedString(30045)})
+        view.endofdirectory(args)
+        args._addon.openSettings()
+        return False
+    return True
+
+
+def setCountry(args):
+    """Set country of settings
+    """
     args._country = args._addon.getSetting("country")
     if args._country == "0":
         args._country = "de"
@@ -57,18 +97,10 @@ def main(argv):
     else:
         args._country = "de"
 
-    if not (username and password):
-        # open addon settings
-        view.add_item(args, {"title": args._addon.getLocalizedString(30045)})
-        view.endofdirectory(args)
-        args._addon.openSettings()
-        return False
-    else:
-        # list menue
-        api.start(args)
-        xbmcplugin.setContent(int(args._argv[1]), "tvshows")
-        check_mode(args)
-        api.close(args)
+    # pages of another region, e.g. of the merged catalog, login there
+    m = re.match(r"/(de|fr|sc|ru)/", getattr(args, "url", ""))
+    if m:
+        args._country = m.group(1)
 
 
 def check_mode(args):
@@ -91,6 +123,15 @@ def check_mode(args):
         showMainMenue(args)
     elif mode == "catalog":
         controller.showCatalog(args)
+    elif mode == "catalog_regions":
+        from . import regions
+        regions.showCatalog(args)
+    elif mode == "catalog_filter":
+        from . import facets
+        facets.showFilter(args)
+    elif mode == "facet":
+        from . import facets
+        facets.listValues(args)
     elif mode == "last_episodes":
         controller.listLastEpisodes(args)
     elif mode == "last_simulcasts":
@@ -107,8 +148,32 @@ def check_mode(args):
         controller.listSeason(args)
     elif mode == "list_episodes":
         controller.listEpisodes(args)
+    elif mode == "enrich_episodes":
+        controller.enrichEpisodes(args)
     elif mode == "videoplay":
         controller.startplayback(args)
+    elif mode == "download":
+        from . import downloader
+        downloader.download(args)
+    elif mode == "offline":
+        from . import downloader
+        downloader.listDownloads(args)
+    elif mode == "play_offline":
+        from . import downloader
+        downloader.playDownload(args)
+    elif mode == "library_export":
+        from . import library
+        library.export(args)
+    elif mode == "diagnostics":
+        from . import profiler
+        profiler.listProfiles(args)
+    elif mode == "resolve":
+        from . import resolver
+        resolver.resolve(args)
+    elif mode == "widget":
+        controller.showWidget(args)
+    elif mode == "widget_refresh":
+        controller.refreshWidget(args)
     elif mode == "trailer":
         item = xbmcgui.ListItem(getattr(args, "title", "Title not provided"), path=args.url)
         xbmcplugin.setResolvedUrl(int(args._argv[1]), True, item)
@@ -122,9 +187,17 @@ def check_mode(args):
 def showMainMenue(args):
     """Show main menu
     """
+    from . import regions
     view.add_item(args,
                   {"title": args._addon.getLocalizedString(30020),
                    "mode":   "catalog"})
+    if len(regions.getRegions(args)) > 1:
+        view.add_item(args,
+                      {"title": args._addon.getLocalizedString(30057),
+                       "mode":  "catalog_regions"})
+    view.add_item(args,
+                  {"title": args._addon.getLocalizedString(30058),
+                   "mode":   "catalog_filter"})
     view.add_item(args,
                   {"title": args._addon.getLocalizedString(30025),
                    "mode":   "last_episodes"})
@@ -143,4 +216,11 @@ def showMainMenue(args):
     view.add_item(args,
                   {"title": args._addon.getLocalizedString(30023),
                    "mode":   "collection"})
+    view.add_item(args,
+                  {"title": args._addon.getLocalizedString(30028),
+                   "mode":   "offline"})
+    if args._addon.getSetting("profiling") == "true":
+        view.add_item(args,
+                      {"title": args._addon.getLocalizedString(30063),
+                       "mode":  "diagnostics"})
     view.endofdirectory(args)
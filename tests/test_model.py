@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+# Wakanim - Watch videos from the german anime platform Wakanim.tv on Kodi.
+# Copyright (C) 2017 MrKrabat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Decoding of plugin arguments, Kodi is provided by tools/kodi.py
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tools"))
+import kodi
+
+kodi.install(tempfile.mkdtemp(prefix="wakanim-test-"), {})
+sys.path.insert(0, kodi.ROOT)
+from resources.lib import model, view
+
+
+class ParseTest(unittest.TestCase):
+    def test_quote_arg(self):
+        listing = "?mode=list_episodes&url=%2Fde%2Fv2%2Fcatalogue%2Fshow%2F1%2Fa&title=Staffel+1+%2B+OVA"
+        url = "plugin://plugin.video.wakanim/?mode=enrich_episodes&title=%s&listing=%s" % (
+            view.quote_arg("Staffel 1 + OVA", False), view.quote_arg(listing, False))
+        base, query = url.split("?", 1)
+        args = model.parse([base + "?", "-1", "?" + query])
+        self.assertEqual(args.listing, listing)
+        self.assertEqual(args.title, "Staffel 1 + OVA")
+
+    def test_quote_value(self):
+        # single quoted values are decoded twice
+        args = model.parse(["plugin://plugin.video.wakanim/", "1", "?title=" + view.quote_value("a%2Fb+c", False)])
+        self.assertEqual(args.title, "a/b c")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+# Wakanim - Watch videos from the german anime platform Wakanim.tv on Kodi.
+# Copyright (C) 2017 MrKrabat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Compare extraction specs with the former per-item find() code
+Runs outside of Kodi, only BeautifulSoup is required:
+    python tools/bench_extract.py [items] [rounds]
+"""
+
+import gc
+import os
+import sys
+import time
+import tracemalloc
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from resources.lib import extract
+
+
+HEADER = u"<html><head><title>Wakanim</title></head><body><header><nav>" + u"<a href='#'>menu</a>" * 50 + u"</nav></header>"
+FOOTER = u"<footer>" + u"<p>footer</p>" * 50 + u"</footer></body></html>"
+
+
+def show(i):
+    return (u"<li><div class='slider_item'><a href='/de/v2/catalogue/show/%d/show-%d'>"
+            u"<img src='//www.wakanim.tv/img/%d.jpg' alt='Show %d'></a>"
+            u"<div class='slider_item_description'><span class='slider_item_title'><strong> Show %d </strong></span></div>"
+            u"<div class='stars'><span class='-yes'></span><span class='-yes'></span><span class='-no'></span></div>"
+            u"<p class='tooltip_text'>\n<strong>Show %d</strong>\n<span> Plot of show %d </span></p>"
+            u"<time> 2018 </time></div></li>") % (i, i, i, i, i, i, i)
+
+
+def episode(i):
+    return (u"<li class='slider_item'><div class='slider_item_inner'><a href='/de/v2/catalogue/episode/%d/ep-%d'>"
+            u"<img src='//www.wakanim.tv/img/ep%d.jpg' alt='Episode %d'></a></div>"
+            u"<a class='slider_item_season' href='#'> Season 1 </a>"
+            u"<div class='ProgressBar' data-progress='%d'></div></li>") % (i, i, i, i, i % 100)
+
+
+def big(i):
+    return (u"<div class='big-item-list_item'><a href='/de/v2/collection/detail/%d/show-%d'>"
+            u"<img src='//www.wakanim.tv/img/%d.jpg'></a>"
+            u"<h3 class='big-item_title'> Show %d </h3></div>") % (i, i, i, i)
+
+
+def pages(n):
+    """Synthetic pages of every listing mode
+    """
+    return {
+        "catalog":    HEADER + u"<ul class='catalog_list'>" + u"".join(show(i) for i in range(n)) + u"</ul>" + FOOTER,
+        "simulcasts": HEADER + u"<div class='js-slider-lastShow'><ul>" + u"".join(show(i).replace(u"\n<strong>Show %d</strong>\n" % i, u"") for i in range(n)) + u"</ul></div>" + FOOTER,
+        "last":       HEADER + u"<div class='js-slider-lastEp'><ul>" + u"".join(episode(i) for i in range(n)) + u"</ul></div>" + FOOTER,
+        "watchlist":  HEADER + u"<section>" + u"".join(episode(i).replace(u"<li class='slider_item'>", u"<div class='slider_item'>").replace(u"</li>", u"</div>") for i in range(n)) + u"</section>" + FOOTER,
+        "collection": HEADER + u"<div class='big-item-list'>" + u"".join(big(i) for i in range(n)) + u"</div>" + FOOTER,
+        "episodes":   HEADER + u"".join(u"<section class='seasonSection'><h2 class='slider-section_title'><span>%%</span> Season %d</h2><ul>" % s
+                                        + u"".join(episode(i) for i in range(n // 4)) + u"</ul></section>" for s in range(4)) + FOOTER,
+    }
+
+
+def thumb(src):
+    src = src.replace(" ", "%20")
+    return src if src[:4] == "http" else "https:" + src
+
+
+def legacyShows(html, container, plot):
+    soup = BeautifulSoup(html, "html.parser")
+    items = []
+    for li in soup.find(*container).find_all("li"):
+        star = li.find("div", {"class": "stars"}).find_all("span", {"class": "-no"})
+        items.append({"url":         li.a["href"],
+                      "title":       li.find("div", {"class": "slider_item_description"}).span.strong.string.strip(),
+                      "tvshowtitle": li.find("div", {"class": "slider_item_description"}).span.strong.string.strip(),
+                      "mode":        "list_season",
+                      "thumb":       thumb(li.img["src"]),
+                      "fanart":      thumb(li.img["src"]),
+                      "rating":      str(10 - len(star) * 2),
+                      "plot":        li.find("p", {"class": "tooltip_text"}).contents[plot].string.strip(),
+                      "year":        li.time.string.strip()})
+    return items
+
+
+def legacyEpisode(li, url):
+    progress = int(li.find("div", {"class": "ProgressBar"}).get("data-progress"))
+    return {"url":       url,
+            "title":     li.img["alt"],
+            "mode":      "videoplay",
+            "thumb":     thumb(li.img["src"]),
+            "playcount": "1" if progress > 90 else "0",
+            "progress":  str(progress)}
+
+
+def legacyLast(html):
+    soup = BeautifulSoup(html, "html.parser")
+    return [dict(legacyEpisode(li, li.a["href"]), fanart=thumb(li.img["src"]), plot=li.find("a", {"class": "slider_item_season"}).string.strip())
+            for li in soup.find("div", {"class": "js-slider-lastEp"}).find_all("li")]
+
+
+def legacyWatchlist(html):
+    soup = BeautifulSoup(html, "html.parser")
+    return [dict(legacyEpisode(div, div.find("div", {"class": "slider_item_inner"}).a["href"]), fanart=thumb(div.img["src"]))
+            for div in soup.find("section").find_all("div", {"class": "slider_item"})]
+
+
+def legacyCollection(html):
+    soup = BeautifulSoup(html, "html.parser")
+    return [{"url":    div.a["href"].replace("collection/detail", "catalogue/show"),
+             "title":  div.find("h3", {"class": "big-item_title"}).string.strip(),
+             "mode":   "list_season",
+             "thumb":  thumb(div.img["src"]),
+             "fanart": thumb(div.img["src"])}
+            for div in soup.find("div", {"class": "big-item-list"}).find_all("div", {"class": "big-item-list_item"})]
+
+
+def legacyEpisodes(html):
+    soup = BeautifulSoup(html, "html.parser")
+    return [[s.find("h2", {"class": "slider-section_title"}).get_text().split("%", 1)[1].strip(),
+             [legacyEpisode(li, li.a["href"]) for li in s.find_all("li", {"class": "slider_item"})]]
+            for s in soup.find_all("section", {"class": "seasonSection"})]
+
+
+MODES = [("catalog",    lambda h: legacyShows(h, ("ul", {"class": "catalog_list"}), 3),         extract.CATALOG),
+         ("simulcasts", lambda h: legacyShows(h, ("div", {"class": "js-slider-lastShow"}), -1), extract.SIMULCASTS),
+         ("last",       legacyLast,       extract.LAST_EPISODES),
+         ("watchlist",  legacyWatchlist,  extract.WATCHLIST),
+         ("collection", legacyCollection, extract.BIG_ITEMS),
+         ("episodes",   legacyEpisodes,   extract.EPISODES)]
+
+
+def measure(func, html, rounds):
+    """Best time of rounds and size of the result
+    """
+    best = None
+    for _ in range(rounds):
+        start = time.time()
+        func(html)
+        best = min(best, time.time() - start) if best is not None else time.time() - start
+    tracemalloc.start()
+    result = func(html)
+    # parse trees are cyclic, only count what the result keeps alive
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return best, size
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    html = pages(n)
+
+    print("%-11s %12s %12s %12s %12s" % ("mode", "legacy us", "spec us", "legacy B", "spec B"))
+    for mode, legacy, spec in MODES:
+        # both must yield the same items
+        old = legacy(html[mode])
+        new = spec.extract(html[mode])
+        if spec.group:
+            old = [(t, e) for t, e in old]
+            new = [(t, [spec.info(r) for r in e]) for t, e in new]
+        else:
+            new = [spec.info(r) for r in new]
+        assert old == new, mode
+
+        t1, m1 = measure(legacy, html[mode], rounds)
+        t2, m2 = measure(spec.extract, html[mode], rounds)
+        print("%-11s %12.1f %12.1f %12d %12d" % (mode, t1 * 1e6 / n, t2 * 1e6 / n, m1 // n, m2 // n))
+
+
+if __name__ == "__main__":
+    main()
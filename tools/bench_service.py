@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+# Wakanim - Watch videos from the german anime platform Wakanim.tv on Kodi.
+# Copyright (C) 2017 MrKrabat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Compare per-click latency with and without the resident service
+Replays the clicks of the load runner one after another against the
+stand-in server, every click in a fresh process like in Kodi. Timing
+starts before the addon is imported, so module imports and the login
+count like they do for the user. Listings are answered by a service
+running in this process the second time, playback always runs in the
+click's process and shares the cookie file with the service:
+    python tools/bench_service.py [--invocations 60] [--latency fixed:0.05] ...
+Requires BeautifulSoup, Kodi is provided by tools/kodi.py.
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import traceback
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import kodi
+import standin
+import load_test
+
+
+def click(task):
+    """Run one click, forwarded to the service if it is running
+    Returns result like load_test.invoke() and whether the service answered
+    """
+    mode, argv = task
+    kodi.record.reset()
+    start = time.time()
+    try:
+        from resources.lib import rpc
+        served = rpc.forward(argv)
+        if not served:
+            from resources.lib import wakanim
+            wakanim.main(argv)
+    except Exception:
+        return (mode, time.time() - start, "crashed", traceback.format_exc().strip().splitlines()[-1]), False
+    return load_test.outcome(mode, time.time() - start), served
+
+
+def measure(tasks, values, service):
+    """Run all clicks in a new profile, with a service if service is True
+    """
+    profile = tempfile.mkdtemp(prefix="wakanim-bench-")
+    window = {}
+    server = None
+    if service:
+        # the service of Kodi is a long running process, here it is this one
+        kodi.install(profile, dict(values, service="true"))
+        if kodi.ROOT not in sys.path:
+            sys.path.insert(0, kodi.ROOT)
+        from resources.lib import service as resident, rpc
+        server = resident.Server()
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        window[rpc.PROPERTY] = "%d:%s" % (server.server_address[1], server.token)
+
+    pool = multiprocessing.get_context("spawn").Pool(1, load_test.setup, (profile, values, window), maxtasksperchild=1)
+    try:
+        return pool.map(click, tasks, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+        if server:
+            server.shutdown()
+            server.server_close()
+        shutil.rmtree(profile, True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--invocations", type=int, default=60)
+    parser.add_argument("--setting", action="append", default=[], metavar="KEY=VALUE", help="addon setting, e.g. prefetch=true")
+    standin.options(parser)
+    opts = parser.parse_args()
+
+    server = standin.StandIn(opts.fixtures, standin.faults(opts)).start()
+    values = {"wakanim_username": server.site.user, "wakanim_password": server.site.password, "origin": server.origin, "service": "false"}
+    values.update(s.split("=", 1) for s in opts.setting)
+    tasks = list(load_test.invocations(server.site, opts.invocations, opts.seed))
+
+    try:
+        results = [("in-process", measure(tasks, values, False)),
+                   ("service", measure(tasks, values, True))]
+    finally:
+        server.stop()
+
+    print("%-16s %6s %12s %12s %12s %12s %8s" % ("mode", "runs", "plugin p50", "plugin p90", "service p50", "service p90", "served"))
+    for mode, _ in load_test.SCENARIO + (("all", 0),):
+        row = []
+        for _, runs in results:
+            times = [r[1] * 1000 for r, _ in runs if mode in ("all", r[0])]
+            row.extend((load_test.percentile(times, 50), load_test.percentile(times, 90)))
+        runs = [served for r, served in results[1][1] if mode in ("all", r[0])]
+        if runs:
+            print("%-16s %6d %10.0fms %10.0fms %10.0fms %10.0fms %8d" % ((mode, len(runs)) + tuple(row) + (runs.count(True),)))
+
+    for name, runs in results:
+        failures = [r for r, _ in runs if r[2] != "ok"]
+        if failures:
+            print("\n%s failures:" % name)
+            for mode, _, outcome, detail in failures:
+                print("  %-8s %-16s %s" % (outcome, mode, detail))
+
+
+if __name__ == "__main__":
+    main()
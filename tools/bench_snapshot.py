@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+# Wakanim - Watch videos from the german anime platform Wakanim.tv on Kodi.
+# Copyright (C) 2017 MrKrabat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Compare load times of snapshots with JSON and pickle
+Runs outside of Kodi, only BeautifulSoup is required:
+    python tools/bench_snapshot.py [shows] [rounds]
+"""
+
+import os
+import sys
+import json
+import time
+import pickle
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from bench_extract import pages
+from resources.lib import extract
+from resources.lib import snapshot
+
+
+#: rows shown by a partial read, e.g. the first screen of a listing
+PAGE = 50
+
+
+def best(func, rounds):
+    """Best time of rounds in ms
+    """
+    times = []
+    for _ in range(rounds):
+        start = time.time()
+        func()
+        times.append(time.time() - start)
+    return min(times) * 1000
+
+
+def bench(folder, name, spec, items, partial, rounds):
+    """Load times of one item list in all formats
+    Parameters:
+      partial: function reading the part a listing renders from items
+    """
+    paths = dict((fmt, os.path.join(folder, name + "." + fmt)) for fmt in ("json", "pickle", "snap"))
+    with open(paths["json"], "w") as f:
+        json.dump(spec.dump(items), f, separators=(",", ":"))
+    with open(paths["pickle"], "wb") as f:
+        pickle.dump(spec.dump(items), f, pickle.HIGHEST_PROTOCOL)
+    snapshot.write(paths["snap"], spec, items)
+
+    def fromJson():
+        with open(paths["json"], "r") as f:
+            return spec.load(json.load(f))
+
+    def fromPickle():
+        with open(paths["pickle"], "rb") as f:
+            return spec.load(pickle.load(f))
+
+    def fromSnapshot(read):
+        def run():
+            with snapshot.Snapshot(paths["snap"]) as s:
+                return read(s.load(spec))
+        return run
+
+    # all formats must yield the same items
+    assert spec.dump(fromSnapshot(lambda i: [(t, list(r)) for t, r in i] if spec.group else list(i))()) == spec.dump(fromJson())
+
+    full = lambda i: [(t, list(r)) for t, r in i] if spec.group else list(i)
+    print("%-9s %10d %10d %10d %10.2f %10.2f %10.2f %10.2f" % (
+        name, os.path.getsize(paths["json"]), os.path.getsize(paths["pickle"]), os.path.getsize(paths["snap"]),
+        best(fromJson, rounds), best(fromPickle, rounds), best(fromSnapshot(full), rounds), best(fromSnapshot(partial), rounds)))
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    html = pages(n)
+    folder = tempfile.mkdtemp()
+    try:
+        print("%-9s %10s %10s %10s %10s %10s %10s %10s" % ("listing", "json B", "pickle B", "snap B", "json ms", "pickle ms", "snap ms", "part ms"))
+        # first screen of the catalogue
+        bench(folder, "catalog", extract.CATALOG, extract.CATALOG.extract(html["catalog"]), lambda i: i[:PAGE], rounds)
+        # the last season only
+        bench(folder, "episodes", extract.EPISODES, extract.EPISODES.extract(html["episodes"]), lambda i: list(i[-1][1]), rounds)
+    finally:
+        shutil.rmtree(folder)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+# Wakanim - Watch videos from the german anime platform Wakanim.tv on Kodi.
+# Copyright (C) 2017 MrKrabat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Kodi host for running plugin invocations outside of Kodi
+Provides the parts of the xbmc modules and InputStreamHelper the addon
+uses and records what an invocation showed: directory items, resolved
+urls, dialogs, logged errors and started plugins. Playback is simulated
+with a fast clock, one player second per tick.
+"""
+
+import os
+import re
+import sys
+import time
+import types
+import xml.etree.ElementTree as ElementTree
+
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+class Record(object):
+    """What one invocation showed to the user
+    """
+    def __init__(self):
+        self.items    = []     #: labels of directory items
+        self.ended    = False  #: endOfDirectory called
+        self.resolved = None   #: url of setResolvedUrl, False if failed
+        self.dialogs  = []     #: texts of dialogs and error notifications
+        self.errors   = []     #: messages logged with LOGERROR
+        self.plugins  = []     #: plugin urls started with RunPlugin
+        self.folder   = ""     #: Container.FolderPath, the listing shown
+        self.refresh  = 0      #: Container.Refresh calls
+
+    def reset(self):
+        self.__init__()
+
+
+#: record of the running invocation
+record = Record()
+
+
+def settings(values):
+    """Defaults of settings.xml overlaid with values
+    """
+    result = {}
+    for setting in ElementTree.parse(os.path.join(ROOT, "resources", "settings.xml")).iter("setting"):
+        if setting.get("id"):
+            result[setting.get("id")] = setting.get("default", "")
+    result.update(values)
+    return result
+
+
+def strings():
+    """English strings of the addon
+    """
+    with open(os.path.join(ROOT, "resources", "language", "resource.language.en_gb", "strings.po"), "r") as f:
+        return dict((int(i), s) for i, s in re.findall(r'msgctxt "#(\d+)"\s*msgid "(.*)"', f.read()))
+
+
+def install(profile, values, search=u"show", tick=0.01, duration=25, window=None):
+    """Register Kodi modules in sys.modules
+    Parameters:
+      profile: folder of the addon profile
+      values: settings differing from the defaults
+      search: text entered in input dialogs
+      tick: real seconds of one player second
+      duration: seconds of every simulated video
+      window: initial window properties, e.g. the address of a service
+    """
+    config = settings(values)
+    texts = strings()
+    properties = dict(window or {})
+    players = []
+
+    xbmc = types.ModuleType("xbmc")
+    for level, name in enumerate(("LOGDEBUG", "LOGINFO", "LOGNOTICE", "LOGWARNING", "LOGERROR", "LOGSEVERE", "LOGFATAL", "LOGNONE")):
+        setattr(xbmc, name, level)
+
+    def log(msg, level=xbmc.LOGDEBUG):
+        if level >= xbmc.LOGERROR:
+            record.errors.append(msg)
+    xbmc.log = log
+    xbmc.translatePath = lambda path: path
+    labels = {"System.BuildVersion": lambda: "19.0", "Container.FolderPath": lambda: record.folder}
+    xbmc.getInfoLabel = lambda label: labels[label]() if label in labels else ""
+    xbmc.getCondVisibility = lambda condition: False
+    def executebuiltin(command, wait=False):
+        if command.startswith("RunPlugin("):
+            record.plugins.append(command[len("RunPlugin("):-1])
+        elif command == "Container.Refresh":
+            record.refresh += 1
+    xbmc.executebuiltin = executebuiltin
+    xbmc.sleep = lambda ms: time.sleep(ms / 1000.0 * tick)
+
+    class Monitor(object):
+        """Every wait advances the simulated player
+        """
+        def waitForAbort(self, timeout=0):
+            time.sleep((timeout or 0) * tick)
+            for player in list(players):
+                player._tick(timeout or 0)
+            return False
+
+        def abortRequested(self):
+            return False
+
+    class Player(object):
+        def __init__(self):
+            self._file = None
+            self._time = 0.0
+            players.append(self)
+
+        def _tick(self, seconds):
+            if self._file is None and record.resolved:
+                self._file = record.resolved
+                self.onAVStarted()
+            elif self._file is not None:
+                self._time += seconds
+                if self._time >= duration:
+                    players.remove(self)
+                    self.onPlayBackEnded()
+
+        def isPlaying(self):
+            # one player in Kodi, any simulated playback counts
+            return any(p._file is not None for p in players)
+
+        def isPlayingVideo(self):
+            return self._file is not None
+
+        def getPlayingFile(self):
+            if self._file is None:
+                raise RuntimeError("not playing")
+            return self._file
+
+        def getTime(self):
+            return self._time
+
+        def getTotalTime(self):
+            return float(duration)
+
+        def pause(self):
+            pass
+
+        def seekTime(self, seconds):
+            self._time = seconds
+
+        def onAVStarted(self):
+            pass
+
+        def onPlayBackEnded(self):
+            pass
+
+    xbmc.Monitor = Monitor
+    xbmc.Player = Player
+
+    xbmcgui = types.ModuleType("xbmcgui")
+    xbmcgui.NOTIFICATION_INFO = "info"
+    xbmcgui.NOTIFICATION_WARNING = "warning"
+    xbmcgui.NOTIFICATION_ERROR = "error"
+    xbmcgui.INPUT_ALPHANUM = 0
+
+    class Window(object):
+        def __init__(self, id=10000):
+            pass
+
+        def getProperty(self, key):
+            return properties.get(key, "")
+
+        def setProperty(self, key, value):
+            properties[key] = value
+
+        def clearProperty(self, key):
+            properties.pop(key, None)
+
+    class Dialog(object):
+        def ok(self, heading, message=""):
+            record.dialogs.append(message)
+            return True
+
+        def yesno(self, heading, message="", *args, **kwargs):
+            return False
+
+        def notification(self, heading, message, icon="info", time=5000, sound=True):
+            if icon == xbmcgui.NOTIFICATION_ERROR:
+                record.dialogs.append(message)
+
+        def input(self, heading, defaultt="", type=0, *args, **kwargs):
+            return search
+
+    class DialogProgressBG(object):
+        def create(self, heading, message=""):
+            pass
+
+        def update(self, percent=0, heading="", message=""):
+            pass
+
+        def close(self):
+            pass
+
+    class ListItem(object):
+        def __init__(self, label="", label2="", path=""):
+            self.label = label
+            self.path = path
+
+        def __getattr__(self, name):
+            # setInfo, setArt, setProperty, setMimeType, ...
+            return lambda *args, **kwargs: None
+
+    xbmcgui.Window = Window
+    xbmcgui.Dialog = Dialog
+    xbmcgui.DialogProgressBG = DialogProgressBG
+    xbmcgui.ListItem = ListItem
+
+    xbmcplugin = types.ModuleType("xbmcplugin")
+    xbmcplugin.SORT_METHOD_NONE = 0
+
+    def addDirectoryItem(handle, url, listitem, isFolder=False, totalItems=0):
+        record.items.append(listitem.label)
+        return True
+
+    def endOfDirectory(handle, succeeded=True, updateListing=False, cacheToDisc=True):
+        record.ended = True
+
+    def setResolvedUrl(handle, succeeded, listitem):
+        record.resolved = listitem.path if succeeded else False
+
+    xbmcplugin.addDirectoryItem = addDirectoryItem
+    xbmcplugin.endOfDirectory = endOfDirectory
+    xbmcplugin.setResolvedUrl = setResolvedUrl
+    xbmcplugin.setContent = lambda handle, content: None
+    xbmcplugin.addSortMethod = lambda handle, method: None
+
+    xbmcaddon = types.ModuleType("xbmcaddon")
+
+    class Addon(object):
+        def __init__(self, id=None):
+            pass
+
+        def getSetting(self, key):
+            return config.get(key, "")
+
+        def setSetting(self, key, value):
+            config[key] = value
+
+        def getLocalizedString(self, id):
+            return texts.get(id, "")
+
+        def getAddonInfo(self, key):
+            return {"name": "Wakanim", "version": "0", "id": "plugin.video.wakanim",
+                    "profile": profile, "path": ROOT, "fanart": os.path.join(ROOT, "fanart.jpg")}.get(key, "")
+
+        def openSettings(self):
+            pass
+
+    xbmcaddon.Addon = Addon
+
+    xbmcvfs = types.ModuleType("xbmcvfs")
+    xbmcvfs.exists = os.path.exists
+    xbmcvfs.mkdirs = lambda path: os.makedirs(path) or True
+    xbmcvfs.delete = os.remove
+    xbmcvfs.rmdir = os.rmdir
+    xbmcvfs.listdir = lambda path: ([d for d in os.listdir(path) if os.path.isdir(os.path.join(path, d))],
+                                    [f for f in os.listdir(path) if os.path.isfile(os.path.join(path, f))])
+    xbmcvfs.rename = lambda src, dst: os.rename(src, dst) or True
+
+    class File(object):
+        """Text is read decoded, bytes and text are written
+        """
+        def __init__(self, path, mode="r"):
+            self._file = open(path, "wb" if mode == "w" else "rb") if mode == "w" or os.path.isfile(path) else None
+
+        def read(self):
+            return self._file.read().decode("utf-8") if self._file else ""
+
+        def write(self, data):
+            self._file.write(data.encode("utf-8") if isinstance(data, str) else bytes(data))
+            return True
+
+        def close(self):
+            if self._file:
+                self._file.close()
+
+    class Stat(object):
+        def __init__(self, path):
+            self._stat = os.stat(path)
+
+        def st_size(self):
+            return self._stat.st_size
+
+        def st_mtime(self):
+            return self._stat.st_mtime
+
+    xbmcvfs.File = File
+    xbmcvfs.Stat = Stat
+
+    inputstreamhelper = types.ModuleType("inputstreamhelper")
+
+    class Helper(object):
+        class InputStreamException(Exception):
+            pass
+
+        def __init__(self, protocol, drm=None):
+            pass
+
+        def check_inputstream(self):
+            return True
+
+    inputstreamhelper.Helper = Helper
+
+    for module in (xbmc, xbmcgui, xbmcplugin, xbmcaddon, xbmcvfs, inputstreamhelper):
+        sys.modules[module.__name__] = module
+
+    # read by model.Args like in default.py
+    main = sys.modules["__main__"]
+    main._plugId = "plugin.video.wakanim"
+    main._addon = Addon(main._plugId)
+    main._plugin = "Wakanim"
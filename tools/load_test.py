@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+# Wakanim - Watch videos from the german anime platform Wakanim.tv on Kodi.
+# Copyright (C) 2017 MrKrabat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Run plugin invocations against the stand-in server at the same time
+Every invocation runs wakanim.main in a fresh process like in Kodi, all
+share one addon profile. Reports latency percentiles per mode and how
+failures were handled:
+    python tools/load_test.py [--invocations 200] [--concurrency 8] [--errors 0.05] ...
+Requires BeautifulSoup, Kodi is provided by tools/kodi.py.
+"""
+
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import traceback
+import multiprocessing
+try:
+    from urllib.parse import urlencode
+except ImportError:
+    sys.exit("Python 3.7 or newer is required")
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import kodi
+import standin
+
+
+#: modes of the scenario and their weight
+SCENARIO = (("menu", 1), ("catalog", 3), ("search", 1), ("last_episodes", 2), ("last_simulcasts", 1),
+            ("watchlist", 2), ("collection", 1), ("list_season", 3), ("list_episodes", 3), ("videoplay", 2))
+
+
+def invocations(site, count, seed):
+    """Plugin arguments of count invocations drawn from the scenario
+    """
+    rnd = random.Random(seed)
+    modes = [mode for mode, weight in SCENARIO for _ in range(weight)]
+    for _ in range(count):
+        mode = rnd.choice(modes)
+        show = rnd.choice(site.shows)
+        url = "/de/v2/catalogue/show/%d/%s" % (show["id"], standin.slug(show["title"]))
+        thumb = "https://www.wakanim.tv/img/show/%d.jpg" % show["id"]
+        season = rnd.choice(show["seasons"])
+        episode = rnd.choice(season["episodes"])
+        if mode == "menu":
+            query = {}
+        elif mode == "list_season":
+            query = {"mode": mode, "url": url, "title": show["title"], "thumb": thumb, "fanart": thumb}
+        elif mode == "list_episodes":
+            query = {"mode": mode, "url": url, "title": season["title"], "thumb": thumb, "fanart": thumb}
+        elif mode == "videoplay":
+            query = {"mode": mode, "url": "/de/v2/catalogue/episode/%d/%s" % (episode["id"], standin.slug(episode["title"])), "title": episode["title"]}
+        else:
+            query = {"mode": mode}
+        yield mode, ["plugin://plugin.video.wakanim/", "1", "?" + urlencode(query) if query else ""]
+
+
+def setup(profile, values, window=None):
+    """Install Kodi in a worker process
+    """
+    kodi.install(profile, values, window=window)
+    sys.path.insert(0, kodi.ROOT)
+
+
+def invoke(task):
+    """Run one plugin invocation
+    Returns mode, seconds, outcome and detail, outcome is 'ok', 'handled'
+    for errors shown to the user or 'crashed' for uncaught exceptions,
+    also of worker threads, and other logged errors.
+    """
+    mode, argv = task
+    from resources.lib import wakanim
+    kodi.record.reset()
+    start = time.time()
+    try:
+        wakanim.main(argv)
+        elapsed = time.time() - start
+        if kodi.record.ended:
+            kodi.record.folder = argv[0] + argv[2]
+        # detached invocations like episode enrichment, not timed
+        for url in list(kodi.record.plugins):
+            base, _, query = url.partition("?")
+            wakanim.main([base, "-1", "?" + query])
+    except Exception:
+        return mode, time.time() - start, "crashed", traceback.format_exc().strip().splitlines()[-1]
+    return outcome(mode, elapsed)
+
+
+def outcome(mode, elapsed):
+    """Result of an invocation from what it showed, see invoke()
+    """
+    record = kodi.record
+    error = kodi.strings()[30041]
+    if record.dialogs:
+        return mode, elapsed, "handled", "dialog: %s" % record.dialogs[0]
+    if record.errors:
+        # e.g. exceptions of pool workers, which are logged and swallowed
+        return mode, elapsed, "crashed", "logged: %s" % record.errors[0].replace("[PLUGIN] Wakanim: ", "")
+    if mode == "videoplay":
+        if record.resolved:
+            return mode, elapsed, "ok", ""
+        return mode, elapsed, "handled", "not resolved"
+    if error in record.items:
+        return mode, elapsed, "handled", "error item"
+    if not record.ended:
+        return mode, elapsed, "handled", "no listing"
+    return mode, elapsed, "ok", ""
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(int(round(p / 100.0 * (len(values) - 1))), len(values) - 1)]
+
+
+def report(results, elapsed, stats):
+    print("%-16s %6s %6s %8s %8s %9s %9s %9s %9s" % ("mode", "runs", "ok", "handled", "crashed", "p50 ms", "p90 ms", "p99 ms", "max ms"))
+    for mode, _ in SCENARIO + (("all", 0),):
+        runs = [r for r in results if mode in ("all", r[0])]
+        if not runs:
+            continue
+        times = [r[1] * 1000 for r in runs]
+        outcomes = [r[2] for r in runs]
+        print("%-16s %6d %6d %8d %8d %9.0f %9.0f %9.0f %9.0f" % (
+            mode, len(runs), outcomes.count("ok"), outcomes.count("handled"), outcomes.count("crashed"),
+            percentile(times, 50), percentile(times, 90), percentile(times, 99), max(times)))
+    print("\n%d invocations in %.1fs, %.1f per second" % (len(results), elapsed, len(results) / elapsed))
+
+    details = {}
+    for mode, _, outcome, detail in results:
+        if outcome != "ok":
+            key = (outcome, mode, detail)
+            details[key] = details.get(key, 0) + 1
+    if details:
+        print("\nFailures:")
+        for (outcome, mode, detail), count in sorted(details.items()):
+            print("  %4d %-8s %-16s %s" % (count, outcome, mode, detail))
+    print("\nStand-in: " + ", ".join("%s %d" % item for item in sorted(stats.items())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--invocations", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--setting", action="append", default=[], metavar="KEY=VALUE", help="addon setting, e.g. prefetch=true")
+    parser.add_argument("--origin", help="use a running stand-in instead of starting one")
+    standin.options(parser)
+    opts = parser.parse_args()
+
+    server = None
+    if opts.origin:
+        site = standin.Site(standin.json.load(open(opts.fixtures)))
+        origin = opts.origin
+    else:
+        server = standin.StandIn(opts.fixtures, standin.faults(opts)).start()
+        site, origin = server.site, server.origin
+
+    profile = tempfile.mkdtemp(prefix="wakanim-load-")
+    values = {"wakanim_username": site.user, "wakanim_password": site.password, "origin": origin, "service": "false"}
+    values.update(s.split("=", 1) for s in opts.setting)
+
+    tasks = list(invocations(site, opts.invocations, opts.seed))
+    pool = multiprocessing.get_context("spawn").Pool(opts.concurrency, setup, (profile, values), maxtasksperchild=1)
+    start = time.time()
+    try:
+        results = pool.map(invoke, tasks, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+        shutil.rmtree(profile, True)
+    report(results, time.time() - start, server.stats() if server else {})
+    if server:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,428 @@
+# -*- coding: utf-8 -*-
+# Wakanim - Watch videos from the german anime platform Wakanim.tv on Kodi.
+# Copyright (C) 2017 MrKrabat
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Stand-in for www.wakanim.tv with latency and fault injection
+Serves the pages the addon reads, built from a fixture file, with the
+markup of the site: login with optional 2FA, catalogue, search, home,
+watchlist, collection, show and episode pages with JWPlayer config,
+reactivation and playtime reports. Runs outside of Kodi:
+    python tools/standin.py [--port 8080] [--latency exp:0.2] [--errors 0.05] ...
+Set the hidden addon setting 'origin' to http://127.0.0.1:8080 to use it,
+GET /_standin/stats returns the served requests and injected faults.
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+try:
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import urlsplit, parse_qsl, unquote
+    from html import escape
+except ImportError:
+    sys.exit("Python 3.7 or newer is required")
+
+
+#: fixture file used by default
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "standin.json")
+#: name of the session cookie
+COOKIE = "standin_session"
+
+
+class Latency(object):
+    """Latency distribution, e.g. 'fixed:0.1', 'uniform:0.05,0.3',
+    'exp:0.2' (mean) or 'lognormal:-2,0.8' (mu, sigma of the log)
+    """
+    def __init__(self, spec):
+        kind, _, params = (spec or "fixed:0").partition(":")
+        self.kind = kind
+        self.params = [float(p) for p in params.split(",") if p]
+        if kind not in ("fixed", "uniform", "exp", "lognormal"):
+            raise ValueError("Unknown latency distribution: %s" % spec)
+
+    def sample(self, rnd):
+        if self.kind == "uniform":
+            return rnd.uniform(*self.params)
+        if self.kind == "exp":
+            return rnd.expovariate(1.0 / self.params[0]) if self.params[0] else 0.0
+        if self.kind == "lognormal":
+            return rnd.lognormvariate(*self.params)
+        return self.params[0] if self.params else 0.0
+
+
+class Faults(object):
+    """Faults injected into responses
+    Parameters:
+      latency: Latency before every response
+      errors: share of requests answered with 503
+      truncate: share of responses closed after half of the body
+      drip: share of responses sent in small chunks at drip_rate bytes/s
+    """
+    def __init__(self, latency=None, errors=0.0, truncate=0.0, drip=0.0, drip_rate=4096, seed=None):
+        self.latency   = latency or Latency(None)
+        self.errors    = errors
+        self.truncate  = truncate
+        self.drip      = drip
+        self.drip_rate = drip_rate
+        self._random   = random.Random(seed)
+        self._lock     = threading.Lock()
+
+    def draw(self):
+        """Latency and fault of one response: None, 'error', 'truncate' or 'drip'
+        """
+        with self._lock:
+            latency = self.latency.sample(self._random)
+            r = self._random.random()
+        if r < self.errors:
+            return latency, "error"
+        if r < self.errors + self.truncate:
+            return latency, "truncate"
+        if r < self.errors + self.truncate + self.drip:
+            return latency, "drip"
+        return latency, None
+
+
+class Site(object):
+    """Pages of the stand-in built from the fixtures
+    """
+    def __init__(self, fixtures):
+        self.user      = fixtures.get("user", "user")
+        self.password  = fixtures.get("password", "password")
+        self.twofactor = fixtures.get("twofactor", False)
+        self.shows     = list(fixtures.get("shows", []))
+        generate = fixtures.get("generate")
+        if generate:
+            self.shows.extend(generated(generate, len(self.shows)))
+        self.episodes  = dict((e["id"], (show, season, e)) for show in self.shows for season in show["seasons"] for e in season["episodes"])
+        self.sessions  = {}
+        self.lock      = threading.Lock()
+
+    def session(self, token):
+        with self.lock:
+            return self.sessions.get(token)
+
+    def login(self, username, password):
+        """New session token, None for wrong credentials
+        """
+        if username != self.user or password != self.password:
+            return None
+        token = uuid.uuid4().hex
+        with self.lock:
+            self.sessions[token] = {"progress": {}, "reactivated": set(), "authorized": not self.twofactor}
+        return token
+
+    def page(self, country, body, session):
+        header = u"<header><nav><a href='/%s/v2'>Wakanim</a>" % country
+        if session:
+            header += u"<span class='header-main_user_name'>%s</span>" % escape(self.user)
+        return (u"<!DOCTYPE html><html><head><meta charset='utf-8'><title>Wakanim</title></head><body>"
+                + header + u"</nav></header>" + body + u"<footer><p>Stand-in</p></footer></body></html>")
+
+    def showItem(self, country, show, tooltip=True):
+        stars = u"".join(u"<span class='-yes'></span>" if i * 2 < show["rating"] else u"<span class='-no'></span>" for i in range(5))
+        plot = u"<p class='tooltip_text'>\n<strong>%s</strong>\n<span>%s</span></p>" % (escape(show["title"]), escape(show["plot"])) if tooltip \
+            else u"<p class='tooltip_text'><span>%s</span></p>" % escape(show["plot"])
+        return (u"<li><div class='slider_item'><a href='/%s/v2/catalogue/show/%d/%s'><img src='//www.wakanim.tv/img/show/%d.jpg' alt='%s'></a>"
+                u"<div class='slider_item_description'><span class='slider_item_title'><strong>%s</strong></span></div>"
+                u"<div class='stars'>%s</div>%s<time>%s</time></div></li>") % (
+                    country, show["id"], slug(show["title"]), show["id"], escape(show["title"]), escape(show["title"]), stars, plot, show["year"])
+
+    def episodeItem(self, country, episode, session, tag=u"li", season=None):
+        progress = session["progress"].get(episode["id"], 0) if session else 0
+        return (u"<%s class='slider_item'><div class='slider_item_inner'><a href='/%s/v2/catalogue/episode/%d/%s'>"
+                u"<img src='//www.wakanim.tv/img/episode/%d.jpg' alt='%s'></a></div>%s"
+                u"<div class='ProgressBar' data-progress='%d'></div></%s>") % (
+                    tag, country, episode["id"], slug(episode["title"]), episode["id"], escape(episode["title"]),
+                    u"<a class='slider_item_season' href='#'>%s</a>" % escape(season) if season else u"", progress, tag)
+
+    def catalogue(self, country, session, query=None):
+        shows = [s for s in self.shows if not query or query.lower() in s["title"].lower()]
+        return self.page(country, u"<ul class='catalog_list'>" + u"".join(self.showItem(country, s) for s in shows) + u"</ul>", session)
+
+    def home(self, country, session):
+        latest = sorted(self.episodes.values(), key=lambda e: -e[2]["id"])[:20]
+        body = (u"<div class='js-slider-lastEp'><ul>" + u"".join(self.episodeItem(country, e, session, season=s["title"]) for _, s, e in latest) + u"</ul></div>"
+                u"<div class='js-slider-lastShow'><ul>" + u"".join(self.showItem(country, s, False) for s in self.shows[:10]) + u"</ul></div>")
+        return self.page(country, body, session)
+
+    def watchlist(self, country, session):
+        episodes = [e for _, _, e in sorted(self.episodes.values(), key=lambda e: e[2]["id"])[:30]]
+        return self.page(country, u"<section>" + u"".join(self.episodeItem(country, e, session, u"div") for e in episodes) + u"</section>", session)
+
+    def collection(self, country, session, path):
+        body = u"".join((u"<div class='big-item-list_item'><a href='/%s/v2/%s/detail/%d/%s'><img src='//www.wakanim.tv/img/show/%d.jpg'></a>"
+                         u"<h3 class='big-item_title'>%s</h3></div>") % (country, path, s["id"], slug(s["title"]), s["id"], escape(s["title"]))
+                        for s in self.shows[:15])
+        return self.page(country, u"<div class='big-item-list'>" + body + u"</div>", session)
+
+    def show(self, country, show, session):
+        day, month, year = show["premiered"].split("-")[::-1]
+        body = (u"<ul><li><span class='border-list_text'><span>%s</span><span>%s</span><span>%s</span></span></li>"
+                u"<li><span class='border-list_text'>%s</span></li></ul>"
+                u"<div class='serie_description'>%s</div>") % (day, month, year, escape(show["originaltitle"]), escape(show["plot"]))
+        for season in show["seasons"]:
+            episodes = season["episodes"]
+            done = sum(1 for e in episodes if session and session["progress"].get(e["id"], 0) > 90)
+            body += (u"<section class='seasonSection'><h2 class='slider-section_title'><span>%5d%%</span> %s</h2><ul>" % (100 * done // max(len(episodes), 1), escape(season["title"]))
+                     + u"".join(self.episodeItem(country, e, session) for e in episodes) + u"</ul></section>")
+        return self.page(country, body, session)
+
+    def episode(self, country, show, episode, session, origin):
+        meta = (u"<meta property='og:description' content=\"%s\">"
+                u"<meta itemprop='duration' content='PT24M'><meta itemprop='episodeNumber' content='%d'>"
+                u"<div class='episode_description'><p>%s</p></div>") % (
+                    escape(show["plot"]), episode["number"], escape(episode.get("plot", u"Plot of %s." % episode["title"])))
+        if not session:
+            body = u"<p>This episode is reserved for our subscribers</p>"
+        elif episode.get("reactivate") and episode["id"] not in session["reactivated"]:
+            body = u"<div id='jwplayer-container'><a href='/%s/v2/svod/reactivate/%d'>reactivate</a></div>" % (country, episode["id"])
+        else:
+            body = (u"<div id='jwplayer-container'></div><script>"
+                    u"var stats = {url: \"/%s/v2/stats?idepisode=%d&lang=%s&idserie=%d\",};"
+                    u"jwplayer(\"jwplayer-container\").setup({file: \"%s/stream/%d/manifest.mpd\", type: \"dash\", autostart: (autoplay) ? \"true\" : \"false\","
+                    u" drm: {widevine: {url: \"%s/license\", headers: [{name: \"Authorization\", value: \"Bearer standin\"}]}}});</script>") % (
+                        country, episode["id"], country, show["id"], origin, episode["id"], origin)
+        return self.page(country, meta + body, session)
+
+    def authorize(self, country, session):
+        return self.page(country, (u"<form action='/%s/v2/client/authorizewebclient' method='post'>"
+                                   u"<input name='__RequestVerificationToken' type='hidden' value='standin'></form>") % country, None)
+
+
+def slug(title):
+    return u"-".join(u"".join(c if c.isalnum() else u" " for c in title.lower()).split())
+
+
+def generated(settings, offset):
+    """Shows created from counts, e.g. {"shows": 200, "seasons": 2, "episodes": 12}
+    """
+    rnd = random.Random(settings.get("seed", 0))
+    shows = []
+    episode = 100000
+    for i in range(settings.get("shows", 100)):
+        show = offset + i + 1
+        year = rnd.randint(2010, 2020)
+        seasons = []
+        for s in range(settings.get("seasons", 1)):
+            episodes = []
+            for e in range(settings.get("episodes", 12)):
+                episode += 1
+                episodes.append({"id": episode, "number": e + 1, "title": u"Episode %d" % (e + 1),
+                                 "reactivate": rnd.random() < settings.get("reactivate", 0.05)})
+            seasons.append({"title": u"Season %d" % (s + 1), "episodes": episodes})
+        shows.append({"id": show, "title": u"Show %d" % show, "originaltitle": u"Original %d" % show,
+                      "year": str(year), "premiered": "%d-04-01" % year, "rating": rnd.choice((4, 6, 8, 10)),
+                      "plot": u"Plot of show %d." % show, "seasons": seasons})
+    return shows
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Request handler of the stand-in, site and faults are set on the server
+    """
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def do_GET(self):
+        self.handle_request(None)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        self.handle_request(self.rfile.read(length) if length else b"")
+
+    def count(self, key):
+        with self.server.lock:
+            self.server.stats[key] = self.server.stats.get(key, 0) + 1
+
+    def handle_request(self, data):
+        url = urlsplit(self.path)
+        if url.path == "/_standin/stats":
+            with self.server.lock:
+                return self.send(200, json.dumps(self.server.stats).encode("utf-8"), "application/json")
+
+        self.count("requests")
+        latency, fault = self.server.faults.draw()
+        if latency:
+            time.sleep(latency)
+        if fault == "error":
+            self.count("errors")
+            return self.send(503, b"Service Unavailable", "text/plain")
+
+        try:
+            status, body, headers = self.route(url, data)
+        except (KeyError, ValueError, IndexError, StopIteration):
+            status, body, headers = 404, u"Not Found", {}
+        self.count("status %d" % status)
+        self.send(status, body.encode("utf-8"), headers.pop("Content-Type", "text/html; charset=utf-8"), headers, fault)
+
+    def route(self, url, data):
+        """Status, body and headers of a request
+        """
+        site = self.server.site
+        token = None
+        for part in (self.headers.get("Cookie") or "").split(";"):
+            name, _, value = part.strip().partition("=")
+            if name == COOKIE:
+                token = value
+        session = site.session(token)
+        form = dict(parse_qsl(data.decode("utf-8"), True)) if data and data[:1] != b"{" else {}
+        parts = [unquote(p) for p in url.path.split("/") if p]
+        country = parts[0] if parts else "de"
+        path = "/".join(parts[1:])
+
+        if path.startswith("stream/") or path == "license":
+            return 200, u"<MPD></MPD>", {"Content-Type": "application/dash+xml"}
+        if path == "v2/account/login":
+            token = site.login(form.get("Username"), form.get("Password"))
+            if not token:
+                return 200, site.page(country, u"<form class='login'></form>", None), {}
+            self.count("logins")
+            target = dict(parse_qsl(url.query)).get("ReturnUrl") or "/%s/v2" % country
+            return 302, u"", {"Location": target, "Set-Cookie": "%s=%s; Path=/" % (COOKIE, token)}
+        if session and not session["authorized"]:
+            if path == "v2/client/generatetokenwebclient":
+                self.count("2fa")
+                return 200, u"{}", {"Content-Type": "application/json"}
+            return 200, site.authorize(country, session), {}
+        if path == "v2/svod/saveplaytimeprogress":
+            report = json.loads(data.decode("utf-8"))
+            if session:
+                session["progress"][int(report["EpisodeId"])] = int(100 * float(report["PlayTime"]) / float(report["Duration"]))
+            self.count("progress reports")
+            return 200, u"{}", {"Content-Type": "application/json"}
+        if path.startswith("v2/svod/reactivate/"):
+            if session:
+                session["reactivated"].add(int(parts[4]))
+                self.count("reactivations")
+            return 200, site.page(country, u"<p>ok</p>", session), {}
+
+        if path == "v2":
+            return 200, site.home(country, session), {}
+        if path == "v2/catalogue":
+            return 200, site.catalogue(country, session), {}
+        if path == "v2/catalogue/search":
+            return 200, site.catalogue(country, session, form.get("search", "")), {}
+        if path == "v2/watchlist":
+            return 200, site.watchlist(country, session) if session else site.page(country, u"", None), {}
+        if path in ("v2/collection", "v2/mydownloads"):
+            return 200, site.collection(country, session, path[3:]) if session else site.page(country, u"", None), {}
+        if path.startswith("v2/catalogue/show/"):
+            show = int(parts[4])
+            return 200, site.show(country, next(s for s in site.shows if s["id"] == show), session), {}
+        if path.startswith("v2/catalogue/episode/"):
+            show, _, episode = site.episodes[int(parts[4])]
+            origin = "http://%s" % self.headers.get("Host")
+            return 200, site.episode(country, show, episode, session, origin), {}
+        return 404, u"Not Found", {}
+
+    def send(self, status, body, content_type, headers=None, fault=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if fault == "truncate":
+            self.send_header("Connection", "close")
+        self.end_headers()
+
+        if fault == "truncate":
+            self.count("truncated")
+            self.wfile.write(body[:len(body) // 2])
+            self.close_connection = True
+        elif fault == "drip":
+            self.count("dripped")
+            chunk = max(self.server.faults.drip_rate // 10, 1)
+            for i in range(0, len(body), chunk):
+                self.wfile.write(body[i:i + chunk])
+                self.wfile.flush()
+                time.sleep(0.1)
+        else:
+            self.wfile.write(body)
+
+
+class StandIn(object):
+    """Stand-in server running in a thread
+    """
+    def __init__(self, fixtures=None, faults=None, port=0, verbose=False):
+        with open(fixtures or FIXTURES, "r") as f:
+            site = Site(json.load(f))
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.server.daemon_threads = True
+        self.server.site    = site
+        self.server.faults  = faults or Faults()
+        self.server.verbose = verbose
+        self.server.stats   = {}
+        self.server.lock    = threading.Lock()
+        self.site   = site
+        self.origin = "http://127.0.0.1:%d" % self.server.server_address[1]
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def stats(self):
+        with self.server.lock:
+            return dict(self.server.stats)
+
+
+def options(parser):
+    """Add fault options to an argument parser
+    """
+    parser.add_argument("--fixtures", default=FIXTURES, help="fixture file, default %(default)s")
+    parser.add_argument("--latency", default="fixed:0", help="fixed:S, uniform:A,B, exp:MEAN or lognormal:MU,SIGMA")
+    parser.add_argument("--errors", type=float, default=0.0, help="share of 503 responses")
+    parser.add_argument("--truncate", type=float, default=0.0, help="share of responses cut after half of the body")
+    parser.add_argument("--drip", type=float, default=0.0, help="share of slowly sent responses")
+    parser.add_argument("--drip-rate", type=int, default=4096, help="bytes per second of slow responses")
+    parser.add_argument("--seed", type=int, default=None, help="seed of the injected faults")
+
+
+def faults(opts):
+    return Faults(Latency(opts.latency), opts.errors, opts.truncate, opts.drip, opts.drip_rate, opts.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    options(parser)
+    opts = parser.parse_args()
+
+    standin = StandIn(opts.fixtures, faults(opts), opts.port, opts.verbose)
+    print("Stand-in of www.wakanim.tv at %s with %d shows, user '%s'" % (standin.origin, len(standin.site.shows), standin.site.user))
+    try:
+        standin.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(json.dumps(standin.stats(), indent=1, sort_keys=True))
+
+
+if __name__ == "__main__":
+    main()